@@ -0,0 +1,451 @@
+"""
+numpy counts the node labels of every tree for a lower bound of the graph edit
+distances of all pairs of trees, which is shown at once.
+scipy approximates the graph edit distances with a bipartite assignment of the nodes,
+which is an upper bound of the exact distance, calculated chunk by chunk by the
+worker_pool.
+threading refines the approximation towards the exact distances in the background,
+with a job of distance_shards, whose most uncertain shards are calculated first by the
+worker_pool.
+This module does not depend on streamlit.
+"""
+import threading
+import time
+from functools import partial
+from pathlib import Path
+from typing import Union
+
+import networkx as nx
+import numpy as np
+import numpy.typing as npt
+from scipy.optimize import linear_sum_assignment
+
+from condensed_distance import (
+    CondensedDistanceMatrix,
+    condensed_column_max,
+    condensed_pairs,
+)
+from distance_shards import DistanceJob, compute_shard
+from file_lock import POLL_SECONDS
+from graph_edit_distance import node_label
+from worker_pool import WorkerPool, get_worker_pool
+
+# Pairs of the shards of a refinement, much smaller than SHARD_PAIRS of the distance
+# shards, so that the most uncertain pairs are refined first and the versions follow
+# each other closely
+REFINE_SHARD_PAIRS = 16
+# Pairs, whose upper bound a worker calculates at once
+UPPER_BOUND_CHUNK_PAIRS = 128
+# Cost of the assignments, that the edit path must not take, like moving the root
+_FORBIDDEN = 1e6
+
+
+class TreeProfile:
+    """
+    The parts of a tree, that the bounds need, as arrays. The root is node 0.
+    """
+
+    def __init__(self, graph: nx.DiGraph, label_ids: dict[str, int]):
+        nodes = ["0"] + [node for node in graph if node != "0"]
+        index = {node: position for position, node in enumerate(nodes)}
+        self.labels = np.array(
+            [
+                label_ids.setdefault(node_label(graph.nodes[node]), len(label_ids))
+                for node in nodes
+            ]
+        )
+        self.degrees = np.array([graph.degree(node) for node in nodes])
+        edges = np.array(
+            [(index[parent], index[child]) for parent, child in graph.edges()],
+            dtype=np.int64,
+        ).reshape(-1, 2)
+        self.sources, self.targets = edges[:, 0], edges[:, 1]
+        self.edge_codes = np.sort(self.sources * len(nodes) + self.targets)
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+
+def assignment_distance(tree: TreeProfile, other: TreeProfile) -> float:
+    """
+    Cost of the edit path, that the bipartite assignment of the nodes induces, which
+    is an upper bound of the graph edit distance. The nodes are assigned by their label
+    and number of edges, the roots are always substituted, like in tree_distance.
+    Substituted edges are free, every other edge is deleted or inserted.
+    """
+    n, m = len(tree), len(other)
+    costs = np.full((n + m, n + m), _FORBIDDEN)
+    costs[:n, :m] = (tree.labels[:, np.newaxis] != other.labels) + np.abs(
+        tree.degrees[:, np.newaxis] - other.degrees
+    ) / 2
+    costs[0, 1:m] = costs[1:n, 0] = _FORBIDDEN
+    costs[np.arange(n), m + np.arange(n)] = 1 + tree.degrees / 2
+    costs[n + np.arange(m), np.arange(m)] = 1 + other.degrees / 2
+    costs[0, m], costs[n, 0] = _FORBIDDEN, _FORBIDDEN
+    costs[n:, m:] = 0
+    rows, columns = linear_sum_assignment(costs)
+    mapping = np.full(n, -1)
+    substituted = (rows < n) & (columns < m)
+    mapping[rows[substituted]] = columns[substituted]
+    node_cost = (
+        np.count_nonzero(
+            tree.labels[rows[substituted]] != other.labels[columns[substituted]]
+        )
+        + n
+        + m
+        - 2 * np.count_nonzero(substituted)
+    )
+    sources, targets = mapping[tree.sources], mapping[tree.targets]
+    mapped = (sources >= 0) & (targets >= 0)
+    kept = np.count_nonzero(
+        np.isin(sources[mapped] * m + targets[mapped], other.edge_codes)
+    )
+    edge_cost = len(tree.sources) + len(other.sources) - 2 * kept
+    return float(node_cost + edge_cost)
+
+
+def tree_profiles(graphs: list[nx.DiGraph]) -> tuple[list[TreeProfile], int]:
+    """
+    The profiles of all trees, whose labels share their ids, and the number of labels.
+    """
+    label_ids: dict[str, int] = {}
+    profiles = [TreeProfile(graph, label_ids) for graph in graphs]
+    return profiles, len(label_ids)
+
+
+def lower_bounds(profiles: list[TreeProfile], n_labels: int) -> npt.NDArray[np.float32]:
+    """
+    Lower bounds of the graph edit distances of all pairs of trees, in condensed order.
+    They count the nodes, that can't be substituted for free, as no node of the other
+    tree has their label, and the difference of the numbers of edges. Every row of the
+    condensed matrix is calculated at once from the label counts.
+    """
+    n_trees = len(profiles)
+    # Label counts without the roots, which are always substituted for each other
+    counts = np.zeros((n_trees, n_labels), dtype=np.int32)
+    for tree, profile in enumerate(profiles):
+        np.add.at(counts[tree], profile.labels[1:], 1)
+    roots = np.array([profile.labels[0] for profile in profiles])
+    sizes = np.array([len(profile) for profile in profiles])
+    edges = np.array([len(profile.sources) for profile in profiles])
+    lower = np.empty(
+        CondensedDistanceMatrix.condensed_length(n_trees), dtype=np.float32
+    )
+    for tree in range(n_trees - 1):
+        start = CondensedDistanceMatrix.row_offset(tree, n_trees)
+        others = slice(tree + 1, n_trees)
+        free = np.minimum(counts[tree], counts[others]).sum(axis=1)
+        lower[start : start + n_trees - tree - 1] = (
+            (roots[tree] != roots[others])
+            + np.maximum(sizes[tree], sizes[others])
+            - 1
+            - free
+            + np.abs(edges[tree] - edges[others])
+        )
+    return lower
+
+
+def upper_bound_chunk(
+    item: tuple[int, list[tuple[TreeProfile, TreeProfile]]]
+) -> tuple[int, npt.NDArray[np.float32]]:
+    """
+    Entry point of the pool workers. Returns the start of a chunk of consecutive pairs
+    in condensed order with their assignment_distance.
+    """
+    start, pairs = item
+    return start, np.array(
+        [assignment_distance(tree, other) for tree, other in pairs], dtype=np.float32
+    )
+
+
+def upper_bound_chunks(
+    profiles: list[TreeProfile], chunk_pairs: int = UPPER_BOUND_CHUNK_PAIRS
+):
+    """
+    Yields the items of upper_bound_chunk() for all pairs of trees. Every chunk is
+    pickled once, which stores the profiles of its pairs only once.
+    """
+    n_pairs = CondensedDistanceMatrix.condensed_length(len(profiles))
+    for start in range(0, n_pairs, chunk_pairs):
+        stop = min(start + chunk_pairs, n_pairs)
+        rows, columns = condensed_pairs(start, stop, len(profiles))
+        yield start, [
+            (profiles[row], profiles[column]) for row, column in zip(rows, columns)
+        ]
+
+
+def ged_bounds(
+    graphs: list[nx.DiGraph],
+) -> tuple[npt.NDArray[np.float32], npt.NDArray[np.float32]]:
+    """
+    Lower and upper bounds of the graph edit distances of all pairs of trees, in
+    condensed order, calculated in this process.
+    The upper bound is the assignment_distance.
+    """
+    profiles, n_labels = tree_profiles(graphs)
+    upper = np.empty(
+        CondensedDistanceMatrix.condensed_length(len(graphs)), dtype=np.float32
+    )
+    for start, values in map(upper_bound_chunk, upper_bound_chunks(profiles)):
+        upper[start : start + len(values)] = values
+    return lower_bounds(profiles, n_labels), upper
+
+
+class AnytimeDistanceMatrix:
+    """
+    Graph edit distances of a forest, which are available at once as an approximation
+    and become exact shard by shard in a background thread.
+    The first version holds the lower bounds, which only need the label counts of the
+    trees. The background thread first replaces them by the upper bounds of
+    assignment_distance(), chunk by chunk in the worker pool, as these are closer to
+    the exact distances. Then the exact distances are calculated by a DistanceJob with
+    small shards, so standalone workers share the work and an interrupted refinement
+    resumes where it stopped. Every chunk of upper bounds and every batch of completed
+    shards increments the version.
+    The most uncertain shards are refined first: shards with pairs, whose bounds enclose
+    the eps of the clustering, as their refinement may change the clusters, and then
+    the shards with the widest bounds.
+    Once every shard is completed, the job is assembled into a CondensedDistanceMatrix.
+    A version is shown as a CondensedDistanceMatrix held in memory, that stays pinned
+    until a refresh asks for the latest version, so reruns reuse the artifacts computed
+    from it. Its fingerprint is the path and the version, see version_fingerprint().
+    All methods are thread safe.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        graphs: list[nx.DiGraph],
+        pool: WorkerPool = None,  # type: ignore
+        shard_pairs: int = REFINE_SHARD_PAIRS,
+    ):
+        self.path = Path(path)
+        self.job = DistanceJob.create(path, graphs, shard_pairs)
+        self.pool = pool or get_worker_pool()
+        self.profiles, n_labels = tree_profiles(graphs)
+        self.lower = lower_bounds(self.profiles, n_labels)
+        # NaN, until the upper bound of the pair is calculated
+        self.upper = np.full_like(self.lower, np.nan)
+        self.distances = self.lower.copy()
+        self.exact = np.zeros(len(self.lower), dtype=bool)
+        self.version = 0
+        self.eps: Union[float, None] = None
+        # Directory of the profile capture of the current rerun, see profiling
+        self.profile_directory: Union[Path, None] = None
+        self.result: Union[CondensedDistanceMatrix, None] = None
+        self._pending = set(range(self.job.n_shards))
+        self._snapshot: Union[tuple[int, CondensedDistanceMatrix], None] = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread: Union[threading.Thread, None] = None
+        # Shards of an interrupted refinement
+        self.load_shards()
+
+    @property
+    def n_trees(self) -> int:
+        return self.job.n_trees
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self.n_trees, self.n_trees
+
+    @property
+    def progress(self) -> float:
+        """
+        Share of the shards, whose distances are exact.
+        """
+        with self._lock:
+            return 1 - len(self._pending) / max(self.job.n_shards, 1)
+
+    @property
+    def bounds_progress(self) -> float:
+        """
+        Share of the pairs, whose upper bound is calculated.
+        """
+        with self._lock:
+            return 1 - np.count_nonzero(np.isnan(self.upper)) / max(len(self.upper), 1)
+
+    @property
+    def refining(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def set_eps(self, eps: float):
+        """
+        The eps of the clustering, around which the next shards are refined.
+        """
+        self.eps = eps
+
+    def snapshot(self, refresh: bool = False) -> tuple[int, CondensedDistanceMatrix]:
+        """
+        The pinned version and its distances, scaled column wise like a finalized
+        matrix. The latest version is pinned on first use and on refresh.
+        """
+        with self._lock:
+            if self._snapshot is not None and not refresh:
+                return self._snapshot
+            if self._snapshot is not None and self._snapshot[0] == self.version:
+                return self._snapshot
+            version, distances = self.version, self.distances.copy()
+        matrix = CondensedDistanceMatrix.in_memory(distances, self.n_trees)
+        with self._lock:
+            if self._snapshot is None or self._snapshot[0] < version:
+                self._snapshot = (version, matrix)
+            return self._snapshot
+
+    def load_shards(self) -> bool:
+        """
+        Replaces the approximation by the shards completed since the last call, also
+        those of other processes, and increments the version. Pairs, whose graph edit
+        distance timed out without a result, keep their bound.
+        Returns whether any shard was completed.
+        """
+        completed = {}
+        for shard in sorted(self._pending):
+            try:
+                completed[shard] = np.load(self.job.shard_path(shard))
+            except FileNotFoundError:
+                continue
+        if not completed:
+            return False
+        with self._lock:
+            for shard, values in completed.items():
+                start, stop = self.job.shard_range(shard)
+                calculated = ~np.isnan(values)
+                self.distances[start:stop][calculated] = values[calculated]
+                self.exact[start:stop] |= calculated
+                self._pending.discard(shard)
+            self.version += 1
+        return True
+
+    def next_shards(self, count: int) -> list[int]:
+        """
+        The count most uncertain shards, that are not completed yet.
+        The bounds are scaled like the entries of the snapshot, an eps is enclosed, if
+        it lies between the bounds of either of the two entries of a pair.
+        """
+        with self._lock:
+            pending = sorted(self._pending)
+            distances = self.distances.copy()
+        if not pending:
+            return []
+        scale = condensed_column_max(distances, self.n_trees)
+        rows, columns = condensed_pairs(0, len(distances), self.n_trees)
+        smaller = np.minimum(scale[rows], scale[columns])
+        larger = np.maximum(scale[rows], scale[columns])
+        width = (self.upper - self.lower) / smaller
+        if self.eps is None:
+            encloses = np.zeros(len(distances), dtype=bool)
+        else:
+            encloses = (self.lower / larger <= self.eps) & (
+                self.eps <= self.upper / smaller
+            )
+        starts = np.arange(self.job.n_shards) * self.job.shard_pairs
+        enclosing = np.add.reduceat(encloses.astype(np.int64), starts)[pending]
+        widths = np.add.reduceat(width, starts)[pending]
+        order = np.lexsort((-widths, -enclosing))
+        return [pending[position] for position in order[:count]]
+
+    def start(self):
+        """
+        Starts the refinement in a background thread, unless it is running already.
+        """
+        with self._lock:
+            if self._thread is None and not self._stopped.is_set():
+                self._thread = threading.Thread(target=self.refine, daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        """
+        Stops the refinement after the current batch.
+        """
+        self._stopped.set()
+
+    def calculate_upper_bounds(self):
+        """
+        Replaces the lower bounds by the upper bounds, chunk by chunk in the worker
+        pool. Exact distances of completed shards are kept.
+        """
+        for start, values in self.pool.map_unordered(
+            upper_bound_chunk, upper_bound_chunks(self.profiles)
+        ):
+            stop = start + len(values)
+            with self._lock:
+                self.upper[start:stop] = values
+                self.distances[start:stop] = np.where(
+                    self.exact[start:stop], self.distances[start:stop], values
+                )
+                self.version += 1
+            if self._stopped.is_set():
+                return
+
+    def refine(self):
+        """
+        Calculates the upper bounds and then the most uncertain shards, a batch of one
+        shard per worker at a time, until the job is complete, and assembles it.
+        """
+        try:
+            self.calculate_upper_bounds()
+        except RuntimeError:
+            # The pool was shut down with the process
+            return
+        while not self._stopped.is_set():
+            self.load_shards()
+            if self.job.complete():
+                self.result = self.job.assemble()
+                self.load_shards()
+                # Later reruns load the assembled file instead
+                forget_anytime_matrix(self)
+                return
+            worker = partial(
+                compute_shard,
+                self.job.path,
+                profile_directory=self.profile_directory,
+            )
+            try:
+                calculated = any(
+                    self.pool.map_unordered(
+                        worker, self.next_shards(self.pool.processes)
+                    )
+                )
+            except RuntimeError:
+                # The pool was shut down with the process
+                return
+            if not calculated:
+                # The shards are calculated by other processes
+                time.sleep(POLL_SECONDS)
+
+
+def version_fingerprint(path: Path, version: Union[int, str]) -> str:
+    """
+    Fingerprint of a version of the matrix refined towards path, for cache keys.
+    Versions of the same matrix share the prefix version_fingerprint(path, "").
+    """
+    return f"{Path(path)}@{version}"
+
+
+# Matrices refined by this process, shared by all sessions
+_anytime_matrices: dict[Path, AnytimeDistanceMatrix] = {}
+_anytime_matrices_lock = threading.Lock()
+
+
+def get_anytime_matrix(path: Path, graphs: list[nx.DiGraph]) -> AnytimeDistanceMatrix:
+    """
+    The matrix refined towards path, which is created and started on first use.
+    """
+    with _anytime_matrices_lock:
+        matrix = _anytime_matrices.get(Path(path))
+        if matrix is None:
+            matrix = _anytime_matrices[Path(path)] = AnytimeDistanceMatrix(path, graphs)
+            matrix.start()
+        return matrix
+
+
+def forget_anytime_matrix(matrix: AnytimeDistanceMatrix):
+    """
+    Drops a matrix, whose refinement is finished, from the matrices of the process.
+    """
+    with _anytime_matrices_lock:
+        for path in [
+            key for key, value in _anytime_matrices.items() if value is matrix
+        ]:
+            del _anytime_matrices[path]
@@ -0,0 +1,371 @@
+"""
+Batch analysis of a grid of forest configurations, without streamlit:
+    python batch_analysis.py --datasets Iris Digits --n-estimators 20 50 100 \
+        --max-depth 5 10 --seeds 1 2 3 --output report.parquet
+Every configuration runs the pipeline of the dashboard: training, tree extraction,
+distance matrix, DBSCAN, embedding and the metrics. The result is one Parquet report
+with a row per configuration and cluster.
+argparse provides the command line, itertools builds the grid and worker_pool runs the
+configurations in parallel processes.
+Configurations of the same dataset, depth and seed are analyzed by the same process and
+share their artifacts: the smaller forests are slices of the largest one, see
+forest_growth, so every tree is trained, extracted, scored and compared once, and the
+density hierarchy of a distance matrix is shared by all values of eps.
+pandas writes the report with pyarrow.
+"""
+import argparse
+import itertools
+import time
+from pathlib import Path
+from typing import Union
+
+import numpy as np
+import pandas as pd
+from scipy.spatial.distance import squareform
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.model_selection import train_test_split
+
+from condensed_distance import remove_possible_nans_condensed
+from data_loader import DataLoader
+from dataframe_operator import DataframeOperator
+from density_hierarchy import DensityHierarchy
+from embedding_backends import EMBEDDING_BACKENDS, ClassicalMDSBackend
+from forest_growth import resize_forest
+from graph_edit_distance import tree_distance
+from memory_manager import array_fingerprint
+from prediction_distance import disagreement_distances, tree_predictions
+from random_forest_modeller import (
+    DISAGREEMENT_METRIC,
+    DISTANCE_METRICS,
+    GED_METRIC,
+    WL_METRIC,
+    RFmodeller,
+)
+from silhouette import silhouette_scores
+from weisfeiler_lehman import wl_feature_matrix, wl_l1_distances
+from worker_pool import WorkerPool
+
+BATCH_DATASETS = ("Iris", "Digits")
+# DBSCAN parameters of the datasets, see RFmodeller.calculate_tree_clusters
+DBSCAN_EPS = {"Iris": 0.12, "Digits": 0.75}
+DBSCAN_MIN_SAMPLES = 2
+# Per tree metrics, that are averaged per cluster, and their names in the report
+CLUSTER_METRICS = {
+    "accuracy": "mean_accuracy",
+    "macro avg_f1-score": "mean_macro_f1",
+    "n_leaves": "mean_n_leaves",
+    "depth": "mean_depth",
+}
+
+
+def lineage_tasks(args: argparse.Namespace) -> list[dict]:
+    """
+    Splits the grid into tasks of the configurations, whose forests are slices of the
+    same forest.
+    """
+    return [
+        {
+            "dataset": dataset,
+            "max_depth": max_depth,
+            "seed": seed,
+            "n_estimators": sorted(set(args.n_estimators)),
+            "metrics": args.metrics,
+            "eps": args.eps or [DBSCAN_EPS[dataset]],
+            "min_samples": args.min_samples,
+            "embedding": args.embedding,
+        }
+        for dataset, max_depth, seed in itertools.product(
+            args.datasets, args.max_depth, args.seeds
+        )
+    ]
+
+
+def build_modeller(
+    dataset: str, n_estimators: int, max_depth: Union[int, None], seed: int
+) -> RFmodeller:
+    """
+    RFmodeller with the largest forest of a task, trained like in the dashboard, but
+    with the seed of the configuration. The pipeline relies on the streamlit session
+    state, so its steps are called one by one.
+    """
+    dl = DataLoader(dataset)
+    rfm = RFmodeller.__new__(RFmodeller)
+    rfm.data, rfm.features = dl.data, list(dl.features)
+    rfm.target_column, rfm.target_names = dl.target_column, list(dl.target_names)
+    rfm.data_choice = rfm.dataset_key = dataset
+    rfm.imported_model = None  # type: ignore
+    rfm.X_train, rfm.X_test, rfm.y_train, rfm.y_test = train_test_split(
+        dl.data[dl.features].values,
+        dl.data[dl.target_column].values,
+        test_size=0.3,
+        random_state=123,
+    )
+    # The pool runs one task per process, so the trees are not fitted in parallel
+    rfm.model = RandomForestClassifier(
+        n_estimators=n_estimators,
+        max_depth=max_depth,
+        random_state=seed,
+        oob_score=True,
+        n_jobs=1,
+    ).fit(rfm.X_train, rfm.y_train)
+    return rfm
+
+
+def ged_matrix(graphs: list) -> np.ndarray:
+    """
+    Raw graph edit distances of all pairs of trees, as a dense symmetric matrix.
+    The slices of the largest forest are scaled with scale_columns().
+    """
+    n_trees = len(graphs)
+    distances = np.zeros((n_trees, n_trees), dtype=np.float32)
+    for row, column in zip(*np.triu_indices(n_trees, k=1)):
+        distances[row, column] = distances[column, row] = tree_distance(
+            graphs[row], graphs[column]
+        )
+    return distances
+
+
+def scale_columns(raw_distances: np.ndarray) -> np.ndarray:
+    """
+    Replaces NaNs and scales every column by its maximum, like
+    CondensedDistanceMatrix.finalize() does for the dashboard.
+    """
+    n_trees = len(raw_distances)
+    values = squareform(raw_distances, checks=False).astype(np.float32)
+    remove_possible_nans_condensed(values, n_trees)
+    distances = squareform(values)
+    column_max = distances.max(axis=0)
+    column_max[column_max == 0] = 1
+    return distances / column_max
+
+
+def distance_matrices(rfm: RFmodeller, metric: str, n_estimators: list[int]):
+    """
+    Yields n_estimators and the distance matrix of its forest, for every forest size.
+    Everything, that doesn't depend on the size, is calculated once for the largest
+    forest.
+    """
+    if metric == GED_METRIC:
+        raw_distances = ged_matrix(rfm.directed_graphs)
+        for n_trees in n_estimators:
+            yield n_trees, scale_columns(raw_distances[:n_trees, :n_trees])
+    elif metric == DISAGREEMENT_METRIC:
+        x = rfm.data[rfm.features].values.astype(np.float32)
+        predictions = tree_predictions(rfm.model, x)
+        for n_trees in n_estimators:
+            yield n_trees, disagreement_distances(
+                predictions[:n_trees], len(rfm.model.classes_)
+            )
+    elif metric == WL_METRIC:
+        # The L1 distances are normalized per forest, the label counts are shared
+        features = wl_feature_matrix(rfm.directed_graphs)
+        for n_trees in n_estimators:
+            yield n_trees, wl_l1_distances(features[:n_trees])
+    else:
+        raise ValueError(f"batch_analysis: Unknown distance metric {metric}.")
+
+
+def cluster_rows(
+    configuration: dict,
+    forest_accuracy: float,
+    labels: np.ndarray,
+    distance_matrix: np.ndarray,
+    embedding: np.ndarray,
+    tree_df: pd.DataFrame,
+) -> list[dict]:
+    """
+    Report rows of one configuration, one per cluster and one for the noise (cluster
+    -1), if there is any. The metrics of the whole configuration are repeated in
+    every row.
+    """
+    _, silhouette, cluster_silhouettes = silhouette_scores(distance_matrix, labels)
+    cluster_df = tree_df[list(CLUSTER_METRICS)].astype(float).assign(cluster=labels)
+    cluster_df[["component_1", "component_2"]] = embedding
+    cluster_means = cluster_df.groupby("cluster").mean()
+    cluster_sizes = cluster_df.groupby("cluster").size()
+    rows = []
+    for cluster, means in cluster_means.iterrows():
+        rows.append(
+            {
+                **configuration,
+                "forest_accuracy": forest_accuracy,
+                "n_clusters": len(cluster_silhouettes),
+                "trees_in_clusters": 100 * float(np.mean(labels > -1)),
+                "silhouette": silhouette,
+                "cluster": cluster,
+                "cluster_trees": int(cluster_sizes[cluster]),
+                "cluster_silhouette": cluster_silhouettes.get(cluster, np.nan),
+                **{name: means[column] for column, name in CLUSTER_METRICS.items()},
+                "component_1": means["component_1"],
+                "component_2": means["component_2"],
+            }
+        )
+    return rows
+
+
+def analyze_lineage(task: dict) -> list[dict]:
+    """
+    Entry point of the pool workers. Analyzes all configurations of a task.
+    """
+    rfm = build_modeller(
+        task["dataset"], max(task["n_estimators"]), task["max_depth"], task["seed"]
+    )
+    rfm.directed_graphs = [
+        rfm.estimator_to_graph(estimator) for estimator in rfm.model.estimators_
+    ]
+    dfo = DataframeOperator.__new__(DataframeOperator)
+    dfo.rfm, dfo.features = rfm, rfm.features
+    tree_df = dfo.get_tree_df_from_model(rfm, rfm.features)
+    forest_accuracies = {
+        n_trees: resize_forest(rfm.model, n_trees, rfm.X_train, rfm.y_train)[0].score(
+            rfm.X_test, rfm.y_test
+        )
+        for n_trees in task["n_estimators"]
+    }
+    embedding_backend = EMBEDDING_BACKENDS.get(task["embedding"], ClassicalMDSBackend)()
+
+    rows = []
+    for metric in task["metrics"]:
+        for n_trees, distance_matrix in distance_matrices(
+            rfm, metric, task["n_estimators"]
+        ):
+            embedding = embedding_backend.embed(
+                distance_matrix, array_fingerprint(distance_matrix)
+            )
+            density_hierarchy = DensityHierarchy(
+                distance_matrix, task["min_samples"][0]
+            )
+            for min_samples in task["min_samples"]:
+                density_hierarchy = density_hierarchy.with_min_samples(min_samples)
+                for eps in task["eps"]:
+                    configuration = {
+                        "dataset": task["dataset"],
+                        "n_estimators": n_trees,
+                        "max_depth": task["max_depth"],
+                        "seed": task["seed"],
+                        "metric": metric,
+                        "eps": eps,
+                        "min_samples": min_samples,
+                        "embedding": embedding_backend.name,
+                    }
+                    rows += cluster_rows(
+                        configuration,
+                        forest_accuracies[n_trees],
+                        density_hierarchy.labels(eps),
+                        distance_matrix,
+                        embedding,
+                        tree_df.iloc[:n_trees],
+                    )
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Clusters the trees of a grid of forest configurations and reports "
+        "the silhouette scores, the share of trees in clusters and the performance "
+        "of every cluster."
+    )
+    parser.add_argument(
+        "--datasets", nargs="+", default=["Iris"], choices=BATCH_DATASETS
+    )
+    parser.add_argument("--n-estimators", nargs="+", type=int, default=[20, 50, 100])
+    parser.add_argument(
+        "--max-depth",
+        nargs="+",
+        type=lambda value: None if value == "None" else int(value),
+        default=[5, 10],
+        help="Use None for fully grown trees.",
+    )
+    parser.add_argument("--seeds", nargs="+", type=int, default=[123])
+    parser.add_argument(
+        "--metrics",
+        nargs="+",
+        default=[WL_METRIC],
+        choices=DISTANCE_METRICS,
+        help="The graph edit distance takes up to half a second per pair of trees.",
+    )
+    parser.add_argument(
+        "--eps",
+        nargs="+",
+        type=float,
+        default=None,
+        help="Defaults to the eps of the dashboard for each dataset.",
+    )
+    parser.add_argument(
+        "--min-samples", nargs="+", type=int, default=[DBSCAN_MIN_SAMPLES]
+    )
+    parser.add_argument(
+        "--embedding",
+        default=ClassicalMDSBackend.name,
+        choices=list(EMBEDDING_BACKENDS),
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=None,
+        help="Processes analyzing the configurations, defaults to the number of CPUs.",
+    )
+    parser.add_argument("--output", type=Path, default=Path("batch_report.parquet"))
+    args = parser.parse_args()
+
+    tasks = lineage_tasks(args)
+    pool = WorkerPool(args.processes)
+    rows = []
+    start = time.perf_counter()
+    for completed, task_rows in enumerate(pool.map_unordered(analyze_lineage, tasks)):
+        rows += task_rows
+        print(
+            f"{completed + 1}/{len(tasks)} forests analyzed "
+            f"after {time.perf_counter() - start:.1f}s",
+            flush=True,
+        )
+    pool.shutdown()
+    report = (
+        pd.DataFrame(rows)
+        .astype({"max_depth": "Int64"})
+        .sort_values(
+            [
+                "dataset",
+                "max_depth",
+                "seed",
+                "metric",
+                "n_estimators",
+                "min_samples",
+                "eps",
+            ]
+        )
+    )
+    report.to_parquet(args.output, index=False)
+    print(
+        report.drop_duplicates(
+            [
+                "dataset",
+                "max_depth",
+                "seed",
+                "metric",
+                "n_estimators",
+                "min_samples",
+                "eps",
+            ]
+        )[
+            [
+                "dataset",
+                "n_estimators",
+                "max_depth",
+                "seed",
+                "metric",
+                "min_samples",
+                "eps",
+                "n_clusters",
+                "trees_in_clusters",
+                "silhouette",
+            ]
+        ].to_string(
+            index=False
+        )
+    )
+    print(f"Stored {len(report)} rows in {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,524 @@
+"""
+Benchmarks of the analysis hot paths, which run without streamlit:
+    python benchmark.py --output results.json
+    python benchmark.py --baseline baseline.json --save-baseline
+    python benchmark.py --baseline baseline.json
+The last call exits with status 1, if a benchmark got slower than the baseline by more
+than the regression threshold.
+argparse provides the command line, json stores the results and the baseline.
+sklearn creates the forests and the synthetic datasets, numpy and pandas the inputs of
+the benchmarked functions.
+stage_timer measures every run, tempfile holds the distance matrix jobs.
+scipy and sklearn measure, how well the Weisfeiler-Lehman distances and the bounds of
+anytime_distance agree with the graph edit distances.
+altair renders the chart specifications.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Callable
+
+import altair as alt
+import numpy as np
+import pandas as pd
+import sklearn
+from scipy.cluster.hierarchy import fcluster, linkage
+from scipy.spatial.distance import squareform
+from scipy.stats import spearmanr
+from sklearn.datasets import make_classification
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import adjusted_rand_score
+from sklearn.model_selection import train_test_split
+
+from anytime_distance import ged_bounds
+from condensed_distance import CondensedDistanceMatrix
+from dashboard_controller import DashboardController
+from data_loader import DataLoader
+from dataframe_operator import DataframeOperator
+from density_hierarchy import DensityHierarchy
+from distance_shards import DistanceJob, run_job
+from embedding_backends import TSNEBackend
+from graph_edit_distance import timed_tree_distance
+from memory_manager import array_fingerprint
+from nearest_trees import NearestTreeIndex
+from prediction_distance import disagreement_distances, tree_predictions
+from random_forest_modeller import GED_METRIC, RFmodeller
+from silhouette import silhouette_scores
+from stage_timer import logger, stage
+from tree_lsh import NeighborGraph
+from weisfeiler_lehman import wl_l1_distances, wl_feature_matrix
+from worker_pool import WorkerPool
+
+BENCHMARK_DATASETS = ("Iris", "Digits", "wide", "deep")
+BENCHMARK_N_ESTIMATORS = (20, 100, 1000)
+BENCHMARK_MAX_DEPTHS = (5, 10)
+# Full distance matrices are only calculated for forests up to this size, larger
+# forests are clustered and embedded on synthetic distances of the same shape
+GED_MAX_TREES = 20
+# Pairs of trees timed by the per pair graph edit distance benchmark
+GED_SAMPLE_PAIRS = 10
+# Relative slowdown of the fastest run, that counts as a regression. The fastest run is
+# compared, as it is the least disturbed by warm up and other processes.
+REGRESSION_THRESHOLD = 0.25
+# Faster benchmarks are dominated by noise and never count as a regression
+MIN_COMPARABLE_SECONDS = 0.01
+# DBSCAN parameters of the datasets, see RFmodeller.calculate_tree_clusters
+DBSCAN_EPS = {"Iris": 0.12, "Digits": 0.75}
+DBSCAN_DEFAULT_EPS = 0.5
+DBSCAN_MIN_SAMPLES = 2
+# Clusters of the hierarchical clusterings, whose agreement between two distance
+# metrics is measured
+AGREEMENT_CLUSTERS = 5
+SEED = 123
+
+
+def load_dataset(name: str) -> tuple[pd.DataFrame, list[str], str, list[str]]:
+    """
+    Returns data, features, target column and target names of a benchmark dataset.
+    Besides Iris and Digits, there are two synthetic datasets:
+    - wide: few samples with many features,
+    - deep: many samples, whose trees grow as deep as max_depth allows.
+    """
+    if name in ("Iris", "Digits"):
+        dl = DataLoader(name)
+        return dl.data, list(dl.features), dl.target_column, list(dl.target_names)  # type: ignore
+    if name == "wide":
+        shape = {"n_samples": 500, "n_features": 200, "n_informative": 20}
+    elif name == "deep":
+        shape = {"n_samples": 20000, "n_features": 10, "n_informative": 8}
+    else:
+        raise ValueError(f"benchmark: Unknown dataset {name}.")
+    x, y = make_classification(
+        n_classes=3, n_clusters_per_class=2, random_state=SEED, **shape  # type: ignore
+    )
+    features = [f"feature_{i}" for i in range(x.shape[1])]
+    data = pd.DataFrame(x, columns=features)
+    data["target"] = y
+    return data, features, "target", [f"class_{i}" for i in range(3)]
+
+
+def build_modeller(dataset: str, n_estimators: int, max_depth: int) -> RFmodeller:
+    """
+    RFmodeller with a trained forest, but without running the pipeline, which relies
+    on the streamlit session state. The pipeline steps are benchmarked one by one.
+    """
+    data, features, target_column, target_names = load_dataset(dataset)
+    rfm = RFmodeller.__new__(RFmodeller)
+    rfm.data, rfm.features = data, features
+    rfm.target_column, rfm.target_names = target_column, target_names  # type: ignore
+    rfm.data_choice = rfm.dataset_key = dataset
+    rfm.distance_metric = GED_METRIC
+    rfm.imported_model = None  # type: ignore
+    rfm.X_train, rfm.X_test, rfm.y_train, rfm.y_test = train_test_split(
+        data[features].values,
+        data[target_column].values,
+        test_size=0.3,
+        random_state=123,
+    )
+    rfm.model = RandomForestClassifier(
+        n_estimators=n_estimators, max_depth=max_depth, random_state=SEED, n_jobs=-1
+    ).fit(rfm.X_train, rfm.y_train)
+    return rfm
+
+
+def measure(
+    name: str, function: Callable, repeats: int, items: int
+) -> tuple[dict, Any]:
+    """
+    Runs the function repeatedly and returns the wall and CPU times in seconds, and
+    the return value of the last run.
+    """
+    wall, cpu = [], []
+    for _ in range(repeats):
+        with stage(name, items) as record:
+            value = function()
+        wall.append(record.wall_ms / 1e3)
+        cpu.append(record.cpu_ms / 1e3)
+    result = {
+        "benchmark": name,
+        "items": items,
+        "min_s": min(wall),
+        "median_s": float(np.median(wall)),
+        "cpu_median_s": float(np.median(cpu)),
+    }
+    return result, value
+
+
+def full_distance_matrix(
+    graphs: list, pool: WorkerPool, directory: Path
+) -> CondensedDistanceMatrix:
+    """
+    Calculates the distance matrix like the dashboard, into a new file in directory.
+    The pool is started before, so that only the first configuration pays for starting
+    the workers, like the first rerun of the dashboard.
+    """
+    path = Path(directory).joinpath(f"distance_matrix_{uuid.uuid4().hex}.npy")
+    return run_job(DistanceJob.create(path, graphs), pool)
+
+
+def metric_agreement(distances: np.ndarray, other_distances: np.ndarray) -> dict:
+    """
+    How well the condensed distances of two metrics of the same trees agree. They are
+    compared unscaled, as the column wise scaling of the dashboard is asymmetric:
+    - rank_correlation: Spearman correlation of the distances of all pairs,
+    - adjusted_rand: adjusted Rand index of the average linkage clusterings into
+      AGREEMENT_CLUSTERS clusters. DBSCAN is not compared, as its eps depends on the
+      scale of the metric.
+    Pairs without a distance count as the most distant ones.
+    """
+    condensed = [
+        np.nan_to_num(values, nan=np.nanmax(values))
+        for values in (distances, other_distances)
+    ]
+    labels = [
+        fcluster(linkage(values, "average"), AGREEMENT_CLUSTERS, "maxclust")
+        for values in condensed
+    ]
+    return {
+        "rank_correlation": float(spearmanr(*condensed).correlation),
+        "adjusted_rand": float(adjusted_rand_score(*labels)),
+    }
+
+
+def synthetic_distances(n_trees: int) -> np.ndarray:
+    """
+    Symmetric random distances in [0, 1], which replace the graph edit distances of
+    forests too large to calculate them in a benchmark.
+    """
+    rng = np.random.default_rng(SEED)
+    distances = rng.random((n_trees, n_trees))
+    distances = (distances + distances.T) / 2
+    np.fill_diagonal(distances, 0)
+    return distances
+
+
+def run_configuration(
+    dataset: str,
+    n_estimators: int,
+    max_depth: int,
+    repeats: int,
+    ged_max_trees: int,
+    pool: WorkerPool,
+    directory: Path,
+) -> list[dict]:
+    """
+    Benchmarks all hot paths for one forest. The steps build on each other like in
+    RFmodeller, the result of the last run of a step is the input of the next one.
+    Distance matrices are stored in directory.
+    """
+    rfm = build_modeller(dataset, n_estimators, max_depth)
+    results = []
+    # The graphs are extracted without the cache of RFmodeller.create_dot_trees()
+    result, rfm.directed_graphs = measure(
+        "tree extraction",
+        lambda: [
+            rfm.estimator_to_graph(estimator) for estimator in rfm.model.estimators_
+        ],
+        repeats,
+        n_estimators,
+    )
+    results.append(result)
+
+    rng = np.random.default_rng(SEED)
+    pairs = [
+        rng.choice(n_estimators, size=2, replace=False) for _ in range(GED_SAMPLE_PAIRS)
+    ]
+    result, timed_distances = measure(
+        "GED pairs",
+        lambda: [
+            timed_tree_distance(rfm.directed_graphs[i], rfm.directed_graphs[j])
+            for i, j in pairs
+        ],
+        repeats,
+        len(pairs),
+    )
+    result["timeouts"] = sum(timed_out for _, _, timed_out in timed_distances)
+    results.append(result)
+
+    x = rfm.data[rfm.features].values.astype(np.float32)
+    result, _ = measure(
+        "prediction disagreement",
+        lambda: disagreement_distances(
+            tree_predictions(rfm.model, x), len(rfm.model.classes_)
+        ),
+        repeats,
+        CondensedDistanceMatrix.condensed_length(n_estimators),
+    )
+    results.append(result)
+
+    result, _ = measure(
+        "neighbor graph",
+        lambda: NeighborGraph.from_forest(rfm.model),
+        repeats,
+        n_estimators,
+    )
+    results.append(result)
+
+    wl_result, wl_distances = measure(
+        "Weisfeiler-Lehman",
+        lambda: wl_l1_distances(wl_feature_matrix(rfm.directed_graphs)),
+        repeats,
+        CondensedDistanceMatrix.condensed_length(n_estimators),
+    )
+    results.append(wl_result)
+
+    bounds_result, (_, upper_bounds) = measure(
+        "GED bounds",
+        lambda: ged_bounds(rfm.directed_graphs),
+        repeats,
+        CondensedDistanceMatrix.condensed_length(n_estimators),
+    )
+    results.append(bounds_result)
+
+    if n_estimators <= ged_max_trees:
+        result, rfm.distance_matrix = measure(
+            "GED matrix",
+            lambda: full_distance_matrix(rfm.directed_graphs, pool, directory),
+            repeats,
+            CondensedDistanceMatrix.condensed_length(n_estimators),
+        )
+        results.append(result)
+        wl_result["ged_speedup"] = result["min_s"] / wl_result["min_s"]
+        # The graph edit distances of the job, before the scaling
+        ged_distances = rfm.distance_matrix.values
+        wl_result.update(
+            metric_agreement(ged_distances, squareform(wl_distances, checks=False))
+        )
+        # The upper bounds are the approximation, that the dashboard shows at first
+        bounds_result["ged_speedup"] = result["min_s"] / bounds_result["min_s"]
+        bounds_result.update(metric_agreement(ged_distances, upper_bounds))
+        distances = "ged"
+    else:
+        rfm.distance_matrix = synthetic_distances(n_estimators)
+        distances = "synthetic"
+
+    result, _ = measure(
+        "nearest tree index",
+        lambda: NearestTreeIndex.from_distance_matrix(rfm.distance_matrix),
+        repeats,
+        n_estimators,
+    )
+    results.append(result)
+
+    dfo = DataframeOperator.__new__(DataframeOperator)
+    dfo.rfm, dfo.features = rfm, rfm.features
+    result, dfo.tree_df = measure(
+        "tree_df",
+        lambda: dfo.get_tree_df_from_model(rfm, rfm.features),
+        repeats,
+        n_estimators,
+    )
+    results.append(result)
+
+    eps = DBSCAN_EPS.get(dataset, DBSCAN_DEFAULT_EPS)
+
+    def cluster():
+        labels = DensityHierarchy(rfm.distance_matrix, DBSCAN_MIN_SAMPLES).labels(eps)
+        return labels, silhouette_scores(rfm.distance_matrix, labels)
+
+    result, (rfm.clustering, silhouettes) = measure(
+        "DBSCAN + silhouette", cluster, repeats, n_estimators
+    )
+    results.append(result)
+    rfm.cluster_df = pd.DataFrame(
+        {"cluster": rfm.clustering, "tree": list(range(n_estimators))}
+    )
+    rfm.sample_silhouette_scores = pd.DataFrame(
+        silhouettes[0], columns=["Silhouette Score"]
+    )
+    rfm.cluster_silhouette_score, rfm.cluster_silhouette_means = silhouettes[1:]
+
+    distance_fingerprint = array_fingerprint(
+        rfm.distance_matrix.values
+        if isinstance(rfm.distance_matrix, CondensedDistanceMatrix)
+        else rfm.distance_matrix
+    )
+    backend = TSNEBackend(200.0, 30, 12.0)
+    result, embedding = measure(
+        "t-SNE",
+        lambda: backend.fit(rfm.distance_matrix, distance_fingerprint),
+        repeats,
+        n_estimators,
+    )
+    results.append(result)
+    rfm.embedding_backend = backend.name
+    rfm.embedding_df = pd.DataFrame(embedding, columns=["Component 1", "Component 2"])
+
+    dfo.tree_df = dfo.add_cluster_information_to_tree_df(rfm, rfm.features)
+    dfo.tree_df = dfo.add_grid_coordinates_to_tree_df(dfo.tree_df)
+    dfo.tree_df.attrs["embedding_backend"] = rfm.embedding_backend
+    dc = DashboardController.__new__(DashboardController)
+    dc.rfm, dc.dfo, dc.tree_df = rfm, dfo, dfo.tree_df
+    dc.dataset, dc.features = rfm.data, rfm.features
+    dc.setup_chart_encodings()
+
+    def chart_specs():
+        charts = [
+            dc.create_feature_importance_barchart("", "", top_k=10, selection=False),
+            dc.create_tsne_scatter("", "", importance=True),
+            dc.create_tsne_scatter("", ""),
+            dc.create_similarity_matrix("", ""),
+        ]
+        return [chart.to_dict() for chart in charts]
+
+    result, _ = measure("chart specs", chart_specs, repeats, 4)
+    results.append(result)
+
+    for result in results:
+        result.update(
+            dataset=dataset,
+            n_estimators=n_estimators,
+            max_depth=max_depth,
+            distances=distances,
+        )
+    return results
+
+
+def result_key(result: dict) -> tuple:
+    return (
+        result["benchmark"],
+        result["dataset"],
+        result["n_estimators"],
+        result["max_depth"],
+    )
+
+
+def compare(
+    results: list[dict], baseline: list[dict], threshold: float
+) -> pd.DataFrame:
+    """
+    Ratio of the fastest runs to the baseline, for all benchmarks in both runs.
+    """
+    baseline_times = {result_key(result): result["min_s"] for result in baseline}
+    rows = []
+    for result in results:
+        baseline_s = baseline_times.get(result_key(result))
+        if baseline_s is None:
+            continue
+        ratio = result["min_s"] / baseline_s if baseline_s > 0 else np.inf
+        rows.append(
+            {
+                **{
+                    column: result[column]
+                    for column in ("benchmark", "dataset", "n_estimators", "max_depth")
+                },
+                "baseline_s": baseline_s,
+                "min_s": result["min_s"],
+                "ratio": ratio,
+                "regression": ratio > 1 + threshold
+                and max(baseline_s, result["min_s"]) >= MIN_COMPARABLE_SECONDS,
+            }
+        )
+    return pd.DataFrame(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the analysis hot paths and compares them with a baseline."
+    )
+    parser.add_argument(
+        "--datasets", nargs="+", default=BENCHMARK_DATASETS, choices=BENCHMARK_DATASETS
+    )
+    parser.add_argument(
+        "--n-estimators", nargs="+", type=int, default=BENCHMARK_N_ESTIMATORS
+    )
+    parser.add_argument(
+        "--max-depth",
+        nargs="+",
+        type=lambda value: None if value == "None" else int(value),
+        default=BENCHMARK_MAX_DEPTHS,
+        help="Use None for fully grown trees.",
+    )
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument(
+        "--ged-max-trees",
+        type=int,
+        default=GED_MAX_TREES,
+        help="Largest forest, whose full distance matrix is calculated.",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=None,
+        help="Processes calculating the distance matrix, defaults to the number of CPUs.",
+    )
+    parser.add_argument("--output", type=Path, default=Path("benchmark_results.json"))
+    parser.add_argument("--baseline", type=Path, default=None)
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="Store the results as the new baseline instead of comparing them.",
+    )
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    parser.add_argument(
+        "--verbose", action="store_true", help="Log every run as a stage."
+    )
+    args = parser.parse_args()
+    if not args.verbose:
+        logger.setLevel(logging.WARNING)
+    # Streamlit lifts altair's limit of 5000 rows per chart as well, the heatmap of
+    # larger forests exceeds it
+    alt.data_transformers.disable_max_rows()
+
+    results = []
+    pool = WorkerPool(args.processes)
+    with tempfile.TemporaryDirectory() as directory:
+        for dataset in args.datasets:
+            for n_estimators in args.n_estimators:
+                for max_depth in args.max_depth:
+                    print(
+                        f"{dataset}, {n_estimators} trees, max_depth {max_depth}",
+                        flush=True,
+                    )
+                    results += run_configuration(
+                        dataset,
+                        n_estimators,
+                        max_depth,
+                        args.repeats,
+                        args.ged_max_trees,
+                        pool,
+                        Path(directory),
+                    )
+    pool.shutdown()
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "sklearn": sklearn.__version__,
+        },
+        "repeats": args.repeats,
+        "results": results,
+    }
+    args.output.write_text(json.dumps(report, indent=2))
+    print(pd.DataFrame(results).to_string(index=False))
+
+    if args.baseline is None:
+        return
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(report, indent=2))
+        print(f"Stored the baseline in {args.baseline}")
+        return
+    baseline = json.loads(args.baseline.read_text())
+    comparison = compare(results, baseline["results"], args.threshold)
+    if comparison.empty:
+        print("No benchmark in common with the baseline.")
+        return
+    print(comparison.to_string(index=False))
+    if comparison["regression"].any():
+        print(f"Regressions of more than {args.threshold:.0%} against {args.baseline}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
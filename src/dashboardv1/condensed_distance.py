@@ -0,0 +1,235 @@
+"""
+numpy memory maps the condensed distances from disk and assembles row blocks from them.
+os and pathlib handle the temporary file, that is renamed once it is complete.
+warnings reports an unusual number of NaNs.
+"""
+import os
+import warnings
+from pathlib import Path
+
+import numpy as np
+import numpy.typing as npt
+
+# Number of rows assembled at once, when the whole matrix is traversed
+BLOCK_ROWS = 256
+
+
+class CondensedDistanceMatrix:
+    """
+    Pairwise distance matrix of n trees, stored as the condensed upper triangle of the
+    raw (symmetric) distances in float32, followed by the scale of every column.
+    The file is memory mapped, so only the accessed parts are paged into memory.
+
+    Rows are min-max scaled per column when they are accessed. This is what sklearn's
+    MinMaxScaler does on the square matrix, as every column has a minimum of 0 on the
+    diagonal. The scaled matrix is therefore not symmetric, although the stored values are.
+
+    Consumers can treat the object like the dense scaled matrix for
+    - shape and len(),
+    - row access with an int, a slice or an array of row indices,
+    - products with a matrix via @, computed block by block,
+    - np.asarray(), which materializes the dense square and should only be used by
+      consumers that need it.
+    in_memory() wraps condensed values, that are not stored in a file, the same way.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        data = np.load(self.path, mmap_mode="r")
+        # m = n * (n - 1) / 2 condensed values are followed by n column scales
+        n_trees = int((np.sqrt(1 + 8 * data.shape[0]) - 1) / 2)
+        self.n_trees = n_trees
+        self.values = data[: n_trees * (n_trees - 1) // 2]
+        self.column_scale = np.array(data[len(self.values) :])
+        self.shape = (n_trees, n_trees)
+        self.dtype = np.dtype(np.float32)
+
+    @classmethod
+    def in_memory(
+        cls, values: npt.NDArray[np.float32], n_trees: int
+    ) -> "CondensedDistanceMatrix":
+        """
+        The matrix of condensed values held in memory, e.g. a version of an
+        approximation, scaled like a finalized file.
+        """
+        matrix = cls.__new__(cls)
+        matrix.path = None
+        matrix.n_trees = n_trees
+        matrix.values = values
+        matrix.column_scale = condensed_column_max(values, n_trees)
+        matrix.shape = (n_trees, n_trees)
+        matrix.dtype = np.dtype(np.float32)
+        return matrix
+
+    @staticmethod
+    def condensed_length(n_trees: int) -> int:
+        return n_trees * (n_trees - 1) // 2
+
+    @staticmethod
+    def row_offset(row: int, n_trees: int) -> int:
+        """
+        Position of the distance between row and row + 1 in the condensed values.
+        """
+        return n_trees * row - row * (row + 1) // 2
+
+    @classmethod
+    def create(cls, path: Path, n_trees: int) -> npt.NDArray[np.float32]:
+        """
+        Creates a writable memory mapped file for n_trees next to path. The caller fills
+        the condensed values row by row and passes the array to finalize().
+        """
+        return np.lib.format.open_memmap(
+            temporary_path(path),
+            mode="w+",
+            dtype=np.float32,
+            shape=(cls.condensed_length(n_trees) + n_trees,),
+        )
+
+    @classmethod
+    def finalize(
+        cls, path: Path, data: npt.NDArray[np.float32], n_trees: int
+    ) -> "CondensedDistanceMatrix":
+        """
+        Replaces NaNs, calculates the column scales and moves the file into place.
+        Both passes read the condensed values block by block.
+        """
+        values = data[: cls.condensed_length(n_trees)]
+        remove_possible_nans_condensed(values, n_trees)
+        data[len(values) :] = condensed_column_max(values, n_trees)
+        data.flush()
+        del data
+        os.replace(temporary_path(path), path)
+        return cls(path)
+
+    def __len__(self) -> int:
+        return self.n_trees
+
+    def __getitem__(self, index) -> npt.NDArray[np.float32]:
+        if isinstance(index, (int, np.integer)):
+            return self.rows(np.array([index]))[0]
+        if isinstance(index, slice):
+            return self.rows(np.arange(self.n_trees)[index])
+        return self.rows(np.asarray(index))
+
+    def rows(self, indices: npt.NDArray[np.int_]) -> npt.NDArray[np.float32]:
+        """
+        Assembles the scaled rows of the given indices.
+        """
+        row = indices[:, np.newaxis]
+        column = np.arange(self.n_trees)[np.newaxis, :]
+        low, high = np.minimum(row, column), np.maximum(row, column)
+        diagonal = low == high
+        condensed_index = (
+            self.n_trees * low - low * (low + 1) // 2 + (high - low - 1)
+        ).astype(np.int64)
+        condensed_index[diagonal] = 0
+        block = self.values[condensed_index]
+        block[diagonal] = 0
+        return block / self.column_scale
+
+    def iter_row_blocks(self, block_rows: int = BLOCK_ROWS):
+        """
+        Yields (start, stop, rows) for consecutive blocks of scaled rows.
+        """
+        for start in range(0, self.n_trees, block_rows):
+            stop = min(start + block_rows, self.n_trees)
+            yield start, stop, self[start:stop]
+
+    def __matmul__(self, other: np.ndarray) -> np.ndarray:
+        result = np.empty(
+            (self.n_trees,) + other.shape[1:],
+            dtype=np.result_type(self.dtype, other.dtype),
+        )
+        for start, stop, block in self.iter_row_blocks():
+            result[start:stop] = block @ other
+        return result
+
+    def __array__(self, dtype=None) -> np.ndarray:
+        dense = self[:]
+        return dense if dtype is None else dense.astype(dtype)
+
+    def memory_footprint(self) -> int:
+        """
+        Only the column scales are held in memory, the values of a file are paged in
+        on access.
+        """
+        if isinstance(self.values, np.memmap):
+            return self.column_scale.nbytes
+        return self.column_scale.nbytes + self.values.nbytes
+
+
+def condensed_column_max(
+    values: npt.NDArray[np.float32], n_trees: int
+) -> npt.NDArray[np.float32]:
+    """
+    Largest distance of every tree, by which its column is scaled, read row by row
+    from the condensed values.
+    """
+    row_offset = CondensedDistanceMatrix.row_offset
+    column_max = np.zeros(n_trees, dtype=np.float32)
+    for row in range(n_trees - 1):
+        segment = values[row_offset(row, n_trees) : row_offset(row + 1, n_trees)]
+        column_max[row + 1 :] = np.maximum(column_max[row + 1 :], segment)
+        column_max[row] = max(column_max[row], segment.max())
+    # Columns without any distance are left unscaled, like MinMaxScaler does
+    column_max[column_max == 0] = 1
+    return column_max
+
+
+def iter_row_blocks(distance_matrix, block_rows: int = BLOCK_ROWS):
+    """
+    Yields (start, stop, rows) for dense and condensed distance matrices alike.
+    """
+    for start in range(0, distance_matrix.shape[0], block_rows):
+        stop = min(start + block_rows, distance_matrix.shape[0])
+        yield start, stop, np.asarray(distance_matrix[start:stop])
+
+
+def condensed_pairs(
+    start: int, stop: int, n_trees: int
+) -> tuple[npt.NDArray[np.int64], npt.NDArray[np.int64]]:
+    """
+    Rows and columns of the pairs at the positions start to stop of the condensed values.
+    Inverts row_offset(), by solving its quadratic equation for the row.
+    """
+    positions = np.arange(start, stop, dtype=np.int64)
+    rows = (
+        n_trees
+        - 2
+        - np.floor(
+            np.sqrt(4 * n_trees * (n_trees - 1) - 8 * positions - 7) / 2 - 0.5
+        ).astype(np.int64)
+    )
+    offsets = n_trees * rows - rows * (rows + 1) // 2
+    columns = positions - offsets + rows + 1
+    return rows, columns
+
+
+def temporary_path(path: Path) -> Path:
+    return Path(path).with_name(Path(path).name + ".tmp")
+
+
+def remove_possible_nans_condensed(values: npt.NDArray[np.float32], n_trees: int):
+    """
+    Remove possible nans, resulting from timeouts in the nx.graph_edit_distance.
+    The values are replaced in place, one block at a time.
+    """
+    # We currently use an arbitrary measure of the squared maximum distance.
+    # This is fine for now, but should be adjusted to something more reasonable.
+    nan_count = 0
+    nan_max = 0.0
+    for start in range(0, len(values), BLOCK_ROWS * n_trees):
+        block = values[start : start + BLOCK_ROWS * n_trees]
+        nans = np.isnan(block)
+        nan_count += int(np.count_nonzero(nans))
+        if not nans.all():
+            nan_max = max(nan_max, float(np.nanmax(block)))
+    # Every condensed value stands for two entries of the square matrix
+    if 2 * nan_count > n_trees:
+        warnings.warn(
+            f"{2 * nan_count} NaNs in distance matrix. Consider adjusting timeout parameter in nx.graph_edit_distance."
+        )
+    if nan_count:
+        for start in range(0, len(values), BLOCK_ROWS * n_trees):
+            block = values[start : start + BLOCK_ROWS * n_trees]
+            block[np.isnan(block)] = pow(nan_max, 2)
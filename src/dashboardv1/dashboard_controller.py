@@ -1,14 +1,40 @@
 """Streamlit is used to display the dashboard in the browser.
 Pandas handles all of the dataframes in the background.
-Altair is responsible for the charts."""
+Altair is responsible for the charts.
+The memory manager provides the numbers for the admin metrics view, along with the
+state of the worker pool, stage_timer the stage timings of the last reruns and profiling
+the captured profiles.
+User supplied datasets are uploaded in the sidebar and ingested by dataset_ingestion.
+time tells the age of the last health check of the worker pool."""
+import time
+from pathlib import Path
 from typing import Union
 
 import altair as alt
 import numpy as np
+import numpy.typing as npt
 import pandas as pd
 import streamlit as st
 import streamlit.components.v1 as components
+from data_loader import CUSTOM_DATASET
 from dataframe_operator import DataframeOperator
+from dataset_ingestion import SUPPORTED_FORMATS, IngestedDataset
+from embedding_backends import EMBEDDING_BACKENDS, TSNE_GALLERY_FACTORS, TSNEBackend
+from memory_manager import get_memory_manager
+from model_loader import TRAIN_IN_APP, available_models
+from nearest_trees import NEAREST_TREES
+from parameter_sweep import best_configuration
+from random_forest_modeller import (
+    DISAGREEMENT_METRIC,
+    DISTANCE_METRICS,
+    GED_METRIC,
+    NEIGHBOR_GRAPH_METRIC,
+    WL_METRIC,
+)
+from worker_pool import get_worker_pool
+
+# Trees shown at most in the similarity matrix heatmap
+HEATMAP_MAX_TREES = 200
 
 
 class DashboardController:
@@ -19,8 +45,10 @@ class DashboardController:
         dataset: pd.DataFrame,
         features: list[str],
         dfo: DataframeOperator,
+        custom_dataset: IngestedDataset = None,  # type: ignore
     ):
         self.app_mode = None  # Defined in create_sidebar()
+        self.custom_dataset = custom_dataset
         self.rfm = dfo.rfm
         self.tree_df = dfo.tree_df
         self.dfo = dfo
@@ -29,6 +57,14 @@ class DashboardController:
         self.dashboard_container.header("RandFew")
         self.dataset = dataset
         self.features = features
+        self.setup_chart_encodings()
+
+    def setup_chart_encodings(self):
+        """
+        Selections, color scales and title formats shared by the charts.
+        Kept apart from the sidebar, so that charts can be built without a running app,
+        e.g. by benchmark.py.
+        """
         self.feature_names_plus_importance = [
             feature + "_importance" for feature in self.features
         ]
@@ -88,15 +124,50 @@ class DashboardController:
         self.data_form.markdown("## Example Use Cases")
         self.data_form.selectbox(
             label="Choose an example use case:",
-            options=["Iris", "Digits"],
+            options=["Iris", "Digits"]
+            + ([CUSTOM_DATASET] if self.custom_dataset is not None else []),
             key="data_choice",
         )
+        self.data_form.selectbox(
+            label="Choose a model:",
+            options=[TRAIN_IN_APP] + available_models(),
+            key="model_choice",
+            help="Forests trained elsewhere can be placed in the model directory on the server by its operator.\
+                They are inspected as they are, without retraining.",
+        )
         self.data_form.form_submit_button(
             "Run",
             help="On 'run' the selected dataset will be loaded into the dashboard",
         )
+        self.create_custom_dataset_view(sidebar)
 
         if self.app_mode == "Dashboard":
+            # Epsilon is not part of the form, since the clustering for a new value
+            # is extracted from the precomputed density hierarchy without delay.
+            sidebar.markdown("## Clustering")
+            sidebar.slider(
+                label="Select a value for the DBSCAN parameter 'epsilon':",
+                min_value=0.01,
+                max_value=0.99,
+                step=0.01,
+                key="eps",
+                help="The eps parameter determines the maximum distance between two samples to be considered as in the neighborhood of each other.\
+                    In turn, this implies that cluster sizes are even across the dataset which is not necessarily the case.\
+                    Changes to this value are applied immediately.",
+            )
+            if self.rfm.distance_refinement is not None:
+                refinement = self.rfm.distance_refinement
+                sidebar.markdown(
+                    f"The graph edit distances are approximated and refined in the background, the pairs around epsilon first. \
+                        Version {self.rfm.distance_version} is shown, {refinement.bounds_progress:.0%} of the approximations are calculated \
+                        and {refinement.progress:.0%} of the distances are exact."
+                )
+                sidebar.button(
+                    "Show refined distances",
+                    on_click=self.refresh_distances,
+                    help="Reclusters the trees with the latest version of the distances. Until then, the shown version is kept.",
+                )
+
             # Algorithm parameter form
             algorithm_parameters_form = sidebar.form(
                 "algorithm_parameters", clear_on_submit=False
@@ -111,16 +182,22 @@ class DashboardController:
                 unsafe_allow_html=True,
             )
             algorithm_parameters_form.markdown("### Random Forest:")
-            algorithm_parameters_form.slider(
-                label="Select a value for the number of trees in the Random Forest:",
-                min_value=20,
-                max_value=200,
-                step=10,
-                key="n_estimators",
-                help="The number of trees in the forest can boost the overall performance of a random forest. However, it can be interesting to set this to a lower\
-                value to see how this affects the clustering and the performance of the tree as a whole.\n\
-                There are more parameters for a Random Forest, than the number of trees, but we will keep it at this for now.",
-            )
+            if self.rfm.imported_model is not None:
+                # Imported forests are not retrained, so their size is fixed
+                algorithm_parameters_form.markdown(
+                    f"Imported model with {len(self.rfm.model.estimators_)} trees."
+                )
+            else:
+                algorithm_parameters_form.slider(
+                    label="Select a value for the number of trees in the Random Forest:",
+                    min_value=20,
+                    max_value=200,
+                    step=10,
+                    key="n_estimators",
+                    help="The number of trees in the forest can boost the overall performance of a random forest. However, it can be interesting to set this to a lower\
+                    value to see how this affects the clustering and the performance of the tree as a whole.\n\
+                    There are more parameters for a Random Forest, than the number of trees, but we will keep it at this for now.",
+                )
             algorithm_parameters_form.metric(
                 label="Silhouette Score",
                 value=np.round(self.rfm.cluster_silhouette_score, decimals=2),
@@ -136,6 +213,19 @@ class DashboardController:
                 help="This shows the percentage of trees currently assigned to a cluster. Optimally, this is high, when the Silhouette Score is\
                     also high.",
             )
+            algorithm_parameters_form.markdown("### Distance:")
+            algorithm_parameters_form.selectbox(
+                label="Select how the distance between two trees is measured:",
+                options=DISTANCE_METRICS,
+                key="distance_metric",
+                help="The graph edit distance compares the structure of the trees, but is expensive for large forests.\
+                    The prediction disagreement is the share of the samples, on which two trees predict different classes. It compares, what the trees do, and is calculated in well under a second.\
+                    The Weisfeiler-Lehman distance compares the structure of the trees, like the graph edit distance, by counting the subtrees of up to three levels, that occur in each tree. It is calculated in about a second.",
+            )
+            if self.rfm.distance_metric == NEIGHBOR_GRAPH_METRIC:
+                algorithm_parameters_form.markdown(
+                    "This forest is too large for a full distance matrix. Each tree is compared with its structurally most similar trees only, by the Jaccard distance of their split paths."
+                )
             algorithm_parameters_form.markdown("### DBSCAN:")
             algorithm_parameters_form.slider(
                 label="Select a value for the DBSCAN parameter 'min samples':",
@@ -146,14 +236,13 @@ class DashboardController:
                 help="The min_samples parameter is used to determine the minimum number of trees in it's neighborhood for it to be considered as a core point.\
                     Reducing this will naturally yield more clusters, while increasing it will yield less clusters.",
             )
-            algorithm_parameters_form.slider(
-                label="Select a value for the DBSCAN parameter 'epsilon':",
-                min_value=0.01,
-                max_value=0.99,
-                step=0.01,
-                key="eps",
-                help="The eps parameter determines the maximum distance between two samples to be considered as in the neighborhood of each other.\
-                    In turn, this implies that cluster sizes are even across the dataset which is not necessarily the case.",
+            algorithm_parameters_form.markdown("### Embedding:")
+            algorithm_parameters_form.selectbox(
+                label="Select how the trees are projected onto the scatter plot:",
+                options=list(EMBEDDING_BACKENDS),
+                key="embedding_backend",
+                help="Classical MDS and the spectral embedding are deterministic and fast, even for large forests.\
+                    t-SNE usually separates clusters more clearly, but is slower and depends on the parameters below.",
             )
             algorithm_parameters_form.markdown("### t-SNE:")
             algorithm_parameters_form.slider(
@@ -187,8 +276,347 @@ class DashboardController:
                 help="On 'run' the selected dataset will be loaded into the dashboard",
             )
 
+            # Parameter sweep, which needs the full distance matrix
+            if self.rfm.distance_metric != NEIGHBOR_GRAPH_METRIC:
+                sidebar.markdown("## Parameter Sweep")
+                sidebar.checkbox(
+                    "Show parameter sweep",
+                    key="show_parameter_sweep",
+                    help="Evaluates every combination of the DBSCAN parameters and shows the Silhouette Score and the percentage of trees in clusters as heatmaps.",
+                )
+                if st.session_state.get("show_parameter_sweep"):
+                    best = best_configuration(self.rfm.calculate_parameter_sweep())
+                    sidebar.button(
+                        f"Apply best: eps={best['eps']:.2f}, min samples={best['min_samples']:.0f}",
+                        on_click=self.apply_clustering_parameters,
+                        args=(best["eps"], int(best["min_samples"])),
+                        help="The best configuration has the highest product of Silhouette Score and share of trees in clusters.",
+                    )
+                sidebar.markdown("## t-SNE Gallery")
+                sidebar.checkbox(
+                    "Show t-SNE gallery",
+                    key="show_tsne_gallery",
+                    help="Shows the t-SNE embeddings for smaller and larger values of the perplexity and the early exaggeration side by side. They are calculated in parallel and adopting one of them reuses its embedding.",
+                )
+
+            # Nearest trees, highlighted in the scatter plot and the heatmap
+            sidebar.markdown("## Nearest Trees")
+            trees = [None] + list(range(len(self.rfm.model.estimators_)))
+            if st.session_state.get("selected_tree") not in trees:
+                # The tree is not part of the forest anymore
+                st.session_state["selected_tree"] = None
+            sidebar.selectbox(
+                "Highlight the nearest trees of:",
+                options=trees,
+                format_func=lambda tree: "No tree" if tree is None else f"Tree {tree}",
+                key="selected_tree",
+                help="The nearest trees by the selected distance are highlighted in the scatter plot and the similarity matrix. They are looked up in an index, that is built once per distance matrix.",
+            )
+            sidebar.slider(
+                "Number of nearest trees:",
+                min_value=1,
+                max_value=NEAREST_TREES,
+                value=5,
+                key="n_nearest_trees",
+            )
+            sidebar.checkbox(
+                "Show the diagram of the selected tree",
+                key="show_tree_diagram",
+                help="Every tree is drawn on its first request only and cached on disk afterwards.",
+            )
+
         return sidebar
 
+    def nearest_trees(
+        self,
+    ) -> Union[tuple[int, npt.NDArray[np.int32], npt.NDArray[np.float32]], None]:
+        """
+        The tree selected in the sidebar, its nearest trees and their distances, or
+        None, if no tree is selected.
+        """
+        selected_tree = st.session_state.get("selected_tree")
+        if selected_tree is None:
+            return None
+        neighbors, distances = self.rfm.get_nearest_tree_index().query(
+            selected_tree, st.session_state.get("n_nearest_trees", 5)
+        )
+        return selected_tree, neighbors, distances
+
+    def session_artifacts(self) -> dict:
+        """
+        The artifacts this controller keeps alive after the rerun, as the widget
+        callbacks are its methods, see release_artifacts().
+        """
+        return {
+            "model": self.rfm.model,
+            "training_data": [
+                self.rfm.X_train,
+                self.rfm.X_test,
+                self.rfm.y_train,
+                self.rfm.y_test,
+            ],
+            "directed_graphs": self.rfm.directed_graphs,
+            "distance_matrix": self.rfm.distance_matrix,
+            "tree_df": self.tree_df,
+            "load_history": st.session_state.load_history,
+        }
+
+    def release_artifacts(self):
+        """
+        Drops the references to the forest, its distances and the tree dataframe, when
+        the memory manager releases the session. The widget callbacks only set the
+        session state, so they keep working, and the next rerun builds a new
+        controller.
+        """
+        self.rfm = None
+        self.dfo = None
+        self.tree_df = None
+        self.custom_dataset = None
+
+    def apply_clustering_parameters(self, eps: float, min_samples: int):
+        """
+        Callback, that sets the DBSCAN sliders before the next rerun.
+        """
+        st.session_state["eps"] = eps
+        st.session_state["min_samples"] = min_samples
+
+    def select_custom_dataset(self):
+        """
+        Callback, that switches the data selection to the uploaded dataset.
+        """
+        st.session_state["data_choice"] = CUSTOM_DATASET
+
+    def admin_mode(self) -> bool:
+        """
+        The admin views are hidden, unless the page is opened with ?admin=true.
+        """
+        query_params = st.experimental_get_query_params()
+        return query_params.get("admin", [""])[0].lower() in ("1", "true")
+
+    def create_custom_dataset_view(self, sidebar: st.sidebar):  # type: ignore
+        """
+        Upload of a user supplied dataset and selection of the target column.
+        The dataset is loaded in st_dashboard.base_loader, before the model is trained.
+        Models can't be uploaded, as loading them would unpickle untrusted files.
+        """
+        with sidebar.expander("Your own data"):
+            st.file_uploader(
+                "Upload a CSV or Parquet file:",
+                type=list(SUPPORTED_FORMATS) + ["pq"],
+                key="dataset_upload",
+                help="The file is read in chunks. Text columns are encoded as categories.",
+            )
+            if self.custom_dataset is None:
+                return
+            frame = self.custom_dataset.frame
+            st.caption(
+                f"{frame.shape[0]} rows, {frame.shape[1]} columns, "
+                f"{self.custom_dataset.memory_footprint() / 2**20:.1f} MB in memory"
+            )
+            st.selectbox(
+                "Select the target column:",
+                options=list(frame.columns),
+                key="custom_target_column",
+            )
+            st.button(
+                "Analyze",
+                on_click=self.select_custom_dataset,
+                help="Trains the Random Forest on your dataset",
+            )
+
+    def create_admin_metrics_view(self):
+        """
+        Shows the memory accounting of all sessions and the shared artifact cache.
+        """
+        memory_manager = get_memory_manager()
+        summary = memory_manager.summary()
+        admin_expander = self.dashboard_sidebar.expander("Admin: Memory")
+        admin_expander.metric(
+            label="Artifact cache",
+            value=f"{summary['cache_mb']:.1f} / {summary['budget_mb']:.0f} MB",
+            help="Recomputable artifacts shared by all sessions. The least recently used ones are evicted once the budget is exceeded.\
+                The budget is set with the RANDFEW_MEMORY_BUDGET_MB environment variable.",
+        )
+        admin_expander.metric(
+            label="Last reruns of all sessions",
+            value=f"{summary['session_mb']:.1f} MB",
+            help="Summed size of the artifacts every session keeps from its last rerun. The artifacts, that aren't cached, count towards the budget.\
+                Once it is exceeded, the least recently seen sessions are released and build their artifacts again on their next rerun.",
+        )
+        admin_expander.markdown(
+            f"{summary['sessions']} sessions, {summary['entries']} cached artifacts, "
+            f"{summary['evictions']} evictions, {summary['releases']} released sessions, "
+            f"{summary['hit_rate']:.0%} cache hit rate"
+        )
+        admin_expander.dataframe(
+            memory_manager.session_df().pivot_table(
+                index="session", columns="artifact", values="size_mb", aggfunc="sum"
+            )
+        )
+        admin_expander.dataframe(memory_manager.cache_df())
+        pool = get_worker_pool()
+        if pool.running:
+            # Checked in the background, busy workers would block the rerun otherwise
+            healthy, checked = pool.health_status()
+            if healthy is None:
+                health = "health check pending"
+            else:
+                health = (
+                    f"{'healthy' if healthy else 'not answering'} "
+                    f"{time.time() - checked:.0f} s ago"
+                )
+        else:
+            health = "not started"
+        admin_expander.markdown(
+            f"Graph edit distance workers: {pool.processes} processes, {health}, "
+            f"started {pool.starts} times"
+        )
+
+    def create_stage_timing_view(self, stage_history: list[list[dict]]):
+        """
+        Shows the stage timings of the last reruns of this session as a waterfall, one
+        row per rerun, and the measurements of the latest rerun as a table.
+        """
+        stage_df = pd.DataFrame(
+            [record for rerun in stage_history for record in rerun],
+            columns=[
+                "rerun",
+                "stage",
+                "start_ms",
+                "wall_ms",
+                "cpu_ms",
+                "cache",
+                "items",
+            ],
+        )
+        if stage_df.empty:
+            return
+        stage_df["end_ms"] = stage_df["start_ms"] + stage_df["wall_ms"]
+        stage_df["cache"] = stage_df["cache"].fillna("-")
+        timing_expander = self.dashboard_sidebar.expander("Developer: Stage timings")
+        waterfall = (
+            alt.Chart(stage_df)
+            .mark_bar()
+            .encode(
+                x=alt.X(
+                    "start_ms:Q", title="Milliseconds since the start of the rerun"
+                ),
+                x2="end_ms:Q",
+                y=alt.Y("rerun:O", title="Rerun"),
+                color=alt.Color("stage:N", title="Stage"),
+                tooltip=["stage", "wall_ms", "cpu_ms", "cache", "items"],
+            )
+        )
+        timing_expander.altair_chart(waterfall, use_container_width=True)
+        timing_expander.dataframe(
+            stage_df[stage_df["rerun"] == stage_df["rerun"].max()].drop(
+                columns=["rerun", "end_ms"]
+            )
+        )
+
+    def create_ged_telemetry_view(self):
+        """
+        Shows how the graph edit distance calculation of the current distance matrix
+        spent its time: a histogram of the elapsed time per pair, the timeout rate by
+        tree size and the most expensive pairs.
+        """
+        telemetry = self.rfm.ged_telemetry()
+        telemetry_expander = self.dashboard_sidebar.expander("Developer: GED telemetry")
+        if telemetry is None:
+            telemetry_expander.markdown(
+                "No telemetry was recorded for this distance matrix."
+            )
+            return
+        summary = telemetry.summary()
+        if not summary["measured"]:
+            telemetry_expander.markdown("No pair of this distance matrix was timed.")
+            return
+        telemetry_expander.metric(
+            label="Pairs hitting the timeout",
+            value=f"{summary['timeout_rate']:.1%}",
+            help=f"{summary['timeouts']} of {summary['measured']} timed pairs took at least the timeout of {telemetry.timeout} s.\
+                Their distance is only an upper bound.",
+        )
+        telemetry_expander.markdown(
+            f"{summary['total_s']:.0f} s in total, median {summary['median_ms']:.0f} ms, "
+            f"95th percentile {summary['p95_ms']:.0f} ms, maximum {summary['max_ms']:.0f} ms"
+        )
+        histogram = (
+            alt.Chart(telemetry.histogram_df())
+            .mark_bar()
+            .encode(
+                x=alt.X(
+                    "start_ms:Q",
+                    scale=alt.Scale(type="log"),
+                    title="Milliseconds per pair",
+                ),
+                x2="end_ms:Q",
+                y=alt.Y("pairs:Q", title="Pairs"),
+                tooltip=["start_ms", "end_ms", "pairs"],
+            )
+        )
+        telemetry_expander.altair_chart(histogram, use_container_width=True)
+        timeout_rate = (
+            alt.Chart(telemetry.timeout_rate_by_size())
+            .mark_bar()
+            .encode(
+                x=alt.X("pair_nodes:N", sort=None, title="Nodes of both trees"),
+                y=alt.Y(
+                    "timeout_rate:Q",
+                    axis=alt.Axis(format="%"),
+                    title="Pairs hitting the timeout",
+                ),
+                tooltip=["pair_nodes", "pairs", "timeout_rate", "median_ms"],
+            )
+        )
+        telemetry_expander.altair_chart(timeout_rate, use_container_width=True)
+        telemetry_expander.dataframe(telemetry.worst_pairs())
+
+    def refresh_distances(self):
+        st.session_state["refresh_distances"] = True
+
+    def request_profile(self):
+        st.session_state["profile_next_rerun"] = True
+
+    def create_profiling_view(self, captures: list[dict]):
+        """
+        Profiles the next rerun on request and lists the recent captures, with the peak
+        memory of the stages of the latest one.
+        """
+        profiling_expander = self.dashboard_sidebar.expander("Developer: Profiling")
+        profiling_expander.button(
+            "Profile the next rerun",
+            on_click=self.request_profile,
+            help="Samples the call stacks and the memory of the rerun, including the workers of the graph edit distance.",
+        )
+        if not captures:
+            profiling_expander.markdown("No profiles were captured yet.")
+            return
+        profiling_expander.dataframe(
+            pd.DataFrame(captures)[
+                [
+                    "name",
+                    "created",
+                    "duration_s",
+                    "samples",
+                    "peak_rss_mb",
+                    "worker_peak_rss_mb",
+                ]
+            ]
+        )
+        latest = captures[0]
+        profiling_expander.markdown(
+            f"Peak memory per stage of {latest['name']}, stored in {latest['path']}:"
+        )
+        profiling_expander.dataframe(pd.DataFrame(latest["stages"]))
+        folded_path = Path(latest["path"]).joinpath("profile.folded")
+        profiling_expander.download_button(
+            "Download the flame graph stacks",
+            data=folded_path.read_bytes(),
+            file_name=f"{latest['name']}.folded",
+            help="Folded stacks, for flamegraph.pl or speedscope.",
+        )
+
     def show_df(self, show_df: bool = False):
         """
         For dev purposes, the dataframe can be shown on the dashboard.
@@ -323,22 +751,57 @@ class DashboardController:
         self, title: str, subtitle: str, importance: bool = False
     ) -> alt.Chart:
         """
-        Scatterplot displaying the t-SNE embedding of the RF model
+        Scatterplot displaying the embedding of the RF model, by default the t-SNE
+        embedding. The backend is taken from the tree_df metadata.
         importance, if True, displays the feature importance bar chart instead
         of the silhouette score plot.
         The returned plot is a horizontal concatenation of the two plots.
         """
+        embedding_backend = self.tree_df.attrs.get("embedding_backend", "t-SNE")
+        # The selected tree and its nearest trees are outlined
+        source = self.tree_df.assign(neighborhood="other", distance_to_selected=np.nan)
+        tooltip = ["cluster", "tree"]
+        nearest_trees = self.nearest_trees()
+        if nearest_trees is not None:
+            selected_tree, neighbors, distances = nearest_trees
+            source = source.set_index("tree", drop=False)
+            source.loc[selected_tree, "neighborhood"] = "selected"
+            source.loc[neighbors, "neighborhood"] = "nearest"
+            source.loc[neighbors, "distance_to_selected"] = distances
+            tooltip.append(
+                alt.Tooltip(
+                    "distance_to_selected:Q",
+                    title=f"Distance to tree {selected_tree}",
+                    format=".3f",
+                )
+            )
         tsne_chart = (
-            alt.Chart(self.tree_df)
-            .mark_circle(stroke="#7B3514", strokeWidth=1, size=100)
+            alt.Chart(source)
+            .mark_circle(size=100)
             .encode(
-                x=alt.X("Component 1:Q", scale=alt.Scale(zero=False)),
-                y=alt.Y("Component 2:Q", scale=alt.Scale(zero=False)),
+                x=alt.X(
+                    "Component 1:Q",
+                    scale=alt.Scale(zero=False),
+                    title=f"{embedding_backend} Component 1",
+                ),
+                y=alt.Y(
+                    "Component 2:Q",
+                    scale=alt.Scale(zero=False),
+                    title=f"{embedding_backend} Component 2",
+                ),
                 color=self.color,
-                tooltip=[
-                    "cluster",
-                    "tree",
-                ],
+                stroke=alt.Stroke(
+                    "neighborhood:N",
+                    scale=alt.Scale(
+                        domain=["other", "nearest", "selected"],
+                        range=["#7B3514", "#2166ac", "#000000"],
+                    ),
+                    legend=None,
+                ),
+                strokeWidth=alt.condition(
+                    "datum.neighborhood == 'other'", alt.value(1), alt.value(4)
+                ),
+                tooltip=tooltip,
             )
             .add_selection(self.brush)
         ).properties(width=700, height=700)
@@ -842,10 +1305,17 @@ class DashboardController:
 
     def create_similarity_matrix(self, title: str, subtitle: str) -> alt.Chart:
         # Turn the similarity matrix into a dataframe that we can display with altair
-        distance_matrix = self.rfm.distance_matrix
-        x, y = np.meshgrid(
-            range(0, distance_matrix.shape[0]), range(0, distance_matrix.shape[0])
-        )
+        # Large forests are subsampled evenly, the browser can't render all the cells
+        n_trees = self.rfm.distance_matrix.shape[0]
+        trees = np.linspace(0, n_trees - 1, min(n_trees, HEATMAP_MAX_TREES)).astype(int)
+        # The cells between the selected tree and its nearest trees are outlined, so
+        # these trees are always shown
+        nearest_trees = self.nearest_trees()
+        if nearest_trees is not None:
+            selected_tree, neighbors, _ = nearest_trees
+            trees = np.union1d(trees, np.append(neighbors, selected_tree))
+        distance_matrix = np.asarray(self.rfm.distance_matrix[trees])[:, trees]
+        x, y = np.meshgrid(trees, trees)
         source = pd.DataFrame(
             {
                 "tree_x": x.ravel(),
@@ -853,6 +1323,11 @@ class DashboardController:
                 "distance_value": distance_matrix.ravel(),
             }
         )
+        source["nearest"] = False
+        if nearest_trees is not None:
+            source["nearest"] = (
+                (source["tree_y"] == selected_tree) & source["tree_x"].isin(neighbors)
+            ) | ((source["tree_x"] == selected_tree) & source["tree_y"].isin(neighbors))
         source_with_xcluster_info = source.join(
             self.rfm.cluster_df.set_index("tree"),
             on="tree_x",
@@ -884,9 +1359,20 @@ class DashboardController:
                     "distance_value:Q",
                     scale=alt.Scale(scheme="greys", reverse=True),
                     legend=alt.Legend(
-                        title="Normalized GED", orient="left", titleFontSize=14
+                        title={
+                            GED_METRIC: "Normalized GED",
+                            DISAGREEMENT_METRIC: "Disagreement",
+                            WL_METRIC: "Normalized WL distance",
+                            NEIGHBOR_GRAPH_METRIC: "Jaccard distance",
+                        }[self.rfm.distance_metric],
+                        orient="left",
+                        titleFontSize=14,
                     ),
                 ),
+                stroke=alt.condition(
+                    "datum.nearest", alt.value("#2166ac"), alt.value(None)
+                ),
+                strokeWidth=alt.value(2),
                 tooltip=[
                     "tree_x",
                     "tree_y",
@@ -897,6 +1383,136 @@ class DashboardController:
         )
         return self.add_title(chart, title, subtitle)
 
+    def create_tree_diagram(self, title: str, subtitle: str):
+        """
+        Diagram of the tree selected in the sidebar, with the feature and threshold of
+        every split and the class distribution of every node.
+        The SVG is displayed directly instead of returning a chart.
+        """
+        svg = self.rfm.get_tree_svg(st.session_state["selected_tree"])
+        self.dashboard_container.markdown(f"## {title}")
+        self.dashboard_container.caption(subtitle)
+        self.dashboard_container.image(svg, width=900)
+
+    def adopt_tsne_parameters(
+        self, learning_rate: float, perplexity: int, early_exaggeration: float
+    ):
+        """
+        Callback, that selects t-SNE and sets its sliders before the next rerun.
+        """
+        st.session_state["embedding_backend"] = TSNEBackend.name
+        st.session_state["learning_rate"] = learning_rate
+        st.session_state["perplexity"] = perplexity
+        st.session_state["early_exaggeration"] = early_exaggeration
+
+    def create_tsne_gallery(self, title: str, subtitle: str):
+        """
+        Thumbnails of the t-SNE embeddings of the gallery, colored by the current
+        clusters. Altair charts can't trigger callbacks, so every thumbnail has a
+        button, that adopts its parameters.
+        The gallery is displayed directly instead of returning a chart.
+        """
+        gallery = self.rfm.calculate_tsne_gallery()
+        current_parameters = (
+            st.session_state.get("learning_rate"),
+            st.session_state.get("perplexity"),
+            st.session_state.get("early_exaggeration"),
+        )
+        tsne_selected = st.session_state.get("embedding_backend") == TSNEBackend.name
+        self.dashboard_container.markdown(f"## {title}")
+        self.dashboard_container.caption(subtitle)
+        n_columns = len(TSNE_GALLERY_FACTORS)
+        for index, (backend, embedding) in enumerate(gallery):
+            if index % n_columns == 0:
+                columns = self.dashboard_container.columns(n_columns)
+            column = columns[index % n_columns]
+            parameters = (
+                backend.learning_rate,
+                backend.perplexity,
+                backend.early_exaggeration,
+            )
+            is_current = tsne_selected and parameters == current_parameters
+            source = pd.DataFrame(
+                embedding, columns=["Component 1", "Component 2"]
+            ).assign(
+                cluster=self.tree_df["cluster"].values,
+                tree=self.tree_df["tree"].values,
+            )
+            thumbnail = (
+                alt.Chart(source)
+                .mark_circle(size=30)
+                .encode(
+                    x=alt.X("Component 1:Q", scale=alt.Scale(zero=False), axis=None),
+                    y=alt.Y("Component 2:Q", scale=alt.Scale(zero=False), axis=None),
+                    color=alt.Color("cluster:N", legend=None),
+                    tooltip=["cluster", "tree"],
+                )
+                .properties(
+                    width=200,
+                    height=200,
+                    title=f"Perplexity {backend.perplexity}, exaggeration {backend.early_exaggeration:.0f}",
+                )
+            )
+            column.altair_chart(thumbnail, use_container_width=False)
+            column.button(
+                "Current" if is_current else "Adopt",
+                key=f"adopt_tsne_{index}",
+                on_click=self.adopt_tsne_parameters,
+                args=parameters,
+                disabled=is_current,
+            )
+
+    def create_parameter_sweep_heatmap(self, title: str, subtitle: str) -> alt.Chart:
+        """
+        Heatmaps of the Silhouette Score and the percentage of trees in clusters for
+        every combination of the DBSCAN parameters.
+        The current configuration is marked with a circle.
+        """
+        sweep_df = self.rfm.calculate_parameter_sweep()
+        current = pd.DataFrame(
+            {
+                "eps": [st.session_state.get("eps")],
+                "min_samples": [st.session_state.get("min_samples")],
+            }
+        )
+        base = alt.Chart(sweep_df).encode(
+            x=alt.X("eps:O", title="Epsilon", axis=alt.Axis(labelAngle=-90)),
+            y=alt.Y("min_samples:O", title="Min Samples", sort="descending"),
+            tooltip=[
+                alt.Tooltip("eps:Q", title="Epsilon"),
+                alt.Tooltip("min_samples:Q", title="Min Samples"),
+                alt.Tooltip(
+                    "silhouette_score:Q", title="Silhouette Score", format=".2f"
+                ),
+                alt.Tooltip("trees_in_clusters:Q", title="Trees in Clusters (%)"),
+                alt.Tooltip("n_clusters:Q", title="Number of Clusters"),
+            ],
+        )
+        marker = (
+            alt.Chart(current)
+            .mark_point(shape="circle", size=60, color="black", strokeWidth=2)
+            .encode(x="eps:O", y=alt.Y("min_samples:O", sort="descending"))
+        )
+        silhouette_heatmap = base.mark_rect().encode(
+            color=alt.Color(
+                "silhouette_score:Q",
+                scale=alt.Scale(range=self.range_, domain=(-1, 1)),
+                legend=alt.Legend(orient="left", title="Silhouette Score"),
+            )
+        )
+        coverage_heatmap = base.mark_rect().encode(
+            color=alt.Color(
+                "trees_in_clusters:Q",
+                scale=alt.Scale(scheme="greys", domain=(0, 100)),
+                legend=alt.Legend(orient="right", title="Trees in Clusters (%)"),
+            )
+        )
+        chart = alt.vconcat(
+            (silhouette_heatmap + marker).properties(width=900, height=250),
+            (coverage_heatmap + marker).properties(width=900, height=250),
+        ).resolve_scale(color="independent")
+        return self.add_title(chart, title, subtitle)  # type: ignore
+
     def check_data_choice(self):
         if "data_choice" in st.session_state:
             data_choice = st.session_state.data_choice
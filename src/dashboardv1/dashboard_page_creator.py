@@ -1,6 +1,27 @@
-"""Path enables the reading of files containing the markdown for the dashboard."""
+"""Path enables the reading of files containing the markdown for the dashboard.
+Streamlit's session state tells, which optional charts are toggled on. The parameter
+sweep and the t-SNE gallery are left out for forests too large for a full distance
+matrix.
+stage_timer measures building the charts and rendering the page."""
 from pathlib import Path
+import streamlit as st
 from dashboard_controller import DashboardController
+from data_loader import CUSTOM_DATASET
+from random_forest_modeller import (
+    DISAGREEMENT_METRIC,
+    GED_METRIC,
+    NEIGHBOR_GRAPH_METRIC,
+    WL_METRIC,
+)
+from stage_timer import record_items, timed_stage
+
+# Names of the distance metrics in the captions of the distance matrix
+METRIC_CAPTIONS = {
+    GED_METRIC: "the graph edit distance (GED)",
+    DISAGREEMENT_METRIC: "the prediction disagreement",
+    WL_METRIC: "the Weisfeiler-Lehman distance",
+    NEIGHBOR_GRAPH_METRIC: "the Jaccard distance of the split paths",
+}
 
 
 class DashboardPageCreator:
@@ -12,10 +33,12 @@ class DashboardPageCreator:
 
     The layout dictionary is a list of dictionaries. Each dictionary contains the following
     keys:
-    - content: either "markdown", "image" or "chart"
+    - content: either "markdown", "image", "chart", "gallery" or "tree_diagram"
     Depending on the content, the dictionary should contain the following keys:
     - file: the name of the file containing the markdown or image
     - chart_element: the chart element to be displayed, given by a dashboard controller method
+    - title and subtitle: the title and subtitle of the t-SNE gallery or the tree diagram,
+      which are displayed by the dashboard controller
 
     The layout dictionary is passed to the create_page method, which will then create the page.
 
@@ -26,6 +49,14 @@ class DashboardPageCreator:
     def __init__(self, dashboard_controller: DashboardController = None):  # type: ignore
         self.dashboard_controller = dashboard_controller
 
+    def distance_matrix_subtitle(self, figure: int) -> str:
+        """
+        Caption of the distance matrix, naming the distance metric selected in the
+        sidebar.
+        """
+        metric = self.dashboard_controller.rfm.distance_metric
+        return f"Figure {figure}: Distance matrix, using {METRIC_CAPTIONS[metric]}, as the distance metric."
+
     def create_tutorial_page_layout(self):
         """
         Create a tutorial page with graphics of how a random forest works.
@@ -65,6 +96,16 @@ class DashboardPageCreator:
         Explanations will be toggled on by default.
         """
         self.dashboard_controller.show_df(show_df=show_df)
+        self.create_page(self.build_dashboard_layout())
+
+    @timed_stage("chart build")
+    def build_dashboard_layout(self) -> list[dict]:
+        """
+        Builds the charts of the dashboard and returns its layout dictionary.
+        """
+        embedding_backend = self.dashboard_controller.tree_df.attrs.get(
+            "embedding_backend", "t-SNE"
+        )
         if self.dashboard_controller.check_data_choice() == "Iris":
             layout = [
                 {"content": "markdown", "file": "welcome.md"},
@@ -91,7 +132,7 @@ class DashboardPageCreator:
                     "content": "chart",
                     "chart_element": self.dashboard_controller.create_similarity_matrix(
                         title="Pairwise Distance Matrix",
-                        subtitle="Figure 3: Distance matrix, using the graph edit distance (GED), as the distance metric.",
+                        subtitle=self.distance_matrix_subtitle(3),
                     ),
                 },
                 {"content": "markdown", "file": "iris_distance_matrix_explanation.md"},
@@ -107,16 +148,16 @@ class DashboardPageCreator:
                 {
                     "content": "chart",
                     "chart_element": self.dashboard_controller.create_tsne_scatter(
-                        title="T-SNE Scatter Plot",
-                        subtitle="Figure 5: A T-SNE embedding of the Random Forest based on the distance matrix.",
+                        title=f"{embedding_backend} Scatter Plot",
+                        subtitle=f"Figure 5: A {embedding_backend} embedding of the Random Forest based on the distance matrix.",
                     ),
                 },
                 {"content": "markdown", "file": "iris_explanation4.md"},
                 {
                     "content": "chart",
                     "chart_element": self.dashboard_controller.create_tsne_scatter(
-                        title="T-SNE Scatter Plot with Importance Bar Chart",
-                        subtitle="Figure 6: The same T-SNE embedding, as shown above, interacting with the feature importance bar chart, that was shown earlier.",
+                        title=f"{embedding_backend} Scatter Plot with Importance Bar Chart",
+                        subtitle=f"Figure 6: The same {embedding_backend} embedding, as shown above, interacting with the feature importance bar chart, that was shown earlier.",
                         importance=True,
                     ),
                 },
@@ -130,6 +171,47 @@ class DashboardPageCreator:
                 },
                 {"content": "markdown", "file": "explanation5.md"},
             ]
+        elif self.dashboard_controller.check_data_choice() == CUSTOM_DATASET:
+            # The class specific charts are tailored to the example use cases
+            layout = [
+                {"content": "markdown", "file": "welcome.md"},
+                {"content": "markdown", "file": "custom_header.md"},
+                {"content": "markdown", "file": "explanation1.md"},
+                {
+                    "content": "chart",
+                    "chart_element": self.dashboard_controller.create_feature_importance_barchart(
+                        title="Feature importances",
+                        subtitle="Figure 1: The 10 most important features of the Random Forest.",
+                        top_k=10,
+                        selection=False,
+                        flip=True,
+                    ),
+                },
+                {
+                    "content": "chart",
+                    "chart_element": self.dashboard_controller.create_similarity_matrix(
+                        title="Pairwise Distance Matrix",
+                        subtitle=self.distance_matrix_subtitle(2),
+                    ),
+                },
+                {
+                    "content": "chart",
+                    "chart_element": self.dashboard_controller.create_silhouette_plot(
+                        title="Silhouette Plot",
+                        subtitle="Figure 3: Silhouette Plot of all points not classified as noise.",
+                        solo=True,
+                    ),
+                },
+                {
+                    "content": "chart",
+                    "chart_element": self.dashboard_controller.create_tsne_scatter(
+                        title=f"{embedding_backend} Scatter Plot with Importance Bar Chart",
+                        subtitle=f"Figure 4: A {embedding_backend} embedding of the Random Forest, interacting with the feature importances.",
+                        importance=True,
+                    ),
+                },
+                {"content": "markdown", "file": "explanation5.md"},
+            ]
         else:
             layout = [
                 {"content": "markdown", "file": "welcome.md"},
@@ -167,7 +249,7 @@ class DashboardPageCreator:
                     "content": "chart",
                     "chart_element": self.dashboard_controller.create_similarity_matrix(
                         title="Pairwise Distance Matrix",
-                        subtitle="Figure 4: Distance matrix, using the graph edit distance, as the distance metric.",
+                        subtitle=self.distance_matrix_subtitle(4),
                     ),
                 },
                 {
@@ -186,16 +268,16 @@ class DashboardPageCreator:
                 {
                     "content": "chart",
                     "chart_element": self.dashboard_controller.create_tsne_scatter(
-                        title="t-SNE Scatter Plot",
-                        subtitle="Figure 6: A t-SNE embedding of the Random Forest based on the distance matrix.",
+                        title=f"{embedding_backend} Scatter Plot",
+                        subtitle=f"Figure 6: A {embedding_backend} embedding of the Random Forest based on the distance matrix.",
                     ),
                 },
                 {"content": "markdown", "file": "digits_explanation4.md"},
                 {
                     "content": "chart",
                     "chart_element": self.dashboard_controller.create_tsne_scatter(
-                        title="t-SNE Scatter Plot with Importance Bar Chart",
-                        subtitle="Figure 7: The same t-SNE embedding, as shown above, interacting with the feature importance bar chart, that was shown earlier.",
+                        title=f"{embedding_backend} Scatter Plot with Importance Bar Chart",
+                        subtitle=f"Figure 7: The same {embedding_backend} embedding, as shown above, interacting with the feature importance bar chart, that was shown earlier.",
                         importance=True,
                     ),
                 },
@@ -210,8 +292,46 @@ class DashboardPageCreator:
                 {"content": "markdown", "file": "explanation5.md"},
                 {"content": "markdown", "file": "explanation6.md"},
             ]
-        self.create_page(layout)
+        if (
+            st.session_state.get("show_parameter_sweep")
+            and self.dashboard_controller.rfm.distance_metric != NEIGHBOR_GRAPH_METRIC
+        ):
+            layout.append(
+                {
+                    "content": "chart",
+                    "chart_element": self.dashboard_controller.create_parameter_sweep_heatmap(
+                        title="Parameter Sweep",
+                        subtitle="Silhouette Score (top) and percentage of trees in clusters (bottom) for every combination of the DBSCAN parameters.",
+                    ),
+                }
+            )
+        if (
+            st.session_state.get("show_tsne_gallery")
+            and self.dashboard_controller.rfm.distance_metric != NEIGHBOR_GRAPH_METRIC
+        ):
+            layout.append(
+                {
+                    "content": "gallery",
+                    "title": "t-SNE Gallery",
+                    "subtitle": "t-SNE embeddings for smaller and larger values of the perplexity (rows) and the early exaggeration (columns), colored by the current clusters.",
+                }
+            )
+        if (
+            st.session_state.get("show_tree_diagram")
+            and st.session_state.get("selected_tree") is not None
+        ):
+            selected_tree = st.session_state["selected_tree"]
+            layout.append(
+                {
+                    "content": "tree_diagram",
+                    "title": f"Tree {selected_tree}",
+                    "subtitle": f"The splits of tree {selected_tree}. Each node shows the class distribution of the training samples, that reach it, and is colored by its majority class.",
+                }
+            )
+        record_items(sum(item["content"] == "chart" for item in layout))
+        return layout
 
+    @timed_stage("page render")
     def create_page(self, layout: list[dict]):
         """
         Creates a page according to the passed layout.
@@ -281,6 +401,20 @@ class DashboardPageCreator:
                 self.dashboard_controller.dashboard_container.image(read_image(item["file"]))  # type: ignore
             elif item["content"] == "chart":
                 charts.append(item["chart_element"])
+            elif item["content"] == "gallery":
+                if charts:
+                    self.dashboard_controller.display_charts(charts)
+                    charts = []
+                self.dashboard_controller.create_tsne_gallery(
+                    item["title"], item["subtitle"]
+                )
+            elif item["content"] == "tree_diagram":
+                if charts:
+                    self.dashboard_controller.display_charts(charts)
+                    charts = []
+                self.dashboard_controller.create_tree_diagram(
+                    item["title"], item["subtitle"]
+                )
         if charts:
             self.dashboard_controller.display_charts(charts)
         self.dashboard_controller.scroll_up_on_data_change()
@@ -2,21 +2,39 @@
 os is used to read the mushroom file.
 pandas handles dataframe operations.
 sklearn is used to load the iris dataset.
+Datasets uploaded by the user are ingested by dataset_ingestion.
 """
+import re
+
 import pandas as pd
 from sklearn.datasets import load_iris, load_digits
 
+from dataset_ingestion import IngestedDataset
+
+# Name of the user supplied dataset in the data selection
+CUSTOM_DATASET = "Custom"
+
 
 class DataLoader:
     """
-    Offers the ability to change the dataset, between Iris and Mushrooms.
+    Offers the ability to change the dataset, between Iris, Digits and a dataset
+    supplied by the user.
+    The dataset key identifies the data in cache keys and file names. For the built in
+    datasets it is their name, for user supplied datasets it contains the content
+    fingerprint and the target column.
     """
 
-    def __init__(self, dataset: str = "Iris"):
+    def __init__(
+        self,
+        dataset: str = "Iris",
+        custom_dataset: IngestedDataset = None,  # type: ignore
+        custom_target_column: str = None,  # type: ignore
+    ):
         self.data: pd.DataFrame
         self.features: list[str]
         self.target_column: list[str]
         self.target_names: list[str]
+        self.dataset_key: str
         self.iris = load_iris(as_frame=True)  # type: ignore
         self.digits = load_digits(as_frame=True)  # type: ignore
         self._dataset_map = {
@@ -33,8 +51,27 @@ class DataLoader:
                 "target_names": self.digits["target_names"],  # type: ignore
             },
         }
+        if custom_dataset is not None:
+            self.add_custom_dataset(custom_dataset, custom_target_column)
         self.load(dataset)
 
+    def add_custom_dataset(self, custom_dataset: IngestedDataset, target_column: str):
+        """
+        Makes an ingested dataset available under CUSTOM_DATASET.
+        """
+        if target_column not in custom_dataset.frame.columns:
+            raise ValueError(
+                f"DataLoader: Target column '{target_column}' is not part of the dataset."
+            )
+        self._dataset_map[CUSTOM_DATASET] = {
+            "data": custom_dataset.frame,
+            "features": custom_dataset.features(target_column),
+            "target_column": target_column,
+            "target_names": custom_dataset.target_names(target_column),
+            "dataset_key": f"{CUSTOM_DATASET}_{custom_dataset.fingerprint}_"
+            + re.sub(r"\W", "_", target_column),
+        }
+
     def load(self, dataset: str):
         """
         Loads the dataset with assigned feature and target names.
@@ -43,3 +80,4 @@ class DataLoader:
         self.features = self._dataset_map[dataset]["features"]
         self.target_column = self._dataset_map[dataset]["target_column"]
         self.target_names = self._dataset_map[dataset]["target_names"]
+        self.dataset_key = self._dataset_map[dataset].get("dataset_key", dataset)
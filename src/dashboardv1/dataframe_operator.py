@@ -4,36 +4,73 @@ pandas handles dataframe operations.
 sklearn calculates some performance metrics and the the decision tree
 class is just used as a type hint, as some trees are passed as arguments.
 RFmodeller is used to create the random forest model.
+The shared cache keeps the per tree metrics, which only depend on the forest and the data.
+The memory manager keeps those of the largest forest of the same forest_key, so only
+the trees added to a forest are scored.
+stage_timer measures the construction of the tree_df.
 """
 import numpy as np
 import pandas as pd
 from sklearn.metrics import classification_report
 from sklearn.tree import DecisionTreeClassifier
 from random_forest_modeller import RFmodeller
+from memory_manager import forest_fingerprint, get_memory_manager, get_session_id
+from shared_cache import get_shared_cache
+from stage_timer import record_cache, record_items, timed_stage
 
 
 class DataframeOperator:
     """Handling everything related to preparing the {tree_df} dataframe for visualization."""
 
+    @timed_stage("tree_df build")
     def __init__(self, rfm: RFmodeller, features: list[str]):
         self.rfm = rfm
         self.features = features
-        self.tree_df = self.get_tree_df_from_model(rfm, features)
+        self.tree_df = get_shared_cache().get_or_compute(
+            "tree_df",
+            (rfm.dataset_key, forest_fingerprint(rfm.model), tuple(features)),
+            lambda: self.grow_tree_df(rfm, features),
+        )
+        # Only a hit, unless get_tree_df_from_model() recorded a miss
+        record_cache(True)
         self.tree_df = self.add_cluster_information_to_tree_df(rfm, features)
         self.tree_df = self.add_grid_coordinates_to_tree_df(self.tree_df)
+        # Metadata about how the tree_df was built
+        self.tree_df.attrs["embedding_backend"] = rfm.embedding_backend
+        record_items(len(self.tree_df))
+
+    def grow_tree_df(self, rfm: RFmodeller, features: list[str]) -> pd.DataFrame:
+        """
+        The tree_df of the largest forest of the same forest_key, sliced to the trees of
+        the forest, or extended by the metrics of the trees, that were added to it.
+        """
+        memory_manager = get_memory_manager()
+        cache_key = ("tree_rows", rfm.dataset_key, *rfm.forest_key, tuple(features))
+        cached_df = memory_manager.get(cache_key)
+        n_trees = len(rfm.model.estimators_)
+        if cached_df is not None and len(cached_df) >= n_trees:
+            return cached_df.iloc[:n_trees]
+        n_cached = 0 if cached_df is None else len(cached_df)
+        tree_df = pd.concat(
+            [cached_df, self.get_tree_df_from_model(rfm, features, start=n_cached)],
+            ignore_index=True,
+        )
+        return memory_manager.put(cache_key, tree_df, get_session_id())
 
     # Inspect RF trees and retrieve number of leaves and depth for each tree
     # This could be altered to more interesting metrics in the future
     def get_tree_df_from_model(
-        self, rfm: RFmodeller, features: list[str]
+        self, rfm: RFmodeller, features: list[str], start: int = 0
     ) -> pd.DataFrame:
         """
         Constructs the tree_df dataframe from the random forest model.
         This dataframe contains information about each tree in the random forest.
-        The method iterates over each estimator to retrieve metrics about them.
+        The method iterates over each estimator to retrieve metrics about them, from
+        the estimator at position start on.
         """
+        record_cache(False)
         tree_df = pd.DataFrame(columns=["n_leaves", "depth"])
-        for est in rfm.model.estimators_:
+        for est in rfm.model.estimators_[start:]:
             new_row = {"n_leaves": est.get_n_leaves(), "depth": est.get_depth()}
             # List of tuples with variable and importance
             feature_importances = [
@@ -79,17 +116,22 @@ class DataframeOperator:
     ) -> pd.DataFrame:
         """
         Adds cluster information to the tree_df dataframe.
+        The per tree metrics are taken from self.tree_df, which came from the cache.
         """
-        tree_df = self.get_tree_df_from_model(rfm, features)
+        tree_df = self.tree_df.copy()
         tree_df = pd.concat([tree_df, rfm.cluster_df], axis=1)
         tree_df["cluster"] = tree_df["cluster"].apply(
             lambda x: "Noise" if x == -1 else x
         )
         tree_df["cluster"] = tree_df["cluster"].astype("str")
-        tree_df = pd.concat([tree_df, rfm.tsne_df], axis=1)
+        tree_df = pd.concat([tree_df, rfm.embedding_df], axis=1)
         tree_df = pd.concat([tree_df, rfm.sample_silhouette_scores], axis=1)
+        tree_df["Cluster Silhouette Score"] = rfm.cluster_df["cluster"].map(
+            rfm.cluster_silhouette_means
+        )
         # All noise values are set to -1
         tree_df.loc[tree_df.cluster == "Noise", "Silhouette Score"] = -1
+        tree_df.loc[tree_df.cluster == "Noise", "Cluster Silhouette Score"] = -1
         return tree_df
 
     def add_grid_coordinates_to_tree_df(self, tree_df: pd.DataFrame) -> pd.DataFrame:
@@ -0,0 +1,212 @@
+"""
+pandas reads CSV files chunk by chunk and combines the compact chunks column by column.
+pyarrow reads Parquet files batch by batch.
+hashlib fingerprints the file content, so that ingested datasets and everything
+computed from them can be cached by content.
+warnings reports missing values that had to be filled.
+"""
+import hashlib
+import warnings
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO, Iterable, Iterator, Union
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from pandas.api.types import union_categoricals
+
+# Rows parsed at once, this bounds the memory used by the parser
+CHUNK_ROWS = 50_000
+# Bytes read at once, when the file content is fingerprinted
+FINGERPRINT_BLOCK_BYTES = 1 << 20
+SUPPORTED_FORMATS = ("csv", "parquet")
+
+
+class IngestedDataset:
+    """
+    A user supplied dataset in a compact, purely numeric frame.
+    Numeric columns are downcast to the smallest sufficient type. Text columns are
+    encoded as integer category codes, with the categories kept in {categories}, so
+    that the random forest can be trained on the frame directly. Missing codes are -1.
+    """
+
+    def __init__(
+        self, frame: pd.DataFrame, fingerprint: str, categories: dict[str, list]
+    ):
+        self.frame = frame
+        self.fingerprint = fingerprint
+        self.categories = categories
+
+    def check_target(self, target_column: str):
+        """
+        Raises a ValueError, if the target column is continuous, as the random forest
+        classifies. Text columns and numbers without a fractional part are classes.
+        """
+        if target_column in self.categories:
+            return
+        values = self.frame[target_column].to_numpy()
+        if np.issubdtype(values.dtype, np.floating) and np.any(np.mod(values, 1)):
+            raise ValueError(
+                f"The target column '{target_column}' has continuous values, select a column of classes."
+            )
+
+    def features(self, target_column: str) -> list[str]:
+        return [column for column in self.frame.columns if column != target_column]
+
+    def target_names(self, target_column: str) -> list[str]:
+        """
+        The class names of the target column, ordered like the class labels.
+        """
+        labels = np.unique(self.frame[target_column])
+        if target_column in self.categories:
+            names = self.categories[target_column]
+            return [names[label] if label >= 0 else "missing" for label in labels]
+        return [str(label) for label in labels]
+
+    def memory_footprint(self) -> int:
+        return int(self.frame.memory_usage(deep=True).sum())
+
+
+def detect_format(file_name: str) -> str:
+    """
+    Determines the format from the file extension.
+    """
+    extension = Path(file_name).suffix.lower().lstrip(".")
+    if extension == "pq":
+        extension = "parquet"
+    if extension not in SUPPORTED_FORMATS:
+        raise ValueError(
+            f"Unsupported file format '{extension}'. Supported formats are {', '.join(SUPPORTED_FORMATS)}."
+        )
+    return extension
+
+
+def file_fingerprint(source: Union[str, Path, BinaryIO]) -> str:
+    """
+    blake2b hash of the file content, read block by block.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open_source(source) as file:
+        for block in iter(lambda: file.read(FINGERPRINT_BLOCK_BYTES), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+@contextmanager
+def open_source(source: Union[str, Path, BinaryIO]) -> Iterator[BinaryIO]:
+    """
+    Yields a binary file object at position 0, for paths and already opened files
+    (like streamlit's UploadedFile) alike. Opened files are not closed, since they
+    belong to the caller.
+    """
+    if isinstance(source, (str, Path)):
+        with open(source, "rb") as file:
+            yield file
+    else:
+        source.seek(0)
+        yield source
+
+
+def iter_chunks(
+    source: Union[str, Path, BinaryIO], data_format: str, chunk_rows: int = CHUNK_ROWS
+) -> Iterator[pd.DataFrame]:
+    """
+    Yields the dataset in frames of at most chunk_rows rows.
+    """
+    with open_source(source) as file:
+        if data_format == "csv":
+            yield from pd.read_csv(file, chunksize=chunk_rows)
+        else:
+            for batch in pq.ParquetFile(file).iter_batches(batch_size=chunk_rows):
+                yield batch.to_pandas()
+
+
+def compact_chunk(chunk: pd.DataFrame) -> pd.DataFrame:
+    """
+    Downcasts the numeric columns of a chunk and turns all other columns into
+    categoricals.
+    """
+    for column in chunk.columns:
+        values = chunk[column]
+        if pd.api.types.is_bool_dtype(values):
+            chunk[column] = values.astype(np.int8)
+        elif pd.api.types.is_integer_dtype(values):
+            chunk[column] = pd.to_numeric(values, downcast="integer")
+        elif pd.api.types.is_float_dtype(values):
+            chunk[column] = pd.to_numeric(values, downcast="float")
+        else:
+            chunk[column] = values.astype(str).where(values.notna()).astype("category")
+    return chunk
+
+
+def combine_chunks(
+    chunks: Iterable[pd.DataFrame],
+) -> tuple[pd.DataFrame, dict[str, list]]:
+    """
+    Concatenates the compact chunks column by column.
+    The chunks are consumed one at a time and split into their columns, so that the
+    memory is bounded by the compacted size of the dataset and a single combined
+    column: the parts of every column are released, once it is combined.
+    A column that was text in any chunk is categorical in all of them, the categories
+    of all chunks are unified before the codes are taken.
+    Columns without any values are dropped, as there is nothing to fill them with.
+    """
+    parts: dict[str, list] = {}
+    for chunk in chunks:
+        for column in chunk.columns:
+            parts.setdefault(column, []).append(chunk[column].array)
+        del chunk
+    columns = {}
+    categories = {}
+    for column in list(parts):
+        column_parts = [pd.Series(part, copy=False) for part in parts.pop(column)]
+        if any(isinstance(part.dtype, pd.CategoricalDtype) for part in column_parts):
+            combined = union_categoricals(
+                [
+                    part
+                    if isinstance(part.dtype, pd.CategoricalDtype)
+                    else part.astype(str).where(part.notna()).astype("category")
+                    for part in column_parts
+                ],
+                sort_categories=True,
+            )
+            if len(combined.categories) == 0:
+                warnings.warn(f"Column '{column}' has no values and was dropped.")
+                continue
+            categories[column] = list(combined.categories)
+            columns[column] = pd.to_numeric(combined.codes, downcast="integer")
+        else:
+            values = pd.concat(column_parts, ignore_index=True)
+            missing = int(values.isna().sum())
+            if missing == len(values):
+                warnings.warn(f"Column '{column}' has no values and was dropped.")
+                continue
+            if missing:
+                warnings.warn(
+                    f"{missing} missing values in column '{column}' were replaced by the median."
+                )
+                values = values.fillna(values.median())
+            columns[column] = values.to_numpy()
+    return pd.DataFrame(columns), categories
+
+
+def ingest_dataset(
+    source: Union[str, Path, BinaryIO],
+    file_name: str,
+    chunk_rows: int = CHUNK_ROWS,
+    fingerprint: str = None,  # type: ignore
+) -> IngestedDataset:
+    """
+    Reads a CSV or Parquet file in chunks of chunk_rows rows into an IngestedDataset.
+    Only one raw chunk is held at a time, all other chunks are already compacted, see
+    combine_chunks().
+    The fingerprint is calculated, unless the caller already did so.
+    """
+    data_format = detect_format(file_name)
+    frame, categories = combine_chunks(
+        compact_chunk(chunk) for chunk in iter_chunks(source, data_format, chunk_rows)
+    )
+    if frame.empty:
+        raise ValueError(f"The file '{file_name}' does not contain any rows.")
+    return IngestedDataset(frame, fingerprint or file_fingerprint(source), categories)
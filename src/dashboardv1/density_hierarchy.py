@@ -0,0 +1,136 @@
+"""
+numpy selects the nearest neighbors of every point and extracts the labels.
+copy is used to share the nearest neighbors between hierarchies.
+The rows are read block by block, so that condensed distance matrices are never
+materialized as a whole. Only the nearest neighbors of every point are kept, the
+neighborhoods for a value of eps are collected in one pass over the rows per call.
+"""
+import copy
+
+import numpy as np
+import numpy.typing as npt
+
+from condensed_distance import iter_row_blocks
+
+# Nearest neighbors kept per point, which covers the min_samples slider. Core distances
+# of larger values of min_samples are calculated in another pass over the rows.
+CORE_NEIGHBORS = 10
+
+
+class NeighborhoodGraph:
+    """
+    Neighborhoods of the core points for one value of eps, as compressed sparse rows:
+    the neighbors of point i are indices[indptr[i] : indptr[i + 1]].
+    Points, that are not core points, have no neighbors.
+    """
+
+    def __init__(self, indptr: npt.NDArray[np.int64], indices: npt.NDArray[np.int32]):
+        self.indptr = indptr
+        self.indices = indices
+
+    def neighbors(self, point: int) -> npt.NDArray[np.int32]:
+        return self.indices[self.indptr[point] : self.indptr[point + 1]]
+
+
+class DensityHierarchy:
+    """
+    Precomputed neighborhood structure of a distance matrix for one value of min_samples.
+    The CORE_NEIGHBORS nearest distances of every point are selected once. Afterwards
+    the core points for any eps follow directly from the core distances, and the labels
+    need a single pass over the rows to collect the neighborhoods of the core points.
+    The hierarchy keeps O(n_trees * CORE_NEIGHBORS) values besides a reference to the
+    distance matrix, so memory mapped matrices stay on disk.
+
+    The rows are used as they are, because the column wise scaled distance matrix is not
+    necessarily symmetric. This keeps the labels identical to
+    DBSCAN(metric="precomputed") on the same matrix.
+    """
+
+    def __init__(self, distance_matrix: npt.NDArray[np.float64], min_samples: int):
+        self.distance_matrix = distance_matrix
+        self.min_samples = min_samples
+        n_trees = distance_matrix.shape[0]
+        n_nearest = min(n_trees, max(CORE_NEIGHBORS, min_samples))
+        self.nearest_distances = np.empty((n_trees, n_nearest), dtype=np.float64)
+        for start, stop, rows in iter_row_blocks(distance_matrix):
+            nearest = np.partition(rows, n_nearest - 1, axis=1)[:, :n_nearest]
+            self.nearest_distances[start:stop] = np.sort(nearest, axis=1)
+        self.core_distances = self.calculate_core_distances(min_samples)
+
+    def calculate_core_distances(self, min_samples: int) -> npt.NDArray[np.float64]:
+        """
+        A point is a core point, if its min_samples-th closest point (itself included)
+        lies within eps. That distance is the core distance of the point.
+        """
+        n_trees, n_nearest = self.nearest_distances.shape
+        if min_samples <= n_nearest:
+            return self.nearest_distances[:, min_samples - 1]
+        if min_samples > n_trees:
+            return np.full(n_trees, np.inf)
+        core_distances = np.empty(n_trees, dtype=np.float64)
+        for start, stop, rows in iter_row_blocks(self.distance_matrix):
+            core_distances[start:stop] = np.partition(rows, min_samples - 1, axis=1)[
+                :, min_samples - 1
+            ]
+        return core_distances
+
+    def with_min_samples(self, min_samples: int) -> "DensityHierarchy":
+        """
+        Returns the hierarchy for another value of min_samples.
+        The nearest distances are shared, only the core distances are recalculated.
+        """
+        density_hierarchy = copy.copy(self)
+        density_hierarchy.min_samples = min_samples
+        density_hierarchy.core_distances = self.calculate_core_distances(min_samples)
+        return density_hierarchy
+
+    def neighborhood_graph(self, eps: float) -> NeighborhoodGraph:
+        """
+        Collects the neighborhoods of all core points for eps in one pass over the rows.
+        The graph can be passed to labels() of every hierarchy of the same distance
+        matrix, whose min_samples is at least as large as the one of this hierarchy,
+        as their core points are a subset of the core points of this one.
+        """
+        is_core = self.core_distances <= eps
+        counts = np.zeros(len(is_core), dtype=np.int64)
+        blocks = []
+        for start, stop, rows in iter_row_blocks(self.distance_matrix):
+            core_rows = np.flatnonzero(is_core[start:stop])
+            within_eps = np.asarray(rows)[core_rows] <= eps
+            counts[start + core_rows] = within_eps.sum(axis=1)
+            blocks.append(np.nonzero(within_eps)[1].astype(np.int32))
+        indptr = np.concatenate([[0], np.cumsum(counts)])
+        return NeighborhoodGraph(indptr, np.concatenate(blocks))
+
+    def labels(
+        self, eps: float, neighborhood_graph: NeighborhoodGraph = None  # type: ignore
+    ) -> npt.NDArray[np.intp]:
+        """
+        Extracts the DBSCAN cluster labels for eps. Noise is labeled with -1.
+        Clusters are expanded in the same order as sklearn does, so border points
+        reachable from several clusters end up in the same cluster as with DBSCAN.
+        A neighborhood graph of the same eps saves the pass over the rows.
+        """
+        if neighborhood_graph is None:
+            neighborhood_graph = self.neighborhood_graph(eps)
+        is_core = self.core_distances <= eps
+        labels = np.full(len(self.core_distances), -1, dtype=np.intp)
+        label_num = 0
+        for start in np.flatnonzero(is_core):
+            if labels[start] != -1:
+                continue
+            labels[start] = label_num
+            stack = [start]
+            while stack:
+                neighbors = neighborhood_graph.neighbors(stack.pop())
+                unlabeled = neighbors[labels[neighbors] == -1]
+                labels[unlabeled] = label_num
+                stack.extend(unlabeled[is_core[unlabeled]])
+            label_num += 1
+        return labels
+
+    def memory_footprint(self) -> int:
+        """
+        The distance matrix is cached on its own and not counted here.
+        """
+        return self.nearest_distances.nbytes + self.core_distances.nbytes
@@ -0,0 +1,311 @@
+"""
+numpy stores every completed shard of the condensed distances in a file of its own.
+pickle stores the trees of a job, so that workers outside of the dashboard can load them.
+ged_telemetry keeps the elapsed time of every pair and whether it timed out next to the
+finished matrix.
+profiling samples the workers, while a rerun of the dashboard is profiled.
+file_lock coordinates all processes working on the same job, which may run in
+different containers on a shared volume.
+worker_pool runs the shards in long lived worker processes, shutil removes finished jobs.
+argparse provides the command line of standalone workers, e.g. docker-compose replicas:
+    python distance_shards.py --directory pickle
+"""
+import argparse
+import os
+import pickle
+import shutil
+import time
+from functools import partial
+from pathlib import Path
+from typing import Callable
+
+import networkx as nx
+import numpy as np
+
+from condensed_distance import (
+    CondensedDistanceMatrix,
+    condensed_pairs,
+    temporary_path,
+)
+from file_lock import POLL_SECONDS, FileLock
+from ged_telemetry import GEDTelemetry
+from graph_edit_distance import GED_TIMEOUT, timed_tree_distance
+from profiling import capture_stopped, profile_worker
+from worker_pool import WorkerPool, get_worker_pool
+
+# Number of consecutive pairs of trees calculated and checkpointed together
+SHARD_PAIRS = 128
+JOB_SUFFIX = ".shards"
+# Jobs a worker keeps loaded, the least recently used one is dropped first
+OPEN_JOBS = 2
+
+
+class DistanceJob:
+    """
+    Calculation of one condensed distance matrix, split into shards of SHARD_PAIRS
+    consecutive pairs. The job lives in a directory next to the final file:
+    - job.pickle: the trees and the shard size,
+    - create.lock: the claim of the process, that writes job.pickle,
+    - shard_00000.npy: the distances of a completed shard,
+    - shard_00000_elapsed.npy: the seconds spent on each of its pairs,
+    - shard_00000_timed_out.npy: whether the calculation of each of its pairs timed out,
+    - shard_00000.lock: the claim of a shard, that is being calculated,
+    - assemble.lock: the claim of the process, that assembles the final file.
+    Completed shards survive restarts and crashes of every process. Only the shards in
+    progress are lost and claimed again by another process, once their locks are stale.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.directory = self.path.with_name(self.path.name + JOB_SUFFIX)
+        self._definition = None
+
+    @classmethod
+    def create(
+        cls, path: Path, graphs: list[nx.DiGraph], shard_pairs: int = SHARD_PAIRS
+    ) -> "DistanceJob":
+        """
+        Creates the job directory, unless another process already did, or opens it.
+        The shard size of an existing job is kept, so that its shards stay valid.
+        The definition is written under create.lock, so that processes creating the
+        same job at once write it only once.
+        """
+        job = cls(path)
+        job.directory.mkdir(parents=True, exist_ok=True)
+        definition_path = job.directory.joinpath("job.pickle")
+        if definition_path.exists():
+            return job
+        with FileLock(job.directory.joinpath("create.lock")):
+            if not definition_path.exists():
+                with open(temporary_path(definition_path), "wb") as outfile:
+                    pickle.dump({"graphs": graphs, "shard_pairs": shard_pairs}, outfile)
+                os.replace(temporary_path(definition_path), definition_path)
+        return job
+
+    @property
+    def definition(self) -> dict:
+        if self._definition is None:
+            with open(self.directory.joinpath("job.pickle"), "rb") as infile:
+                self._definition = pickle.load(infile)
+        return self._definition
+
+    @property
+    def graphs(self) -> list[nx.DiGraph]:
+        return self.definition["graphs"]
+
+    @property
+    def shard_pairs(self) -> int:
+        return self.definition["shard_pairs"]
+
+    @property
+    def n_trees(self) -> int:
+        return len(self.graphs)
+
+    @property
+    def n_shards(self) -> int:
+        n_pairs = CondensedDistanceMatrix.condensed_length(self.n_trees)
+        return -(-n_pairs // self.shard_pairs)
+
+    def shard_range(self, shard: int) -> tuple[int, int]:
+        n_pairs = CondensedDistanceMatrix.condensed_length(self.n_trees)
+        return shard * self.shard_pairs, min((shard + 1) * self.shard_pairs, n_pairs)
+
+    def shard_path(self, shard: int) -> Path:
+        return self.directory.joinpath(f"shard_{shard:05d}.npy")
+
+    def elapsed_path(self, shard: int) -> Path:
+        return self.directory.joinpath(f"shard_{shard:05d}_elapsed.npy")
+
+    def timed_out_path(self, shard: int) -> Path:
+        return self.directory.joinpath(f"shard_{shard:05d}_timed_out.npy")
+
+    def pending_shards(self) -> list[int]:
+        return [
+            shard
+            for shard in range(self.n_shards)
+            if not self.shard_path(shard).exists()
+        ]
+
+    def complete(self) -> bool:
+        return self.path.exists() or not self.pending_shards()
+
+    def compute_shard(self, shard: int) -> bool:
+        """
+        Calculates and checkpoints a shard, if no other process claimed it.
+        Returns whether the shard is completed.
+        """
+        if self.path.exists():
+            # Already assembled by another process
+            return True
+        lock = FileLock(self.directory.joinpath(f"shard_{shard:05d}.lock"))
+        if not lock.acquire(blocking=False):
+            return False
+        try:
+            shard_path = self.shard_path(shard)
+            if shard_path.exists():
+                return True
+            rows, columns = condensed_pairs(*self.shard_range(shard), self.n_trees)
+            distances = np.empty(len(rows), dtype=np.float32)
+            elapsed = np.empty(len(rows), dtype=np.float32)
+            timed_out = np.empty(len(rows), dtype=bool)
+            for pair, (row, column) in enumerate(zip(rows, columns)):
+                distances[pair], elapsed[pair], timed_out[pair] = timed_tree_distance(
+                    self.graphs[row], self.graphs[column]
+                )
+                lock.refresh()
+            # Written first, as the distances mark the shard as completed
+            np.save(self.elapsed_path(shard), elapsed)
+            np.save(self.timed_out_path(shard), timed_out)
+            with open(temporary_path(shard_path), "wb") as outfile:
+                np.save(outfile, distances)
+            os.replace(temporary_path(shard_path), shard_path)
+            return True
+        finally:
+            lock.release()
+
+    def assemble(self) -> CondensedDistanceMatrix:
+        """
+        Combines the completed shards into the final file and its telemetry, and
+        removes the job. Only one process assembles, the others wait for it and open
+        the result.
+        """
+        try:
+            with FileLock(self.directory.joinpath("assemble.lock")):
+                if not self.path.exists():
+                    condensed = CondensedDistanceMatrix.create(self.path, self.n_trees)
+                    n_pairs = CondensedDistanceMatrix.condensed_length(self.n_trees)
+                    elapsed = np.full(n_pairs, np.nan, dtype=np.float32)
+                    timed_out = np.zeros(n_pairs, dtype=bool)
+                    for shard in range(self.n_shards):
+                        start, stop = self.shard_range(shard)
+                        condensed[start:stop] = np.load(self.shard_path(shard))
+                        if self.elapsed_path(shard).exists():
+                            elapsed[start:stop] = np.load(self.elapsed_path(shard))
+                        if self.timed_out_path(shard).exists():
+                            timed_out[start:stop] = np.load(self.timed_out_path(shard))
+                        else:
+                            # Shards of workers, that did not record the flag yet
+                            timed_out[start:stop] = elapsed[start:stop] >= GED_TIMEOUT
+                    GEDTelemetry(
+                        elapsed,
+                        np.array(
+                            [graph.number_of_nodes() for graph in self.graphs],
+                            dtype=np.int32,
+                        ),
+                        GED_TIMEOUT,
+                        timed_out,
+                    ).save(self.path)
+                    CondensedDistanceMatrix.finalize(self.path, condensed, self.n_trees)
+        except FileNotFoundError:
+            # Another process assembled the file and removed the job in the meantime
+            if not self.path.exists():
+                raise
+        shutil.rmtree(self.directory, ignore_errors=True)
+        return CondensedDistanceMatrix(self.path)
+
+
+# Jobs opened by this process, so that pool workers load the trees only once per job,
+# ordered from the least to the most recently used
+_open_jobs: dict[Path, DistanceJob] = {}
+
+
+def compute_shard(path: Path, shard: int, profile_directory: Path = None) -> bool:  # type: ignore
+    """
+    Entry point of the pool workers.
+    With a profile_directory, the calculation is sampled and the samples are stored
+    there, while its capture is running, see profiling.ProfileCapture.
+    """
+    job = _open_jobs.pop(path, None) or DistanceJob(path)
+    _open_jobs[path] = job
+    while len(_open_jobs) > OPEN_JOBS:
+        del _open_jobs[next(iter(_open_jobs))]
+    if profile_directory is None or capture_stopped(profile_directory):
+        return job.compute_shard(shard)
+    with profile_worker(profile_directory, f"shard_{shard:05d}"):
+        return job.compute_shard(shard)
+
+
+def run_job(
+    job: DistanceJob,
+    pool: WorkerPool = None,  # type: ignore
+    progress: Callable[[float], None] = None,  # type: ignore
+    profile_directory: Path = None,  # type: ignore
+) -> CondensedDistanceMatrix:
+    """
+    Works on the pending shards of the job with the pool, by default the pool shared by
+    the whole process, until all shards are completed, also those claimed by other
+    processes, and assembles the result.
+    progress is called with the share of completed shards.
+    The pool workers are profiled into profile_directory, if it is given.
+    """
+    pool = pool or get_worker_pool()
+    worker = partial(compute_shard, job.path, profile_directory=profile_directory)
+    while not job.complete():
+        for _ in pool.map_unordered(worker, job.pending_shards()):
+            if progress is not None:
+                progress(1 - len(job.pending_shards()) / job.n_shards)
+        if not job.complete():
+            # The remaining shards are calculated by other processes
+            time.sleep(POLL_SECONDS)
+    return job.assemble()
+
+
+def find_jobs(directory: Path) -> list[DistanceJob]:
+    return [
+        DistanceJob(job_directory.with_name(job_directory.name[: -len(JOB_SUFFIX)]))
+        for job_directory in sorted(Path(directory).glob(f"*{JOB_SUFFIX}"))
+        if job_directory.joinpath("job.pickle").exists()
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Calculates the distance matrix jobs, that the dashboard created."
+    )
+    parser.add_argument(
+        "--directory",
+        type=Path,
+        default=Path(__file__).resolve().parent.joinpath("pickle"),
+        help="Directory of the distance matrices and their jobs.",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=None,
+        help="Worker processes of this worker, defaults to the number of CPUs.",
+    )
+    parser.add_argument(
+        "--poll",
+        type=float,
+        default=5.0,
+        help="Seconds between looking for new jobs.",
+    )
+    parser.add_argument(
+        "--once",
+        action="store_true",
+        help="Exit once there are no more jobs, instead of waiting for new ones.",
+    )
+    args = parser.parse_args()
+    pool = WorkerPool(args.processes)
+    while True:
+        jobs = find_jobs(args.directory)
+        for job in jobs:
+            run_job(job, pool)
+            telemetry = GEDTelemetry.load(job.path)
+            if telemetry is None:
+                # Assembled by a process, that did not record the telemetry
+                print(f"Completed {job.path.name}")
+                continue
+            summary = telemetry.summary()
+            print(
+                f"Completed {job.path.name}, {summary.get('timeouts', 0)} of "
+                f"{summary['pairs']} pairs hit the timeout"
+            )
+        if args.once and not jobs:
+            break
+        time.sleep(args.poll)
+    pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,353 @@
+"""
+numpy computes the eigendecompositions of the classical MDS and spectral embeddings.
+sklearn provides the t-SNE embedding.
+The memory manager caches t-SNE embeddings between reruns, the shared cache between
+dashboard replicas.
+stage_timer records, whether the t-SNE embedding was calculated or taken from a cache.
+worker_pool fits the t-SNE embeddings of the gallery concurrently.
+"""
+import itertools
+
+import numpy as np
+import numpy.typing as npt
+from sklearn.manifold import TSNE
+
+from memory_manager import get_memory_manager, get_session_id
+from shared_cache import get_shared_cache
+from stage_timer import record_cache
+from worker_pool import WorkerPool
+
+TSNE_SEED = 123
+# t-SNE runs initialized from a cached embedding need far fewer iterations.
+# sklearn requires at least 250, which are spent in the early exaggeration phase.
+WARM_START_N_ITER = 500
+# Ranges of the learning rate, perplexity and early exaggeration sliders
+TSNE_SLIDER_RANGES = (499.0, 45.0, 48.0)
+# Bounds of the perplexity and early exaggeration sliders
+TSNE_PERPLEXITY_BOUNDS = (5, 50)
+TSNE_EARLY_EXAGGERATION_BOUNDS = (2.0, 50.0)
+# The gallery scales the perplexity and the early exaggeration of the sidebar by these
+# factors. The learning rate is kept, as it changes the results the most.
+TSNE_GALLERY_FACTORS = (0.5, 1.0, 2.0)
+
+
+class EmbeddingBackend:
+    """
+    Projects the trees into two dimensions, based on their pairwise distances.
+    Subclasses implement embed() and are registered in EMBEDDING_BACKENDS.
+    The embeddings of deterministic backends only depend on the distances, so callers
+    cache them by the fingerprint of the distances. The others cache their embeddings
+    themselves, along with their parameters and seed.
+    """
+
+    name = ""
+    deterministic = True
+
+    def embed(
+        self, distance_matrix: npt.NDArray[np.float64], distance_fingerprint: str
+    ) -> npt.NDArray[np.float32]:
+        """
+        Returns an array of shape (n_trees, 2).
+        The fingerprint identifies the distance matrix for backends that cache.
+        """
+        raise NotImplementedError
+
+
+class ClassicalMDSBackend(EmbeddingBackend):
+    """
+    Classical (Torgerson) multidimensional scaling.
+    The double centered squared distances are decomposed and the two largest
+    eigenvectors, scaled by the root of their eigenvalues, are the coordinates.
+    """
+
+    name = "Classical MDS"
+
+    def embed(
+        self, distance_matrix: npt.NDArray[np.float64], distance_fingerprint: str
+    ) -> npt.NDArray[np.float32]:
+        squared_distances = symmetrize(distance_matrix) ** 2
+        # Double centering, without building the centering matrix
+        gram = -0.5 * (
+            squared_distances
+            - squared_distances.mean(axis=0)
+            - squared_distances.mean(axis=1)[:, np.newaxis]
+            + squared_distances.mean()
+        )
+        eigenvalues, eigenvectors = np.linalg.eigh(gram)
+        # eigh returns the eigenvalues in ascending order
+        eigenvalues = np.clip(eigenvalues[::-1][:2], 0, None)
+        coordinates = eigenvectors[:, ::-1][:, :2] * np.sqrt(eigenvalues)
+        return fix_signs(coordinates).astype(np.float32)
+
+
+class SpectralBackend(EmbeddingBackend):
+    """
+    Laplacian eigenmaps on a gaussian affinity of the distances.
+    The kernel width is the median of the distances between different trees.
+    """
+
+    name = "Spectral"
+
+    def embed(
+        self, distance_matrix: npt.NDArray[np.float64], distance_fingerprint: str
+    ) -> npt.NDArray[np.float32]:
+        distances = symmetrize(distance_matrix)
+        off_diagonal = distances[~np.eye(distances.shape[0], dtype=bool)]
+        width = np.median(off_diagonal[off_diagonal > 0]) if off_diagonal.any() else 1
+        affinity = np.exp(-(distances**2) / (2 * width**2))
+        degree_root = np.sqrt(affinity.sum(axis=1))
+        normalized_affinity = affinity / np.outer(degree_root, degree_root)
+        # The largest eigenvectors of the normalized affinity are the smallest of the
+        # normalized laplacian. The first one is trivial and skipped.
+        _, eigenvectors = np.linalg.eigh(normalized_affinity)
+        coordinates = eigenvectors[:, ::-1][:, 1:3] / degree_root[:, np.newaxis]
+        return fix_signs(coordinates).astype(np.float32)
+
+
+class TSNEBackend(EmbeddingBackend):
+    """
+    t-SNE on the precomputed distances, using the parameters from the sidebar.
+    Embeddings are cached per distance matrix, parameters and seed. If only the
+    parameters changed, the run starts from the cached embedding with the closest
+    parameters and uses fewer iterations.
+    """
+
+    name = "t-SNE"
+    deterministic = False
+
+    def __init__(
+        self,
+        learning_rate: float = 73.0,
+        perplexity: int = 5,
+        early_exaggeration: float = 35.0,
+        seed: int = TSNE_SEED,
+    ):
+        self.learning_rate = float(learning_rate)
+        self.perplexity = int(perplexity)
+        self.early_exaggeration = float(early_exaggeration)
+        self.seed = seed
+
+    def cache_key(self, n_trees: int, distance_fingerprint: str) -> tuple:
+        """
+        Key of the embedding in the memory manager. The namespace is left out in the
+        shared cache.
+        """
+        # Perplexity has to be smaller than the number of trees
+        perplexity = min(self.perplexity, n_trees - 1)
+        return (
+            "tsne_embedding",
+            distance_fingerprint,
+            self.learning_rate,
+            perplexity,
+            self.early_exaggeration,
+            self.seed,
+        )
+
+    def embed(
+        self, distance_matrix: npt.NDArray[np.float64], distance_fingerprint: str
+    ) -> npt.NDArray[np.float32]:
+        memory_manager = get_memory_manager()
+        cache_key = self.cache_key(distance_matrix.shape[0], distance_fingerprint)
+        embedding = memory_manager.get(cache_key)
+        if embedding is None:
+            # Other replicas may have computed the same embedding already
+            embedding = get_shared_cache().get_or_compute(
+                "tsne_embedding",
+                cache_key[1:],
+                lambda: self.fit(distance_matrix, distance_fingerprint),
+            )
+            memory_manager.put(cache_key, embedding, get_session_id())
+        # Only a hit, unless fit() recorded a miss
+        record_cache(True)
+        return embedding
+
+    def fit(
+        self, distance_matrix: npt.NDArray[np.float64], distance_fingerprint: str
+    ) -> npt.NDArray[np.float32]:
+        record_cache(False)
+        return fit_tsne(self.tsne_task(distance_matrix, distance_fingerprint))
+
+    def tsne_task(
+        self, distance_matrix: npt.NDArray[np.float64], distance_fingerprint: str
+    ) -> tuple:
+        """
+        Arguments of fit_tsne(), which can run in another process.
+        The run is warm started from the nearest cached embedding, if there is one.
+        """
+        parameters = self.cache_key(distance_matrix.shape[0], distance_fingerprint)[2:]
+        warm_start_embedding = self.nearest_cached_embedding(
+            distance_fingerprint, parameters[:3]
+        )
+        if warm_start_embedding is None:
+            init, n_iter = "random", 1000
+        else:
+            # Rescaled the same way sklearn rescales its PCA initialization
+            init = warm_start_embedding / np.std(warm_start_embedding[:, 0]) * 1e-4
+            n_iter = WARM_START_N_ITER
+        return (
+            np.asarray(distance_matrix, dtype=np.float64),
+            *parameters,
+            init,
+            n_iter,
+        )
+
+    def gallery_backends(self) -> list["TSNEBackend"]:
+        """
+        Backends for the grid of parameters around the parameters of this backend,
+        row by row from the smallest to the largest perplexity. Values are rounded to
+        the steps of the sidebar sliders and clipped to their bounds.
+        """
+        backends = {}
+        for perplexity_factor, exaggeration_factor in itertools.product(
+            TSNE_GALLERY_FACTORS, repeat=2
+        ):
+            perplexity = int(
+                np.clip(
+                    round(self.perplexity * perplexity_factor), *TSNE_PERPLEXITY_BOUNDS
+                )
+            )
+            early_exaggeration = float(
+                np.clip(
+                    round(self.early_exaggeration * exaggeration_factor),
+                    *TSNE_EARLY_EXAGGERATION_BOUNDS,
+                )
+            )
+            backends[perplexity, early_exaggeration] = TSNEBackend(
+                self.learning_rate, perplexity, early_exaggeration, self.seed
+            )
+        return list(backends.values())
+
+    def gallery(
+        self,
+        distance_matrix: npt.NDArray[np.float64],
+        distance_fingerprint: str,
+        pool: WorkerPool,
+    ) -> list[tuple["TSNEBackend", npt.NDArray[np.float32]]]:
+        """
+        Embeddings of the gallery_backends(). The missing ones are fitted concurrently
+        in the pool and cached like the embeddings of embed(), so adopting the
+        parameters of a thumbnail reuses its embedding.
+        """
+        memory_manager = get_memory_manager()
+        shared_cache = get_shared_cache()
+        n_trees = distance_matrix.shape[0]
+        embeddings = {}
+        tasks = []
+        for backend in self.gallery_backends():
+            cache_key = backend.cache_key(n_trees, distance_fingerprint)
+            embedding = memory_manager.get(cache_key)
+            if embedding is None:
+                embedding = shared_cache.get("tsne_embedding", cache_key[1:])
+            if embedding is None:
+                tasks.append(
+                    (
+                        cache_key,
+                        backend.tsne_task(distance_matrix, distance_fingerprint),
+                    )
+                )
+            else:
+                embeddings[cache_key] = memory_manager.put(
+                    cache_key, embedding, get_session_id()
+                )
+        record_cache(not tasks)
+        for cache_key, embedding in pool.map_unordered(fit_gallery_embedding, tasks):
+            shared_cache.publish("tsne_embedding", cache_key[1:], embedding)
+            embeddings[cache_key] = memory_manager.put(
+                cache_key, embedding, get_session_id()
+            )
+        return [
+            (
+                backend,
+                embeddings[backend.cache_key(n_trees, distance_fingerprint)],
+            )
+            for backend in self.gallery_backends()
+        ]
+
+    def nearest_cached_embedding(self, distance_fingerprint: str, parameters: tuple):
+        """
+        Returns the cached embedding of the same distance matrix, whose t-SNE parameters
+        are closest to the given ones, or None if there is none.
+        Parameter differences are weighted by the range of their sidebar slider.
+        """
+        memory_manager = get_memory_manager()
+        candidates = [
+            key
+            for key in memory_manager.keys("tsne_embedding")
+            if key[1] == distance_fingerprint and key[-1] == self.seed
+        ]
+        if not candidates:
+            return None
+        nearest_key = min(
+            candidates,
+            key=lambda key: sum(
+                abs(cached - wanted) / slider_range
+                for cached, wanted, slider_range in zip(
+                    key[2:5], parameters, TSNE_SLIDER_RANGES
+                )
+            ),
+        )
+        return memory_manager.get(nearest_key)
+
+
+def fit_tsne(task: tuple) -> npt.NDArray[np.float32]:
+    """
+    Runs t-SNE for a task of TSNEBackend.tsne_task().
+    """
+    (
+        distance_matrix,
+        learning_rate,
+        perplexity,
+        early_exaggeration,
+        seed,
+        init,
+        n_iter,
+    ) = task
+    tsne = TSNE(
+        n_components=2,
+        perplexity=perplexity,
+        early_exaggeration=early_exaggeration,
+        learning_rate=learning_rate,
+        n_iter=n_iter,
+        random_state=seed,
+        metric="precomputed",
+        init=init,
+        verbose=0,
+    )
+    return tsne.fit_transform(distance_matrix).astype(np.float32)
+
+
+def fit_gallery_embedding(
+    item: tuple[tuple, tuple]
+) -> tuple[tuple, npt.NDArray[np.float32]]:
+    """
+    Entry point of the pool workers, returns the cache key with the embedding.
+    """
+    cache_key, task = item
+    return cache_key, fit_tsne(task)
+
+
+EMBEDDING_BACKENDS = {
+    backend.name: backend
+    for backend in [ClassicalMDSBackend, SpectralBackend, TSNEBackend]
+}
+
+
+def symmetrize(distance_matrix: npt.NDArray[np.float64]) -> npt.NDArray[np.float64]:
+    """
+    The column wise scaled distance matrix is not exactly symmetric, the eigen
+    decompositions need it to be. Condensed distance matrices are materialized here.
+    """
+    distance_matrix = np.asarray(distance_matrix, dtype=np.float64)
+    return (distance_matrix + distance_matrix.T) / 2
+
+
+def fix_signs(coordinates: npt.NDArray[np.float64]) -> npt.NDArray[np.float64]:
+    """
+    Eigenvectors are only defined up to their sign. Flipping every component so that
+    its largest absolute coordinate is positive keeps the projection stable between
+    reruns.
+    """
+    largest = coordinates[
+        np.argmax(np.abs(coordinates), axis=0), range(coordinates.shape[1])
+    ]
+    return coordinates * np.where(largest < 0, -1, 1)
@@ -0,0 +1,150 @@
+"""
+os creates the lock files exclusively, which is atomic on local and shared volumes.
+socket and os identify the owner of a lock, so that locks of crashed processes can be
+recovered.
+time is used for waiting and for the heartbeat of held locks.
+threading refreshes locks in the background, while their owner is busy.
+uuid names stale locks while they are removed.
+"""
+import os
+import socket
+import threading
+import time
+import uuid
+from pathlib import Path
+
+# Locks without a heartbeat for this many seconds are considered abandoned
+STALE_LOCK_SECONDS = 120
+POLL_SECONDS = 0.5
+
+
+class FileLock:
+    """
+    Lock between processes, that may run in different containers, as long as they
+    share the directory of the lock file.
+    The lock file contains the host name and the process id of its owner. A lock is
+    stale, if its owner runs on the same host and does not exist anymore, or if the
+    owner did not refresh() the lock for stale_seconds. Stale locks are broken by the
+    next process that tries to acquire them.
+    With heartbeat=True, a background thread refreshes the lock while it is held, for
+    owners that can't call refresh() themselves during long calculations.
+
+    Usage:
+        with FileLock(path):
+            ...
+    or, without waiting:
+        lock = FileLock(path)
+        if lock.acquire(blocking=False):
+            try:
+                ...
+            finally:
+                lock.release()
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        stale_seconds: float = STALE_LOCK_SECONDS,
+        heartbeat: bool = False,
+    ):
+        self.path = Path(path)
+        self.stale_seconds = stale_seconds
+        self.heartbeat = heartbeat
+        self.owner = f"{socket.gethostname()} {os.getpid()}"
+        self.locked = False
+        self._released = threading.Event()
+
+    def acquire(self, blocking: bool = True, timeout: float = None) -> bool:  # type: ignore
+        """
+        Tries to create the lock file. Returns whether the lock was acquired.
+        Blocking calls wait until the lock is free, or until the timeout passed.
+        """
+        start = time.monotonic()
+        while True:
+            try:
+                descriptor = os.open(
+                    self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644
+                )
+            except FileExistsError:
+                if self.is_stale():
+                    self.break_lock()
+                    continue
+                if not blocking or (
+                    timeout is not None and time.monotonic() - start >= timeout
+                ):
+                    return False
+                time.sleep(POLL_SECONDS)
+                continue
+            with os.fdopen(descriptor, "w") as lock_file:
+                lock_file.write(self.owner)
+            self.locked = True
+            if self.heartbeat:
+                self._released.clear()
+                threading.Thread(target=self.beat, daemon=True).start()
+            return True
+
+    def beat(self):
+        while not self._released.wait(self.stale_seconds / 4):
+            try:
+                self.refresh()
+            except FileNotFoundError:
+                return
+
+    def release(self):
+        if self.locked:
+            self.locked = False
+            self._released.set()
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+    def refresh(self):
+        """
+        Heartbeat of the owner, which keeps a long held lock from becoming stale.
+        """
+        if self.locked:
+            os.utime(self.path)
+
+    def is_stale(self) -> bool:
+        try:
+            modified = self.path.stat().st_mtime
+            owner = self.path.read_text()
+        except FileNotFoundError:
+            # Released in the meantime, so the next attempt can acquire it
+            return False
+        host, _, pid = owner.partition(" ")
+        if host == socket.gethostname() and pid.isdigit():
+            if not process_exists(int(pid)):
+                return True
+        return time.time() - modified > self.stale_seconds
+
+    def break_lock(self):
+        """
+        Removes a stale lock. It is renamed first, so that only one of several
+        processes, that found the same stale lock, removes it.
+        """
+        broken_path = self.path.with_name(f"{self.path.name}.{uuid.uuid4().hex}.stale")
+        try:
+            os.rename(self.path, broken_path)
+        except FileNotFoundError:
+            return
+        os.remove(broken_path)
+
+    def __enter__(self) -> "FileLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+def process_exists(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # The process exists, but belongs to someone else
+        return True
+    return True
@@ -0,0 +1,46 @@
+"""
+sklearn grows a fitted random forest with warm_start, so changing the number of trees
+only fits the added trees. copy shares the fitted trees between the forests of all sizes.
+The trees of a forest with a fixed random_state don't depend on the number of trees, so
+a grown or sliced forest is identical to a forest fitted from scratch.
+This module does not depend on streamlit.
+"""
+import copy
+
+import numpy as np
+import numpy.typing as npt
+from sklearn.ensemble import RandomForestClassifier
+
+# Attributes of the out of bag estimate, which only hold for the forest they were
+# calculated for
+_OOB_ATTRIBUTES = ("oob_score_", "oob_decision_function_")
+
+
+def resize_forest(
+    forest: RandomForestClassifier,
+    n_estimators: int,
+    x: npt.NDArray[np.float64],
+    y: npt.NDArray,
+) -> tuple[RandomForestClassifier, int]:
+    """
+    Returns a forest of n_estimators trees, whose first trees are those of the fitted
+    forest, and the number of trees, that were fitted for it.
+    A smaller forest is sliced, without an out of bag estimate. A larger one fits the
+    missing trees on x and y, which have to be the data the forest was fitted on, and
+    calculates the out of bag estimate, if the forest has one.
+    The given forest is not changed.
+    """
+    resized = copy.copy(forest)
+    if n_estimators <= len(forest.estimators_):
+        resized.estimators_ = forest.estimators_[:n_estimators]
+        resized.n_estimators = n_estimators
+        if n_estimators < len(forest.estimators_):
+            for attribute in _OOB_ATTRIBUTES:
+                resized.__dict__.pop(attribute, None)
+        return resized, 0
+    # fit() appends the new trees to the list, which must not be the list of forest
+    resized.estimators_ = list(forest.estimators_)
+    resized.set_params(n_estimators=n_estimators, warm_start=True)
+    resized.fit(x, y)
+    resized.set_params(warm_start=forest.warm_start)
+    return resized, n_estimators - len(forest.estimators_)
@@ -0,0 +1,151 @@
+"""
+numpy stores the elapsed time of every graph edit distance and whether it timed out in
+a compressed side file next to the condensed distance matrix, in the same condensed
+order.
+pandas prepares the summaries for the dashboard.
+This module does not depend on streamlit, the distance workers write the telemetry.
+"""
+import os
+from pathlib import Path
+from typing import Union
+
+import numpy as np
+import numpy.typing as npt
+import pandas as pd
+
+from condensed_distance import temporary_path
+
+TELEMETRY_SUFFIX = ".telemetry.npz"
+
+
+def telemetry_path(path: Path) -> Path:
+    """
+    Side file of the distance matrix at path.
+    """
+    return Path(path).with_suffix(TELEMETRY_SUFFIX)
+
+
+class GEDTelemetry:
+    """
+    Cost of the graph edit distances of one distance matrix:
+    - elapsed: seconds spent on every pair of trees, in condensed order. NaN for pairs
+      calculated before the telemetry was recorded.
+    - tree_nodes: number of nodes of every tree.
+    - timeout: the timeout of the calculation.
+    - timed_out: whether the calculation of every pair was cut off by the timeout, as
+      reported by the calculation, so its distance is only an upper bound, or NaN.
+      Telemetry recorded without it takes the pairs, that took at least the timeout.
+    """
+
+    def __init__(
+        self,
+        elapsed: npt.NDArray[np.float32],
+        tree_nodes: npt.NDArray[np.int32],
+        timeout: float,
+        timed_out: Union[npt.NDArray[np.bool_], None] = None,
+    ):
+        self.elapsed = elapsed
+        self.tree_nodes = tree_nodes
+        self.timeout = timeout
+        self.timed_out = elapsed >= timeout if timed_out is None else timed_out
+
+    @classmethod
+    def load(cls, path: Path) -> Union["GEDTelemetry", None]:
+        """
+        Telemetry of the distance matrix at path, or None if it was not recorded.
+        """
+        try:
+            with np.load(telemetry_path(path)) as telemetry:
+                return cls(
+                    telemetry["elapsed"],
+                    telemetry["tree_nodes"],
+                    float(telemetry["timeout"]),
+                    telemetry["timed_out"] if "timed_out" in telemetry else None,
+                )
+        except FileNotFoundError:
+            return None
+
+    def save(self, path: Path):
+        side_path = telemetry_path(path)
+        with open(temporary_path(side_path), "wb") as outfile:
+            np.savez_compressed(
+                outfile,
+                elapsed=self.elapsed,
+                tree_nodes=self.tree_nodes,
+                timeout=np.float32(self.timeout),
+                timed_out=self.timed_out,
+            )
+        os.replace(temporary_path(side_path), side_path)
+
+    def pair_df(self) -> pd.DataFrame:
+        """
+        One row per pair of trees, with the elapsed milliseconds, whether the pair hit
+        the timeout and the summed number of nodes of both trees.
+        """
+        tree_x, tree_y = np.triu_indices(len(self.tree_nodes), k=1)
+        return pd.DataFrame(
+            {
+                "tree_x": tree_x,
+                "tree_y": tree_y,
+                "elapsed_ms": self.elapsed * 1e3,
+                "timed_out": self.timed_out,
+                "pair_nodes": self.tree_nodes[tree_x] + self.tree_nodes[tree_y],
+            }
+        )
+
+    def summary(self) -> dict:
+        is_measured = ~np.isnan(self.elapsed)
+        measured = self.elapsed[is_measured]
+        if len(measured) == 0:
+            return {"pairs": len(self.elapsed), "measured": 0}
+        timed_out = self.timed_out[is_measured]
+        return {
+            "pairs": len(self.elapsed),
+            "measured": len(measured),
+            "timeouts": int(np.count_nonzero(timed_out)),
+            "timeout_rate": float(np.mean(timed_out)),
+            "total_s": float(measured.sum()),
+            "median_ms": float(np.median(measured)) * 1e3,
+            "p95_ms": float(np.percentile(measured, 95)) * 1e3,
+            "max_ms": float(measured.max()) * 1e3,
+        }
+
+    def histogram_df(self, bins: int = 30) -> pd.DataFrame:
+        """
+        Number of pairs per range of elapsed milliseconds. The ranges grow
+        logarithmically, as most pairs are fast and a few run into the timeout.
+        """
+        elapsed_ms = self.elapsed[~np.isnan(self.elapsed)] * 1e3
+        if len(elapsed_ms) == 0:
+            return pd.DataFrame(columns=["start_ms", "end_ms", "pairs"])
+        low = max(float(elapsed_ms.min()), 1e-3)
+        high = max(float(elapsed_ms.max()), low * 1.01)
+        edges = np.geomspace(low, high, bins + 1)
+        counts, _ = np.histogram(elapsed_ms.clip(low, high), edges)
+        return pd.DataFrame(
+            {"start_ms": edges[:-1], "end_ms": edges[1:], "pairs": counts}
+        )
+
+    def worst_pairs(self, k: int = 10) -> pd.DataFrame:
+        pair_df = self.pair_df()
+        return pair_df.nlargest(k, "elapsed_ms").reset_index(drop=True)
+
+    def timeout_rate_by_size(self, bins: int = 10) -> pd.DataFrame:
+        """
+        Share of pairs that hit the timeout and median milliseconds, for ranges of the
+        summed number of nodes of both trees, each holding about the same number of pairs.
+        """
+        pair_df = self.pair_df().dropna(subset=["elapsed_ms"])
+        if pair_df.empty:
+            return pd.DataFrame(
+                columns=["pair_nodes", "pairs", "timeout_rate", "median_ms"]
+            )
+        pair_df["pair_nodes"] = pd.qcut(pair_df["pair_nodes"], bins, duplicates="drop")
+        by_size = pair_df.groupby("pair_nodes", observed=True).agg(
+            pairs=("elapsed_ms", "size"),
+            timeout_rate=("timed_out", "mean"),
+            median_ms=("elapsed_ms", "median"),
+        )
+        by_size = by_size.reset_index()
+        by_size["pair_nodes"] = by_size["pair_nodes"].astype(str)
+        return by_size
@@ -0,0 +1,86 @@
+"""
+networkx calculates the graph edit distance between two trees.
+ast and re parse the node labels, that graphviz generated from the sklearn trees.
+numpy holds the distances, time measures how long each of them took.
+This module does not depend on streamlit, so that it can be used by worker processes
+outside of the dashboard.
+"""
+import ast
+import re
+import time
+
+import networkx as nx
+import numpy as np
+
+# Seconds spent at most on the graph edit distance of a single pair of trees
+GED_TIMEOUT = 0.5
+
+
+def check_node_label_equality(n1: dict, n2: dict) -> bool:
+    """
+    This function is used to check if two nodes are equal.
+    It is used by the graph edit distance function in order to allow the
+    detection of more than just morphological differences.
+    """
+    n1_label = re.split(r"\\", n1["label"])
+    n2_label = re.split(r"\\", n2["label"])
+    if len(n1_label) == len(n2_label):
+        if len(n1_label) == 3:
+            n1_nvalues_string_list = n1_label[len(n1_label) - 1].split(" = ")[1]
+            n2_nvalues_string_list = n2_label[len(n2_label) - 1].split(" = ")[1]
+            n1_nvalues_true_list = ast.literal_eval(n1_nvalues_string_list)
+            n2_nvalues_true_list = ast.literal_eval(n2_nvalues_string_list)
+            return np.argmax(n1_nvalues_true_list) == np.argmax(n2_nvalues_true_list)
+        elif len(n2_label) == 4:
+            n1_feature_label = n1_label[0].split(" <= ")[0]
+            n2_feature_label = n2_label[0].split(" <= ")[0]
+            return n1_feature_label == n2_feature_label
+        else:
+            raise ValueError()
+    else:
+        return False
+
+
+def node_label(node: dict) -> str:
+    """
+    The part of the label of a node, that check_node_label_equality compares: the split
+    feature of internal nodes and the majority class of leaves.
+    """
+    label = re.split(r"\\", node["label"])
+    if len(label) == 3:
+        # Parsed by hand, as ast.literal_eval is slow for the many leaves of a forest
+        values = [float(value) for value in label[2].split(" = ")[1][1:-1].split(",")]
+        return f"class {values.index(max(values))}"
+    elif len(label) == 4:
+        return f"feature {label[0].split(' <= ')[0]}"
+    else:
+        raise ValueError()
+
+
+def tree_distance(graph: nx.DiGraph, other_graph: nx.DiGraph) -> float:
+    """
+    Graph edit distance between two trees, rooted at their first node.
+    Returns NaN, if no distance was found within GED_TIMEOUT.
+    """
+    distance = nx.graph_edit_distance(
+        other_graph,
+        graph,
+        node_match=check_node_label_equality,
+        timeout=GED_TIMEOUT,
+        roots=("0", "0"),
+    )
+    return np.nan if distance is None else distance
+
+
+def timed_tree_distance(
+    graph: nx.DiGraph, other_graph: nx.DiGraph
+) -> tuple[float, float, bool]:
+    """
+    tree_distance, together with the seconds it took and whether the search was cut
+    off by GED_TIMEOUT. A cut off search returns the best distance found so far, which
+    may be larger than the exact one, or NaN.
+    """
+    start = time.perf_counter()
+    distance = tree_distance(graph, other_graph)
+    elapsed = time.perf_counter() - start
+    return distance, elapsed, elapsed >= GED_TIMEOUT
@@ -0,0 +1,371 @@
+"""
+os reads the configured memory budget from the environment.
+hashlib fingerprints arrays, forests and trees, so they can be used in cache keys.
+threading guards the shared store, as Streamlit serves every session from one process.
+pickle is used to estimate the size of objects that do not report their memory usage,
+once per cached artifact.
+numpy, pandas and networkx objects are measured directly where possible.
+streamlit is only used to identify the current session.
+"""
+import hashlib
+import os
+import pickle
+import sys
+import threading
+import uuid
+from collections import OrderedDict
+from time import time
+from typing import Any, Callable, Hashable, Union
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+DEFAULT_MEMORY_BUDGET_MB = 1024
+# Sessions that have not rerun for this many seconds are dropped from the accounting.
+SESSION_TTL_SECONDS = 3600
+
+
+class MemoryManager:
+    """
+    Process wide store for recomputable artifacts, such as deserialized distance matrices.
+    Entries are evicted in least recently used order once the memory budget is exceeded.
+    Additionally, the artifacts, that each session keeps from its last rerun until the
+    next one, are accounted for and shown in the admin metrics view. The bytes only
+    sessions hold, as they aren't cached or were evicted from the cache, count towards
+    the budget as well. If the budget is still exceeded after the eviction of entries,
+    the least recently seen sessions are released: their release callback drops their
+    references to the artifacts, which their next rerun builds again, mostly from the
+    cache.
+    The size of an entry is estimated once, when it is put. The sizes of its objects
+    are kept by their identity, so that a session holding the same objects is accounted
+    without measuring them again.
+    """
+
+    def __init__(self, budget_bytes: int):
+        self.budget_bytes = budget_bytes
+        self._entries: OrderedDict = OrderedDict()
+        self._sessions: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.releases = 0
+
+    def get(self, key: Hashable) -> Any:
+        """
+        Returns the cached artifact for the key or None, if it is not cached.
+        A hit marks the entry as most recently used.
+        """
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            entry = self._entries[key]
+            entry["hits"] += 1
+            return entry["value"]
+
+    def put(self, key: Hashable, value: Any, session_id: str = None) -> Any:  # type: ignore
+        """
+        Caches the artifact under the given key and returns it.
+        Artifacts larger than the whole budget are returned without being cached.
+        """
+        object_sizes: dict[int, int] = {}
+        size = estimate_size(value, object_sizes)
+        with self._lock:
+            if key in self._entries:
+                self.used_bytes -= self._entries.pop(key)["size"]
+            if size > self.budget_bytes:
+                return value
+            self._entries[key] = {
+                "value": value,
+                "size": size,
+                "object_sizes": object_sizes,
+                "session_id": session_id,
+                "created": time(),
+                "hits": 0,
+            }
+            self.used_bytes += size
+            self._evict(session_id)
+        return value
+
+    def keys(self, namespace: str) -> list:
+        """
+        Returns all cached keys of a namespace. The namespace is the first element of
+        a tuple key.
+        """
+        with self._lock:
+            return [
+                key
+                for key in self._entries
+                if isinstance(key, tuple) and key and key[0] == namespace
+            ]
+
+    def discard(self, predicate: Callable[[Hashable], bool]) -> int:
+        """
+        Removes the entries, whose key matches the predicate, e.g. artifacts of
+        superseded inputs, which would only be evicted once the budget is exceeded.
+        Returns the number of removed entries.
+        """
+        with self._lock:
+            keys = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                self.used_bytes -= self._entries.pop(key)["size"]
+            return len(keys)
+
+    def record_session(
+        self,
+        session_id: str,
+        artifacts: dict[str, Any],
+        release: Union[Callable[[], None], None] = None,
+    ):
+        """
+        Records the artifacts a session keeps after its rerun and their sizes. Objects,
+        that are also cached, take the size estimated when they were put.
+        release drops the references of the session to the artifacts, it is called
+        when the session is released, see _evict(). The recorded session itself is
+        never released by this call.
+        """
+        with self._lock:
+            object_sizes = {}
+            for entry in self._entries.values():
+                object_sizes.update(entry["object_sizes"])
+            # Keeps the cached objects alive, so that their identities stay unique
+            cached_values = [entry["value"] for entry in self._entries.values()]
+        sizes = {
+            name: estimate_size(artifact, object_sizes)
+            for name, artifact in artifacts.items()
+        }
+        del cached_values
+        now = time()
+        with self._lock:
+            # Sessions rerun in place, so their entry becomes the most recently seen
+            self._sessions.pop(session_id, None)
+            self._sessions[session_id] = {
+                "artifacts": artifacts,
+                "object_sizes": object_sizes,
+                "sizes": sizes,
+                "release": release,
+                "last_seen": now,
+            }
+            for stale_id in [
+                sid
+                for sid, session in self._sessions.items()
+                if now - session["last_seen"] > SESSION_TTL_SECONDS
+            ]:
+                self._release(stale_id)
+            self._evict(session_id)
+
+    def session_bytes(self) -> int:
+        """
+        Bytes held by the sessions only, without the cached objects, which are counted
+        by used_bytes. Must be called while holding the lock.
+        """
+        cached_ids = set()
+        for entry in self._entries.values():
+            cached_ids.update(entry["object_sizes"])
+        return sum(
+            exclusive_size(artifact, session["object_sizes"], cached_ids)
+            for session in self._sessions.values()
+            for artifact in session["artifacts"].values()
+        )
+
+    def _release(self, session_id: str):
+        """
+        Forgets a session and drops its references to its artifacts.
+        Must be called while holding the lock.
+        """
+        session = self._sessions.pop(session_id)
+        if session["release"] is not None:
+            session["release"]()
+        self.releases += 1
+
+    def _evict(self, current_session_id: Union[str, None] = None):
+        """
+        Removes least recently used entries until the budget is met. Then releases the
+        least recently seen sessions, except the current one, until the cache and the
+        sessions fit into the budget together.
+        Must be called while holding the lock.
+        """
+        while self.used_bytes > self.budget_bytes and self._entries:
+            _, entry = self._entries.popitem(last=False)
+            self.used_bytes -= entry["size"]
+            self.evictions += 1
+        idle_sessions = [
+            session_id
+            for session_id in self._sessions
+            if session_id != current_session_id
+        ]
+        for session_id in idle_sessions:
+            if self.used_bytes + self.session_bytes() <= self.budget_bytes:
+                break
+            self._release(session_id)
+
+    def summary(self) -> dict[str, float]:
+        """
+        Aggregated numbers for the admin metrics view.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "budget_mb": self.budget_bytes / 1024**2,
+                "cache_mb": self.used_bytes / 1024**2,
+                "session_mb": sum(
+                    sum(session["sizes"].values())
+                    for session in self._sessions.values()
+                )
+                / 1024**2,
+                "entries": len(self._entries),
+                "sessions": len(self._sessions),
+                "evictions": self.evictions,
+                "releases": self.releases,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def cache_df(self) -> pd.DataFrame:
+        """
+        One row per cached artifact, least recently used first.
+        """
+        with self._lock:
+            rows = [
+                {
+                    "artifact": key[0] if isinstance(key, tuple) else str(key),
+                    "key": str(key),
+                    "size_mb": entry["size"] / 1024**2,
+                    "hits": entry["hits"],
+                    "session": entry["session_id"],
+                    "age_s": time() - entry["created"],
+                }
+                for key, entry in self._entries.items()
+            ]
+        return pd.DataFrame(
+            rows, columns=["artifact", "key", "size_mb", "hits", "session", "age_s"]
+        )
+
+    def session_df(self) -> pd.DataFrame:
+        """
+        One row per session and artifact of the session's last rerun.
+        """
+        with self._lock:
+            rows = [
+                {"session": session_id, "artifact": name, "size_mb": size / 1024**2}
+                for session_id, session in self._sessions.items()
+                for name, size in session["sizes"].items()
+            ]
+        return pd.DataFrame(rows, columns=["session", "artifact", "size_mb"])
+
+
+_memory_manager = None
+_memory_manager_lock = threading.Lock()
+
+
+def get_memory_manager() -> MemoryManager:
+    """
+    Returns the process wide memory manager, which is shared by all sessions.
+    The budget is read from the RANDFEW_MEMORY_BUDGET_MB environment variable.
+    """
+    global _memory_manager
+    with _memory_manager_lock:
+        if _memory_manager is None:
+            budget_mb = float(
+                os.environ.get("RANDFEW_MEMORY_BUDGET_MB", DEFAULT_MEMORY_BUDGET_MB)
+            )
+            _memory_manager = MemoryManager(int(budget_mb * 1024**2))
+        return _memory_manager
+
+
+def get_session_id() -> str:
+    """
+    Returns an identifier for the current Streamlit session.
+    """
+    if "session_id" not in st.session_state:
+        st.session_state["session_id"] = uuid.uuid4().hex[:8]
+    return st.session_state["session_id"]
+
+
+def array_fingerprint(array: np.ndarray) -> str:
+    """
+    Content hash of an array, used to key artifacts derived from it.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str((array.shape, array.dtype)).encode())
+    digest.update(np.ascontiguousarray(array).data)
+    return digest.hexdigest()
+
+
+def tree_fingerprint(estimator: Any) -> str:
+    """
+    Content hash of a fitted decision tree, made of its node arrays.
+    """
+    state = estimator.tree_.__getstate__()
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(array_fingerprint(state["nodes"]).encode())
+    digest.update(array_fingerprint(state["values"]).encode())
+    return digest.hexdigest()
+
+
+def forest_fingerprint(model: Any) -> str:
+    """
+    Content hash of a fitted forest, made of the hashes of all its trees.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for estimator in model.estimators_:
+        digest.update(tree_fingerprint(estimator).encode())
+    return digest.hexdigest()
+
+
+def estimate_size(obj: Any, object_sizes: Union[dict[int, int], None] = None) -> int:
+    """
+    Estimates the memory footprint of an artifact in bytes.
+    Forests are measured by the node arrays of their trees, everything without a
+    cheaper measure falls back to the size of its pickle.
+    object_sizes maps the identity of objects to their known size. The sizes of the
+    artifact and of the items of lists and tuples are looked up there and added to it.
+    """
+    if object_sizes is None:
+        object_sizes = {}
+    if id(obj) not in object_sizes:
+        object_sizes[id(obj)] = _measure_size(obj, object_sizes)
+    return object_sizes[id(obj)]
+
+
+def exclusive_size(obj: Any, object_sizes: dict[int, int], shared_ids: set) -> int:
+    """
+    Size of obj without the objects in shared_ids, from the sizes of estimate_size().
+    """
+    if id(obj) in shared_ids:
+        return 0
+    if isinstance(obj, (list, tuple)) and not isinstance(obj, nx.Graph):
+        return sys.getsizeof(obj) + sum(
+            exclusive_size(item, object_sizes, shared_ids) for item in obj
+        )
+    return object_sizes[id(obj)]
+
+
+def _measure_size(obj: Any, object_sizes: dict[int, int]) -> int:
+    if isinstance(obj, np.memmap):
+        # Memory mapped files are paged in by the OS and can be dropped at any time
+        return 0
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if hasattr(obj, "memory_footprint"):
+        return obj.memory_footprint()
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        return int(obj.memory_usage(deep=True).sum())
+    if hasattr(obj, "estimators_"):
+        return sum(estimate_size(estimator) for estimator in obj.estimators_)
+    if hasattr(obj, "tree_"):
+        state = obj.tree_.__getstate__()
+        return state["nodes"].nbytes + state["values"].nbytes
+    if isinstance(obj, (list, tuple)) and not isinstance(obj, nx.Graph):
+        return sys.getsizeof(obj) + sum(
+            estimate_size(item, object_sizes) for item in obj
+        )
+    try:
+        return len(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))
+    except (pickle.PicklingError, TypeError, AttributeError):
+        return sys.getsizeof(obj)
@@ -0,0 +1,134 @@
+"""
+joblib loads externally trained forests with memory mapping, so that the large node
+arrays are paged in from disk instead of being read into a separate buffer first.
+Loading a model unpickles it, which can run arbitrary code. Models are therefore only
+loaded from the model directory on the server, which only the operator writes to, and
+never from uploads.
+os and pathlib locate the model directory, which can be configured by the environment.
+sklearn is used to check, that the loaded object is a random forest classifier.
+The memory manager keeps loaded models across reruns, dataset_ingestion fingerprints
+the model files.
+"""
+import os
+from pathlib import Path
+
+import joblib
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+
+from dataset_ingestion import file_fingerprint
+from memory_manager import get_memory_manager, get_session_id
+
+# Option of the model selection, that trains a forest in the dashboard itself
+TRAIN_IN_APP = "Train in app"
+MODEL_SUFFIX = ".joblib"
+
+
+def get_model_dir() -> Path:
+    """
+    Directory of the externally trained forests, RANDFEW_MODEL_DIR if it is set.
+    Every model in it is trusted, so it must not be writable by dashboard visitors.
+    """
+    default_dir = Path(__file__).resolve().parent.joinpath("models")
+    return Path(os.environ.get("RANDFEW_MODEL_DIR", default_dir))
+
+
+def available_models() -> list[str]:
+    """
+    File names of all persisted forests in the model directory.
+    """
+    model_dir = get_model_dir()
+    if not model_dir.is_dir():
+        return []
+    return sorted(path.name for path in model_dir.glob(f"*{MODEL_SUFFIX}"))
+
+
+def load_model(file_name: str) -> tuple[RandomForestClassifier, str]:
+    """
+    Loads a forest from the model directory with memory mapping and returns it with
+    the fingerprint of the file. Both are cached by the memory manager, as long as the
+    file is not modified.
+    """
+    path = get_model_dir().joinpath(file_name)
+    if not path.is_file():
+        raise ValueError(f"Model file '{file_name}' not found in {get_model_dir()}.")
+    stat = path.stat()
+    memory_manager = get_memory_manager()
+    cache_key = ("imported_model", str(path), stat.st_mtime_ns, stat.st_size)
+    cached = memory_manager.get(cache_key)
+    if cached is not None:
+        return cached
+
+    model = joblib.load(path, mmap_mode="r")
+    if not isinstance(model, RandomForestClassifier) or not hasattr(
+        model, "estimators_"
+    ):
+        raise ValueError(
+            f"Model file '{file_name}' does not contain a fitted RandomForestClassifier."
+        )
+    return memory_manager.put(
+        cache_key, (model, file_fingerprint(path)), get_session_id()
+    )
+
+
+def validate_features(model: RandomForestClassifier, features: list[str]):
+    """
+    Checks, that the forest was trained on the features of the dataset, in the same
+    order. Forests trained without feature names are only checked by their number.
+    """
+    if hasattr(model, "feature_names_in_"):
+        model_features = [str(feature) for feature in model.feature_names_in_]
+        if model_features != list(features):
+            missing = sorted(set(model_features) - set(features))
+            unexpected = sorted(set(features) - set(model_features))
+            raise ValueError(
+                "The model was trained on different features than the dataset provides. "
+                f"Missing in the dataset: {missing or 'none'}, "
+                f"not used by the model: {unexpected or 'none'}"
+                + ("." if missing or unexpected else ", the order differs.")
+            )
+    elif model.n_features_in_ != len(features):
+        raise ValueError(
+            f"The model was trained on {model.n_features_in_} features, "
+            f"the dataset provides {len(features)}."
+        )
+
+
+def class_indices(
+    model: RandomForestClassifier, target_values: np.ndarray, target_names: list[str]
+) -> np.ndarray:
+    """
+    Translates the target values into the class indices, that the trees of the forest
+    predict. Numeric targets are looked up in the classes of the forest. Text classes
+    are matched by name: target_names holds the class names of the sorted unique target
+    values, e.g. the categories of their codes.
+    Raises a ValueError, if the target contains classes unknown to the forest.
+    """
+    if np.issubdtype(model.classes_.dtype, np.number):
+        indices = np.searchsorted(model.classes_, target_values).clip(
+            0, len(model.classes_) - 1
+        )
+        unknown = model.classes_[indices] != target_values
+        unknown_classes = np.unique(target_values[unknown]).tolist()
+    else:
+        labels, inverse = np.unique(target_values, return_inverse=True)
+        if len(labels) != len(target_names):
+            raise ValueError(
+                f"The target column has {len(labels)} classes, "
+                f"but {len(target_names)} class names."
+            )
+        model_indices = {str(name): index for index, name in enumerate(model.classes_)}
+        label_indices = np.array(
+            [model_indices.get(str(name), -1) for name in target_names], dtype=np.intp
+        )
+        indices = label_indices[inverse]
+        unknown = indices < 0
+        unknown_classes = [
+            str(name) for name, index in zip(target_names, label_indices) if index < 0
+        ]
+    if unknown.any():
+        raise ValueError(
+            "The target column contains classes unknown to the model: "
+            f"{unknown_classes}. The model knows {[str(name) for name in model.classes_]}."
+        )
+    return indices
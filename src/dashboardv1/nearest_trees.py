@@ -0,0 +1,95 @@
+"""
+numpy selects the nearest trees of every tree with a partial sort of its row of the
+distance matrix, block by block, so condensed distance matrices are never materialized
+as a whole.
+scipy holds the edges of neighbor graphs, whose nearest trees are ranked among the
+candidates of the graph only.
+"""
+import numpy as np
+import numpy.typing as npt
+from scipy import sparse
+
+from condensed_distance import iter_row_blocks
+
+# Nearest trees stored for every tree, the sidebar offers at most this many
+NEAREST_TREES = 10
+
+
+class NearestTreeIndex:
+    """
+    The NEAREST_TREES nearest trees of every tree, ordered by their distance.
+    The rows of the distance matrix are used as they are, like in the density
+    hierarchy, so the distance from tree i to tree j is the entry [i, j] of the scaled
+    matrix.
+    Built once per distance matrix, every query is a lookup.
+    Trees with fewer neighbors, like the trees of a neighbor graph with few candidates,
+    are padded with the neighbor -1 at an infinite distance.
+    """
+
+    def __init__(
+        self,
+        neighbors: npt.NDArray[np.int32],
+        distances: npt.NDArray[np.float32],
+    ):
+        self.neighbors = neighbors
+        self.distances = distances
+
+    @classmethod
+    def from_distance_matrix(
+        cls, distance_matrix, n_nearest: int = NEAREST_TREES
+    ) -> "NearestTreeIndex":
+        n_trees = distance_matrix.shape[0]
+        n_nearest = min(n_nearest, n_trees - 1)
+        neighbors = np.empty((n_trees, n_nearest), dtype=np.int32)
+        distances = np.empty((n_trees, n_nearest), dtype=np.float32)
+        if n_nearest == 0:
+            return cls(neighbors, distances)
+        for start, stop, rows in iter_row_blocks(distance_matrix):
+            rows = rows.astype(np.float32)
+            # A tree is not its own neighbor, even if identical trees have a distance of 0
+            rows[np.arange(stop - start), np.arange(start, stop)] = np.inf
+            nearest = np.argpartition(rows, n_nearest - 1, axis=1)[:, :n_nearest]
+            nearest_distances = np.take_along_axis(rows, nearest, axis=1)
+            order = np.argsort(nearest_distances, axis=1, kind="stable")
+            neighbors[start:stop] = np.take_along_axis(nearest, order, axis=1)
+            distances[start:stop] = np.take_along_axis(nearest_distances, order, axis=1)
+        return cls(neighbors, distances)
+
+    @classmethod
+    def from_sparse_distances(
+        cls, distances: sparse.csr_matrix, n_nearest: int = NEAREST_TREES
+    ) -> "NearestTreeIndex":
+        """
+        The nearest trees among the stored entries of every row of a sparse distance
+        matrix, like the candidates of tree_lsh.NeighborGraph. Entries, that aren't
+        stored, aren't neighbors.
+        """
+        n_trees = distances.shape[0]
+        edges = distances.tocoo()
+        # A tree is not its own neighbor, the graph stores it with a distance of 0
+        others = edges.row != edges.col
+        rows, columns, values = edges.row[others], edges.col[others], edges.data[others]
+        order = np.lexsort((values, rows))
+        rows, columns, values = rows[order], columns[order], values[order]
+        # Rank of every neighbor among the neighbors of its tree
+        ranks = np.arange(len(rows)) - np.searchsorted(rows, rows)
+        kept = ranks < n_nearest
+        neighbors = np.full((n_trees, n_nearest), -1, dtype=np.int32)
+        nearest_distances = np.full((n_trees, n_nearest), np.inf, dtype=np.float32)
+        neighbors[rows[kept], ranks[kept]] = columns[kept]
+        nearest_distances[rows[kept], ranks[kept]] = values[kept]
+        return cls(neighbors, nearest_distances)
+
+    def query(
+        self, tree: int, n_nearest: int = NEAREST_TREES
+    ) -> tuple[npt.NDArray[np.int32], npt.NDArray[np.float32]]:
+        """
+        The n_nearest nearest trees of tree and their distances, fewer if the tree has
+        fewer neighbors.
+        """
+        neighbors = self.neighbors[tree, :n_nearest]
+        known = neighbors >= 0
+        return neighbors[known], self.distances[tree, :n_nearest][known]
+
+    def memory_footprint(self) -> int:
+        return self.neighbors.nbytes + self.distances.nbytes
@@ -0,0 +1,87 @@
+"""
+numpy evaluates the whole grid of DBSCAN parameters.
+pandas holds the results for the heatmap.
+The density hierarchy provides the labels, the silhouette module the scores.
+"""
+import numpy as np
+import numpy.typing as npt
+import pandas as pd
+
+from density_hierarchy import DensityHierarchy
+from silhouette import one_hot, silhouette_from_sums
+
+# The same values the sidebar sliders offer
+SWEEP_EPS_VALUES = np.round(np.arange(0.01, 1.0, 0.01), 2)
+SWEEP_MIN_SAMPLES_VALUES = np.arange(2, 11)
+
+
+def sweep_clustering(
+    distance_matrix: npt.NDArray[np.float64],
+    density_hierarchy: DensityHierarchy,
+    eps_values: npt.NDArray[np.float64] = SWEEP_EPS_VALUES,
+    min_samples_values: npt.NDArray[np.int_] = SWEEP_MIN_SAMPLES_VALUES,
+) -> pd.DataFrame:
+    """
+    Evaluates every combination of eps and min_samples.
+    The nearest distances of the density hierarchy are shared by all combinations, and
+    the neighborhoods of every eps by all values of min_samples. For each
+    min_samples, the cluster memberships of all eps values are stacked into one matrix,
+    so that the distance sums for every cluster of every configuration come from a
+    single matrix product.
+    Returns one row per configuration with the silhouette score (noise excluded, -1 if
+    there are not enough clusters), the percentage of trees in clusters and the number
+    of clusters.
+    """
+    hierarchies = [
+        density_hierarchy.with_min_samples(int(min_samples))
+        for min_samples in min_samples_values
+    ]
+    # The core points of the smallest min_samples include those of all the others, so
+    # the neighborhoods of every eps are collected in one pass over the rows
+    smallest = hierarchies[int(np.argmin(min_samples_values))]
+    all_labelings: list[list] = [[] for _ in hierarchies]
+    for eps in eps_values:
+        neighborhood_graph = smallest.neighborhood_graph(eps)
+        for labelings, hierarchy in zip(all_labelings, hierarchies):
+            labelings.append(hierarchy.labels(eps, neighborhood_graph))
+    results = []
+    for min_samples, labelings in zip(min_samples_values, all_labelings):
+        cluster_ids = [np.unique(labels[labels > -1]) for labels in labelings]
+        memberships = [
+            one_hot(labels, ids) for labels, ids in zip(labelings, cluster_ids)
+        ]
+        all_sums = distance_matrix @ np.hstack(memberships)
+        offset = 0
+        for eps, labels, ids, membership in zip(
+            eps_values, labelings, cluster_ids, memberships
+        ):
+            sums = all_sums[:, offset : offset + len(ids)]
+            offset += len(ids)
+            clustered = np.count_nonzero(labels > -1)
+            if 2 <= len(ids) <= clustered - 1:
+                silhouette_score = float(
+                    np.nanmean(
+                        silhouette_from_sums(sums, labels, ids, membership.sum(axis=0))
+                    )
+                )
+            else:
+                silhouette_score = -1.0
+            results.append(
+                {
+                    "eps": float(eps),
+                    "min_samples": int(min_samples),
+                    "silhouette_score": silhouette_score,
+                    "trees_in_clusters": clustered / len(labels) * 100,
+                    "n_clusters": len(ids),
+                }
+            )
+    return pd.DataFrame(results)
+
+
+def best_configuration(sweep_df: pd.DataFrame) -> dict:
+    """
+    The configuration with the highest product of silhouette score and the share of
+    trees in clusters, as both should be high for a good clustering.
+    """
+    score = sweep_df["silhouette_score"] * sweep_df["trees_in_clusters"] / 100
+    return sweep_df.loc[score.idxmax()].to_dict()
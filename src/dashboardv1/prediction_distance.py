@@ -0,0 +1,72 @@
+"""
+numpy packs the predictions of every tree into bits and counts the samples two trees
+agree on with a vectorized popcount. This functional distance compares what the trees
+predict instead of how they are built, and is far cheaper than the graph edit distance.
+This module does not depend on streamlit.
+"""
+import numpy as np
+import numpy.typing as npt
+from sklearn.ensemble import RandomForestClassifier
+
+# Masks of the SWAR popcount, see popcount()
+_M1 = np.uint64(0x5555555555555555)
+_M2 = np.uint64(0x3333333333333333)
+_M4 = np.uint64(0x0F0F0F0F0F0F0F0F)
+_H01 = np.uint64(0x0101010101010101)
+
+
+def tree_predictions(
+    model: RandomForestClassifier, x: npt.NDArray[np.float32]
+) -> npt.NDArray[np.intp]:
+    """
+    Class index predicted by every tree for every sample, of shape (n_trees, n_samples).
+    """
+    return np.stack([estimator.predict(x) for estimator in model.estimators_]).astype(
+        np.intp
+    )
+
+
+def pack_predictions(
+    predictions: npt.NDArray[np.intp], n_classes: int
+) -> npt.NDArray[np.uint64]:
+    """
+    One-hot encodes the predictions and packs them into bits, of shape
+    (n_trees, n_classes, n_words). Bit s of the words of class c is set, if the tree
+    predicts c for sample s.
+    """
+    one_hot = predictions[:, np.newaxis, :] == np.arange(n_classes)[:, np.newaxis]
+    packed = np.packbits(one_hot, axis=-1)
+    # Pad to whole 64 bit words, the padding bits are never set
+    padding = -packed.shape[-1] % 8
+    packed = np.pad(packed, ((0, 0), (0, 0), (0, padding)))
+    return np.ascontiguousarray(packed).view(np.uint64)
+
+
+def popcount(words: npt.NDArray[np.uint64]) -> npt.NDArray[np.uint64]:
+    """
+    Number of set bits of every word, counted in parallel within the word (SWAR), as
+    numpy has no popcount.
+    """
+    words = words - ((words >> np.uint64(1)) & _M1)
+    words = (words & _M2) + ((words >> np.uint64(2)) & _M2)
+    words = (words + (words >> np.uint64(4))) & _M4
+    return (words * _H01) >> np.uint64(56)
+
+
+def disagreement_distances(
+    predictions: npt.NDArray[np.intp], n_classes: int
+) -> npt.NDArray[np.float32]:
+    """
+    Fraction of the samples, on which two trees predict different classes, for all
+    pairs of trees. Returns a dense, symmetric matrix with zeros on the diagonal.
+    A sample has at most one bit set across the classes of a tree, so the classes of
+    the AND of two trees are merged with OR before counting the agreements.
+    """
+    n_trees, n_samples = predictions.shape
+    packed = pack_predictions(predictions, n_classes)
+    distances = np.zeros((n_trees, n_trees), dtype=np.float32)
+    for tree in range(n_trees - 1):
+        agreements = np.bitwise_or.reduce(packed[tree] & packed[tree + 1 :], axis=1)
+        n_agreements = popcount(agreements).sum(axis=1)
+        distances[tree, tree + 1 :] = 1 - n_agreements / n_samples
+    return distances + distances.T
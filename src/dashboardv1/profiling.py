@@ -0,0 +1,292 @@
+"""
+sys and threading sample the call stack of a thread in the background, which profiles
+a whole rerun, without slowing down every function call like a deterministic profiler.
+collections counts the sampled stacks, which are written in the folded format of
+flamegraph.pl, that speedscope and most other flame graph viewers read as well.
+psutil measures the resident memory along with every sample.
+json stores the memory report and the samples of the distance workers.
+file_lock makes sure, that the late samples of the distance workers are added to a
+capture only once, when several sessions list the captures.
+This module does not depend on streamlit, so that the distance workers can use it.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Union
+
+import psutil
+
+from file_lock import FileLock
+from stage_timer import RerunRecorder
+
+# Seconds between two samples
+PROFILE_INTERVAL = 0.005
+# Captures listed in the developer panel
+PROFILE_HISTORY_LENGTH = 10
+# Samples of distance workers, whose capture was never stopped, e.g. as the dashboard
+# was killed, are removed after this many seconds
+STALE_WORKER_SECONDS = 3600
+
+
+def get_profile_dir() -> Path:
+    """
+    Captures are stored in RANDFEW_PROFILE_DIR, or in the profiles folder next to this
+    file.
+    """
+    default_dir = Path(__file__).resolve().parent.joinpath("profiles")
+    return Path(os.environ.get("RANDFEW_PROFILE_DIR", default_dir))
+
+
+def fold_stack(frame) -> str:
+    """
+    The stack of frame from the outermost to the innermost call, in the folded format.
+    """
+    calls = []
+    while frame is not None:
+        code = frame.f_code
+        calls.append(
+            f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+        )
+        frame = frame.f_back
+    return ";".join(reversed(calls))
+
+
+class StackSampler:
+    """
+    Samples the stack of one thread and the resident memory of the process every
+    interval seconds, from a background thread.
+    With a recorder, the memory is attributed to the stages running at that moment.
+    """
+
+    def __init__(
+        self,
+        thread_id: int,
+        recorder: RerunRecorder = None,  # type: ignore
+        interval: float = PROFILE_INTERVAL,
+    ):
+        self.thread_id = thread_id
+        self.recorder = recorder
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.peak_rss = 0
+        self.stage_peak_rss: dict[str, int] = {}
+        self._process = psutil.Process()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        frame = sys._current_frames().get(self.thread_id)
+        if frame is not None:
+            self.stacks[fold_stack(frame)] += 1
+        rss = self._process.memory_info().rss
+        self.peak_rss = max(self.peak_rss, rss)
+        if self.recorder is not None:
+            for record in list(self.recorder.active):
+                self.stage_peak_rss[record.stage] = max(
+                    self.stage_peak_rss.get(record.stage, 0), rss
+                )
+
+
+class ProfileCapture:
+    """
+    Profile of one rerun in <directory>/<name>:
+    - profile.folded: the sampled stacks of the rerun and of the distance workers,
+      whose stacks start with "GED worker". Render it with flamegraph.pl or open it in
+      speedscope.
+    - memory.json: the peak resident memory of every stage, of the whole rerun and of
+      the distance workers.
+    Distance workers write their samples to worker_*.json in the same directory, see
+    profile_worker(). Shards, that are still running when the rerun ends, write them
+    later, they are added to the capture by recent_captures(). Shards started after the
+    capture was stopped are not sampled.
+    """
+
+    def __init__(self, directory: Path, name: str, recorder: RerunRecorder):
+        self.directory = Path(directory).joinpath(name)
+        self.name = name
+        self.sampler = StackSampler(threading.get_ident(), recorder)
+        self.start_time = time.time()
+
+    def start(self) -> "ProfileCapture":
+        self.directory.mkdir(parents=True, exist_ok=True)
+        _local.capture = self
+        self.sampler.start()
+        return self
+
+    def stop(self, stage_records: list[dict]) -> dict:
+        """
+        Stops sampling, writes the capture and returns its memory report.
+        stage_records are the records of the profiled rerun, see finish_rerun().
+        """
+        self.sampler.stop()
+        _local.capture = None
+        write_folded(self.directory, self.sampler.stacks)
+        report = {
+            "name": self.name,
+            "created": time.strftime(
+                "%Y-%m-%d %H:%M:%S", time.localtime(self.start_time)
+            ),
+            "duration_s": round(time.time() - self.start_time, 3),
+            "samples": sum(self.sampler.stacks.values()),
+            "peak_rss_mb": self.sampler.peak_rss / 2**20,
+            "worker_peak_rss_mb": 0.0,
+            "stages": [
+                {
+                    "stage": record["stage"],
+                    "wall_ms": record["wall_ms"],
+                    "peak_rss_mb": self.stage_peak_rss_mb(record["stage"]),
+                }
+                for record in stage_records
+            ],
+        }
+        write_report(self.directory, report)
+        return collect_worker_samples(self.directory) or report
+
+    def stage_peak_rss_mb(self, stage: str) -> Union[float, None]:
+        """
+        None for stages, that were too short to be sampled.
+        """
+        peak_rss = self.sampler.stage_peak_rss.get(stage)
+        return None if peak_rss is None else peak_rss / 2**20
+
+
+_local = threading.local()
+
+
+def current_capture() -> Union[ProfileCapture, None]:
+    """
+    The capture running in the current thread, if any.
+    """
+    return getattr(_local, "capture", None)
+
+
+@contextmanager
+def profile_worker(directory: Path, label: str) -> Iterator[StackSampler]:
+    """
+    Samples the enclosed block of a distance worker and stores the samples in
+    directory, where the capture of the dashboard collects them.
+    """
+    sampler = StackSampler(threading.get_ident())
+    sampler.start()
+    try:
+        yield sampler
+    finally:
+        sampler.stop()
+        # Written under a temporary name, so that the capture never reads a partial file
+        worker_path = Path(directory).joinpath(f"worker_{os.getpid()}_{label}.json")
+        temporary_path = worker_path.with_name(f".{worker_path.name}.tmp")
+        temporary_path.write_text(
+            json.dumps({"peak_rss": sampler.peak_rss, "stacks": sampler.stacks})
+        )
+        os.replace(temporary_path, worker_path)
+
+
+def capture_stopped(directory: Path) -> bool:
+    """
+    Whether the capture in directory has written its report already.
+    """
+    return Path(directory).joinpath("memory.json").exists()
+
+
+def write_report(directory: Path, report: dict):
+    """
+    Writes memory.json under a temporary name first, as other sessions read it.
+    """
+    report_path = Path(directory).joinpath("memory.json")
+    temporary_path = report_path.with_name(".memory.json.tmp")
+    temporary_path.write_text(json.dumps(report, indent=2))
+    os.replace(temporary_path, report_path)
+
+
+def write_folded(directory: Path, stacks: Counter):
+    """
+    Writes profile.folded under a temporary name first, like write_report().
+    """
+    folded_path = Path(directory).joinpath("profile.folded")
+    temporary_path = folded_path.with_name(".profile.folded.tmp")
+    with open(temporary_path, "w") as outfile:
+        for stack, count in stacks.most_common():
+            outfile.write(f"{stack} {count}\n")
+    os.replace(temporary_path, folded_path)
+
+
+def read_folded(directory: Path) -> Counter:
+    stacks: Counter = Counter()
+    with open(Path(directory).joinpath("profile.folded")) as infile:
+        for line in infile:
+            stack, count = line.rstrip("\n").rsplit(" ", 1)
+            stacks[stack] += int(count)
+    return stacks
+
+
+def collect_worker_samples(directory: Path) -> Union[dict, None]:
+    """
+    Adds the samples, that distance workers wrote to the stopped capture in directory,
+    to its stacks and its memory report, and removes them.
+    Returns the updated report, or None, if there were no samples.
+    """
+    directory = Path(directory)
+    with FileLock(directory.joinpath("collect.lock")):
+        worker_paths = sorted(directory.glob("worker_*.json"))
+        if not worker_paths:
+            return None
+        stacks = read_folded(directory)
+        report_path = directory.joinpath("memory.json")
+        report = json.loads(report_path.read_text())
+        worker_peak_rss = report["worker_peak_rss_mb"] * 2**20
+        for worker_path in worker_paths:
+            worker = json.loads(worker_path.read_text())
+            worker_peak_rss = max(worker_peak_rss, worker["peak_rss"])
+            for stack, count in worker["stacks"].items():
+                stacks[f"GED worker;{stack}"] += count
+        write_folded(directory, stacks)
+        report["worker_peak_rss_mb"] = worker_peak_rss / 2**20
+        write_report(directory, report)
+        for worker_path in worker_paths:
+            worker_path.unlink()
+        return report
+
+
+def recent_captures(directory: Path) -> list[dict]:
+    """
+    Memory reports of the last PROFILE_HISTORY_LENGTH captures, newest first.
+    Samples, that distance workers wrote after their capture was stopped, are added to
+    it first. Samples of captures, that were never stopped, are removed once they are
+    older than STALE_WORKER_SECONDS.
+    """
+    worker_paths = list(Path(directory).glob("*/worker_*.json"))
+    for capture_directory in {worker_path.parent for worker_path in worker_paths}:
+        if capture_stopped(capture_directory):
+            collect_worker_samples(capture_directory)
+    for worker_path in worker_paths:
+        if capture_stopped(worker_path.parent):
+            continue
+        try:
+            if time.time() - worker_path.stat().st_mtime > STALE_WORKER_SECONDS:
+                worker_path.unlink()
+        except FileNotFoundError:
+            # Removed by another session
+            pass
+    reports = []
+    for report_path in Path(directory).glob("*/memory.json"):
+        report = json.loads(report_path.read_text())
+        report["path"] = str(report_path.parent)
+        reports.append(report)
+    reports.sort(key=lambda report: report["created"], reverse=True)
+    return reports[:PROFILE_HISTORY_LENGTH]
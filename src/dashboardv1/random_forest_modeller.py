@@ -1,42 +1,94 @@
 """
-warnings, timeit, datetime, chainmap and numpy are mostly used for utility stuff.
-multiprocessing is used for parallelization of the graph edit distance.
-sklearn is used for the random forest classifier, the clustering and the
-tsne embedding.
+numpy is mostly used for utility stuff.
+anytime_distance approximates the graph edit distance at once and refines it in the
+background, with the distance shards, that parallelize it and checkpoint its progress.
+sklearn is used for the random forest classifier.
 pandas is handling the dataframes in the background
 networkx is used for the graph edit distance
 streamlit is only used in this class for caching and the loading spinner
 pygraphviz is used to convert the sklearn tree to pygraph and then networkx
+memory_manager keeps deserialized distance matrices in memory across reruns
+condensed_distance stores the distance matrix as a memory mapped upper triangle
+density_hierarchy replaces repeated DBSCAN runs for the clustering
+embedding_backends project the trees into two dimensions, the t-SNE gallery is fitted
+by the worker_pool
+forest_growth grows and slices the trained forest, when the number of trees changes
+ged_telemetry reports the cost of the graph edit distances
+profiling extends a running profile capture to the distance workers
+model_loader validates externally trained forests against the dataset
+nearest_trees looks up the most similar trees of a tree
+prediction_distance compares the trees by their predictions instead of their structure
+parameter_sweep evaluates all DBSCAN parameter combinations at once
+silhouette calculates all silhouette scores in one pass over the distance matrix
+stage_timer measures the pipeline stages for the developer metrics panel
+tree_lsh clusters and embeds very large forests on a sparse neighbor graph
+tree_rendering draws single trees on request
+weisfeiler_lehman compares the structure of the trees much faster than the graph edit
+distance
 """
-import ast
-import multiprocessing as mp
 import pickle
-import re
-import warnings
-from collections import ChainMap
-from datetime import timedelta
 from os.path import exists
 from pathlib import Path
-from timeit import default_timer as timer
+from typing import Union
 
 import networkx as nx
 import numpy as np
-import numpy.typing as npt
 import pandas as pd
 import pygraphviz as pgv
 import streamlit as st
 from sklearn import tree
-from sklearn.cluster import DBSCAN
 from sklearn.ensemble import RandomForestClassifier
-from sklearn.manifold import TSNE
-from sklearn.metrics import silhouette_samples, silhouette_score
 from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import MinMaxScaler
+
+from anytime_distance import get_anytime_matrix, version_fingerprint
+from condensed_distance import CondensedDistanceMatrix
+from density_hierarchy import DensityHierarchy
+from embedding_backends import (
+    EMBEDDING_BACKENDS,
+    ClassicalMDSBackend,
+    SpectralBackend,
+    TSNEBackend,
+)
+from forest_growth import resize_forest
+from ged_telemetry import GEDTelemetry
+from memory_manager import (
+    array_fingerprint,
+    forest_fingerprint,
+    get_memory_manager,
+    get_session_id,
+)
+from model_loader import class_indices, validate_features
+from nearest_trees import NearestTreeIndex
+from parameter_sweep import SWEEP_MIN_SAMPLES_VALUES, sweep_clustering
+from prediction_distance import disagreement_distances, tree_predictions
+from profiling import current_capture
+from silhouette import silhouette_scores
+from stage_timer import record_cache, record_items, timed_stage
+from tree_lsh import NeighborGraph
+from tree_rendering import get_tree_svg
+from weisfeiler_lehman import WL_ITERATIONS, wl_l1_distances, wl_feature_matrix
+from worker_pool import get_worker_pool
+
+# Number of reruns kept in st.session_state.load_history
+LOAD_HISTORY_LENGTH = 10
+# Forests with more trees are embedded with classical MDS by default
+LARGE_FOREST_TREES = 300
+# Distance metrics between trees, that can be selected in the sidebar
+GED_METRIC = "Graph edit distance"
+DISAGREEMENT_METRIC = "Prediction disagreement"
+WL_METRIC = "Weisfeiler-Lehman"
+DISTANCE_METRICS = [GED_METRIC, DISAGREEMENT_METRIC, WL_METRIC]
+# Forests with more trees are clustered and embedded on a sparse neighbor graph of
+# their structurally most similar trees, instead of a full distance matrix
+NEIGHBOR_GRAPH_TREES = 2000
+NEIGHBOR_GRAPH_METRIC = "Jaccard distance of the split paths"
+# Trees, between which the silhouette scores of a neighbor graph are calculated
+SILHOUETTE_SAMPLE_TREES = 1000
 
 
 class RFmodeller:
     """
-    Handles the creation of the random forest model, the clustering and the tsne embedding.
+    Handles the creation of the random forest model, the clustering and the embedding.
     """
 
     def __init__(
@@ -45,8 +97,11 @@ class RFmodeller:
         feature_list: list[str],
         target_column: list[str],
         target_names: list[str],
+        dataset_key: str = None,  # type: ignore
+        imported_model: RandomForestClassifier = None,  # type: ignore
     ):
         self.data = data
+        self.imported_model = imported_model
         self.features = feature_list
         self.target_column = target_column
         self.target_names = target_names
@@ -54,6 +109,8 @@ class RFmodeller:
             self.data_choice = st.session_state.data_choice
         else:
             self.data_choice = "Iris"
+        # Identifies the data in file names, see DataLoader
+        self.dataset_key = dataset_key or self.data_choice
         self.update_load_history()
         (
             self.model,
@@ -62,25 +119,79 @@ class RFmodeller:
             self.y_train,
             self.y_test,
         ) = self.train_model()
-        self.directed_graphs = self.create_dot_trees()
-        self.distance_matrix = self.compute_distance_matrix()
+        if len(self.model.estimators_) > NEIGHBOR_GRAPH_TREES:
+            # The neighbor graph compares the sklearn trees directly
+            self.directed_graphs = []
+        else:
+            self.directed_graphs = self.create_dot_trees()
+        # The graph edit distances being refined and the version shown in this rerun
+        self.distance_refinement = None
+        self.distance_version = None
+        if "distance_metric" not in st.session_state:
+            st.session_state["distance_metric"] = GED_METRIC
+        self.distance_metric = st.session_state["distance_metric"]
+        if len(self.model.estimators_) > NEIGHBOR_GRAPH_TREES:
+            self.distance_metric = NEIGHBOR_GRAPH_METRIC
+            self.distance_matrix = self.compute_neighbor_graph()
+        elif self.distance_metric == DISAGREEMENT_METRIC:
+            self.distance_matrix = self.compute_disagreement_matrix()
+        elif self.distance_metric == WL_METRIC:
+            self.distance_matrix = self.compute_wl_matrix()
+        else:
+            self.distance_matrix = self.compute_distance_matrix()
+        if self.distance_refinement is not None:
+            # Hashing every version would take as long as reading it
+            self.distance_fingerprint = version_fingerprint(
+                self.distance_refinement.path, self.distance_version
+            )
+        elif isinstance(self.distance_matrix, NeighborGraph):
+            self.distance_fingerprint = array_fingerprint(
+                self.distance_matrix.distances.data
+            )
+        else:
+            self.distance_fingerprint = array_fingerprint(
+                self.distance_matrix.values
+                if isinstance(self.distance_matrix, CondensedDistanceMatrix)
+                else self.distance_matrix
+            )
         (
             self.clustering,
             self.cluster_df,
         ) = self.calculate_tree_clusters()
-        (self.tsne_embedding, self.tsne_df) = self.calculate_tsne_embedding()
-        self.sample_silhouette_scores = self.calculate_sample_silhouette_scores()
-        self.cluster_silhouette_score = self.calculate_cluster_silhouette_score()
+        (
+            self.embedding_backend,
+            self.embedding,
+            self.embedding_df,
+        ) = self.calculate_embedding()
+        (
+            self.sample_silhouette_scores,
+            self.cluster_silhouette_score,
+            self.cluster_silhouette_means,
+        ) = self.calculate_silhouette_scores()
         self.percentage_trees_in_clusters = (
             self.calculate_percentage_trees_in_clusters()
         )
 
+    @timed_stage("training")
     def train_model(self):
         """
         Standard RF classification model
+        An imported model is used as it is, the data is only split for the metrics.
         """
         x = self.data[self.features]
         y = self.data[self.target_column]
+        if self.imported_model is not None:
+            record_cache(True)
+            self.forest_key = ("imported", forest_fingerprint(self.imported_model))
+            validate_features(self.imported_model, self.features)
+            # The trees predict class indices, the metrics compare them with the target
+            y = pd.Series(
+                class_indices(self.imported_model, y.values, self.target_names)
+            )
+            x_train, x_test, y_train, y_test = train_test_split(
+                x.values, y.values, test_size=0.3, random_state=123
+            )
+            return self.imported_model, x_train, x_test, y_train, y_test
         # Have to run this with the .values on X and y, to avoid passing the series with
         # field names etc.
         x_train, x_test, y_train, y_test = train_test_split(
@@ -94,32 +205,69 @@ class RFmodeller:
         else:
             max_depth = 10
 
-        forest_model = RandomForestClassifier(
-            n_estimators=st.session_state.n_estimators,
-            max_depth=max_depth,
-            random_state=123,
-            oob_score=True,
-            n_jobs=-1,
+        # The trees don't depend on the number of trees, so forests of all sizes share
+        # the largest forest fitted so far, which is sliced or grown, see forest_growth
+        self.forest_key = (
+            "trained",
+            array_fingerprint(x_train),
+            array_fingerprint(y_train.astype(str)),
+            max_depth,
         )
-        forest_model.fit(x_train, y_train.ravel())  # type: ignore
+        memory_manager = get_memory_manager()
+        cache_key = ("forest", *self.forest_key)
+        largest_forest = memory_manager.get(cache_key)
+        if largest_forest is None:
+            forest_model = RandomForestClassifier(
+                n_estimators=st.session_state.n_estimators,
+                max_depth=max_depth,
+                random_state=123,
+                oob_score=True,
+                n_jobs=-1,
+            )
+            forest_model.fit(x_train, y_train.ravel())  # type: ignore
+            fitted_trees = st.session_state.n_estimators
+        else:
+            forest_model, fitted_trees = resize_forest(
+                largest_forest,
+                st.session_state.n_estimators,
+                x_train,
+                y_train.ravel(),  # type: ignore
+            )
+        record_cache(fitted_trees == 0)
+        record_items(fitted_trees)
+        if fitted_trees > 0:
+            memory_manager.put(cache_key, forest_model, get_session_id())
         return forest_model, x_train, x_test, y_train, y_test
 
+    @timed_stage("tree extraction")
     def create_dot_trees(self) -> list[nx.DiGraph]:
         """
         Transform the sklearn estimators of Tree class to nxDiGraphs
+        The graphs of the largest forest of the same forest_key are kept by the memory
+        manager, so only the trees, that were added to it, are transformed.
         """
-        directed_graphs = []
-        for estimator in self.model.estimators_:
-            pgv_tree_string = tree.export_graphviz(
-                estimator, feature_names=self.features
-            )
-            pgv_digraph = pgv.AGraph(directed=True)
-            pgv_digraph = pgv.AGraph(pgv_tree_string)
-            nx_digraph = nx.DiGraph()
-            nx_digraph = nx.nx_agraph.from_agraph(pgv_digraph)
-            directed_graphs.append(nx_digraph)
+        memory_manager = get_memory_manager()
+        cache_key = ("directed_graphs", *self.forest_key, tuple(self.features))
+        cached_graphs = memory_manager.get(cache_key) or []
+        n_trees = len(self.model.estimators_)
+        directed_graphs = cached_graphs[:n_trees]
+        n_cached = len(directed_graphs)
+        for estimator in self.model.estimators_[n_cached:]:
+            directed_graphs.append(self.estimator_to_graph(estimator))
+        record_cache(n_cached == n_trees)
+        record_items(n_trees - n_cached)
+        if n_trees > len(cached_graphs):
+            memory_manager.put(cache_key, directed_graphs, get_session_id())
         return directed_graphs
 
+    def estimator_to_graph(self, estimator) -> nx.DiGraph:
+        pgv_tree_string = tree.export_graphviz(estimator, feature_names=self.features)
+        pgv_digraph = pgv.AGraph(directed=True)
+        pgv_digraph = pgv.AGraph(pgv_tree_string)
+        nx_digraph = nx.DiGraph()
+        nx_digraph = nx.nx_agraph.from_agraph(pgv_digraph)
+        return nx_digraph
+
     def slider_session_state_update(
         self, sliders: list, default_values: dict, selection_changed: bool
     ) -> tuple:
@@ -142,15 +290,20 @@ class RFmodeller:
                     slider_values.append(default_values[slider_name])
         return tuple(slider_values)
 
-    def calculate_tsne_embedding(
+    @timed_stage("embedding")
+    def calculate_embedding(
         self,
         learning_rate: float = 73.0,
         perplexity: int = 5,
         early_exaggeration: float = 35.0,
     ):
         """
-        Calculate the tsne embedding of the distance matrix.
-        Uses the parameters from the sidebar.
+        Calculate the 2D embedding of the distance matrix with the backend selected in
+        the sidebar. Large forests default to the deterministic classical MDS, t-SNE is
+        the default for the smaller ones.
+        Deterministic embeddings are cached per distance matrix and backend, t-SNE
+        caches its embeddings itself.
+        Uses the t-SNE parameters from the sidebar.
         Do not be confused by the "unused" arguments, as they are simply not directly
         adressed, but are used in the for loop below via "locals()[parameter]".
         """
@@ -165,6 +318,11 @@ class RFmodeller:
                 "perplexity": 5,
                 "early_exaggeration": 35.0,
             },
+            "Custom": {
+                "learning_rate": 200.0,
+                "perplexity": 30,
+                "early_exaggeration": 12.0,
+            },
         }
         sliders = ["learning_rate", "perplexity", "early_exaggeration"]
         (
@@ -176,24 +334,45 @@ class RFmodeller:
             default_value_dict[self.data_choice],
             self.data_selection_changed(),
         )
-        if self.model.n_estimators < perplexity:
-            perplexity = self.model.n_estimators - 1
-        tsne = TSNE(
-            n_components=2,
-            perplexity=perplexity,
-            early_exaggeration=early_exaggeration,
-            learning_rate=learning_rate,  # type: ignore
-            n_iter=1000,
-            random_state=123,
-            metric="precomputed",
-            init="random",
-            verbose=0,
-        )
-        tsne_embedding = tsne.fit_transform(self.distance_matrix)
-        tsne_df = pd.DataFrame(tsne_embedding, columns=["Component 1", "Component 2"])
-        return tsne_embedding, tsne_df
+        if "embedding_backend" not in st.session_state:
+            if len(self.model.estimators_) > LARGE_FOREST_TREES:
+                st.session_state["embedding_backend"] = ClassicalMDSBackend.name
+            else:
+                st.session_state["embedding_backend"] = TSNEBackend.name
+        embedding_backend = st.session_state["embedding_backend"]
+        if embedding_backend == TSNEBackend.name:
+            backend = TSNEBackend(learning_rate, perplexity, early_exaggeration)
+        else:
+            backend = EMBEDDING_BACKENDS[embedding_backend]()
+        if isinstance(self.distance_matrix, NeighborGraph):
+            # The dense backends need the full distance matrix
+            embedding_backend = SpectralBackend.name
+            embedding = self.distance_matrix.spectral_embedding()
+        elif backend.deterministic:
+            memory_manager = get_memory_manager()
+            cache_key = ("embedding", self.distance_fingerprint, backend.name)
+            embedding = memory_manager.get(cache_key)
+            record_cache(embedding is not None)
+            if embedding is None:
+                embedding = memory_manager.put(
+                    cache_key,
+                    backend.embed(self.distance_matrix, self.distance_fingerprint),
+                    get_session_id(),
+                )
+        else:
+            embedding = backend.embed(self.distance_matrix, self.distance_fingerprint)
+        embedding_df = pd.DataFrame(embedding, columns=["Component 1", "Component 2"])
+        record_items(len(embedding))
+        return embedding_backend, embedding, embedding_df
 
+    @timed_stage("DBSCAN")
     def calculate_tree_clusters(self, eps: float = 0.12, min_samples: int = 2):
+        """
+        Cluster the trees with DBSCAN on the distance matrix.
+        The labels are extracted from a density hierarchy, which is computed once per
+        distance matrix and min_samples, so that changes of eps are cheap.
+        The returned clustering is the array of cluster labels, noise is labeled -1.
+        """
         default_value_dict = {
             "Digits": {
                 "eps": 0.75,
@@ -203,6 +382,10 @@ class RFmodeller:
                 "eps": 0.12,
                 "min_samples": 2,
             },
+            "Custom": {
+                "eps": 0.5,
+                "min_samples": 2,
+            },
         }
         sliders = ["eps", "min_samples"]
         (eps, min_samples,) = self.slider_session_state_update(
@@ -210,146 +393,295 @@ class RFmodeller:
             default_value_dict[self.data_choice],
             self.data_selection_changed(),
         )
+        if self.distance_refinement is not None:
+            # The pairs around eps are refined next
+            self.distance_refinement.set_eps(eps)
 
-        clustering = DBSCAN(
-            eps=eps,
-            min_samples=min_samples,
-            metric="precomputed",
-            n_jobs=-1,
-            algorithm="brute",
-            p=2,
-        ).fit(self.distance_matrix)
+        if isinstance(self.distance_matrix, NeighborGraph):
+            clustering = self.distance_matrix.dbscan_labels(eps, min_samples)
+        else:
+            clustering = self.get_density_hierarchy(min_samples).labels(eps)
+        record_items(len(set(clustering) - {-1}))
 
         cluster_df = pd.DataFrame(
             {
-                "cluster": clustering.labels_,
-                "tree": list(range(len(self.directed_graphs))),
+                "cluster": clustering,
+                "tree": list(range(len(self.model.estimators_))),
             }
         )
         return clustering, cluster_df
 
-    def compute_distance_matrix(self) -> npt.NDArray[np.float64]:
+    @timed_stage("parameter sweep")
+    def calculate_parameter_sweep(self) -> pd.DataFrame:
+        """
+        Evaluates all combinations of the DBSCAN sidebar parameters on the distance
+        matrix. The result is cached per distance matrix.
+        """
+        memory_manager = get_memory_manager()
+        cache_key = ("parameter_sweep", self.distance_fingerprint)
+        sweep_df = memory_manager.get(cache_key)
+        record_cache(sweep_df is not None)
+        if sweep_df is None:
+            sweep_df = memory_manager.put(
+                cache_key,
+                sweep_clustering(
+                    self.distance_matrix,
+                    self.get_density_hierarchy(int(SWEEP_MIN_SAMPLES_VALUES[0])),
+                ),
+                get_session_id(),
+            )
+        return sweep_df
+
+    def get_density_hierarchy(self, min_samples: int) -> DensityHierarchy:
+        """
+        Returns the density hierarchy for the distance matrix and min_samples.
+        It is shared between sessions and reruns via the memory manager.
+        """
+        memory_manager = get_memory_manager()
+        cache_key = ("density_hierarchy", self.distance_fingerprint, min_samples)
+        density_hierarchy = memory_manager.get(cache_key)
+        record_cache(density_hierarchy is not None)
+        if density_hierarchy is None:
+            # The nearest distances do not depend on min_samples and can be reused
+            cached_keys = [
+                key
+                for key in memory_manager.keys("density_hierarchy")
+                if key[1] == self.distance_fingerprint
+            ]
+            cached_hierarchy = (
+                memory_manager.get(cached_keys[-1]) if cached_keys else None
+            )
+            if cached_hierarchy is None:
+                density_hierarchy = DensityHierarchy(self.distance_matrix, min_samples)
+            else:
+                density_hierarchy = cached_hierarchy.with_min_samples(min_samples)
+            density_hierarchy = memory_manager.put(
+                cache_key, density_hierarchy, get_session_id()
+            )
+        return density_hierarchy
+
+    @timed_stage("nearest trees")
+    def get_nearest_tree_index(self) -> NearestTreeIndex:
+        """
+        Returns the nearest trees of every tree, which are looked up for the tree
+        selected in the sidebar. The index is built once per distance matrix and shared
+        between sessions and reruns via the memory manager.
+        The nearest trees of a neighbor graph are ranked among its candidates only.
+        """
+        memory_manager = get_memory_manager()
+        cache_key = ("nearest_trees", self.distance_fingerprint)
+        nearest_tree_index = memory_manager.get(cache_key)
+        record_cache(nearest_tree_index is not None)
+        if nearest_tree_index is None:
+            nearest_tree_index = memory_manager.put(
+                cache_key,
+                NearestTreeIndex.from_sparse_distances(self.distance_matrix.distances)
+                if isinstance(self.distance_matrix, NeighborGraph)
+                else NearestTreeIndex.from_distance_matrix(self.distance_matrix),
+                get_session_id(),
+            )
+        record_items(len(nearest_tree_index.neighbors))
+        return nearest_tree_index
+
+    @timed_stage("tree diagram")
+    def get_tree_svg(self, tree_index: int) -> str:
+        """
+        SVG diagram of a single tree of the forest, rendered on its first request and
+        cached on disk afterwards, see tree_rendering.
+        """
+        if len(self.target_names) == len(self.model.classes_):
+            class_names = [str(name) for name in self.target_names]
+        else:
+            # Imported forests may know classes, that the dataset lacks
+            class_names = [str(name) for name in self.model.classes_]
+        svg = get_tree_svg(
+            self.model.estimators_[tree_index], list(self.features), class_names
+        )
+        record_items(1)
+        return svg
+
+    @timed_stage("t-SNE gallery")
+    def calculate_tsne_gallery(self) -> list[tuple[TSNEBackend, np.ndarray]]:
+        """
+        t-SNE embeddings for a grid of parameters around the parameters of the sidebar,
+        see TSNEBackend.gallery(). The missing embeddings are fitted concurrently by the
+        worker pool, on the same distance matrix as the scatter plot.
+        """
+        backend = TSNEBackend(
+            st.session_state["learning_rate"],
+            st.session_state["perplexity"],
+            st.session_state["early_exaggeration"],
+        )
+        gallery = backend.gallery(
+            self.distance_matrix, self.distance_fingerprint, get_worker_pool()
+        )
+        record_items(len(gallery))
+        return gallery
+
+    @timed_stage("GED")
+    def compute_distance_matrix(self):
         """
         Calculate the pairwise distance matrix for the directed graphs
         If possible, a pickle file is loaded, otherwise the distance matrix is
-        calculated and saved to a pickle file.
+        loaded from or calculated into a condensed, memory mapped file.
         The pickle files for all possible iris and digits datasets are included in the repo.
-        If they can be found, the'll be computed.
-        After calculating any distance matrix, it is saved to a pickle file.
+        If they can be found, the'll be loaded as dense arrays.
+        Newly calculated distance matrices are approximated at first and refined in the
+        background, see AnytimeDistanceMatrix. Reruns show the same version, until
+        the latest one is requested, and the artifacts of earlier versions are dropped.
+        Once exact, they are stored as CondensedDistanceMatrix, which never holds the
+        dense square in memory. Both can be consumed the same way, see
+        the CondensedDistanceMatrix docstring.
         We use graph edit distance as the distance metric.
         """
-        dashboardv1_absolute = Path(__file__).resolve().parent
-        pickle_path = dashboardv1_absolute.joinpath(
-            "pickle",
-            f"distance_matrix_{self.data_choice}{self.model.n_estimators}.pickle",
-        )
+        pickle_path = self.distance_matrix_path()
+        condensed_path = pickle_path.with_suffix(".npy")
+
+        # Deserialization, unless another rerun already loaded the same file
+        memory_manager = get_memory_manager()
+        cache_key = ("distance_matrix", str(pickle_path))
+        distance_matrix = memory_manager.get(cache_key)
+        n_trees = len(self.model.estimators_)
+        record_items(n_trees * (n_trees - 1) // 2)
+        if distance_matrix is not None:
+            record_cache(True)
+            return distance_matrix
 
         # Check for existing pickle
-        if not exists(pickle_path):
-            st.spinner()
-            start = timer()
-            # I used this idea: https://stackoverflow.com/a/56038389/12355337
-            # Every process gets a slice of the list of graphs.
+        if exists(pickle_path):
+            record_cache(True)
+            with open(pickle_path, "rb") as infile:
+                distance_matrix = pickle.load(infile)
+        elif exists(condensed_path):
+            record_cache(True)
+            distance_matrix = CondensedDistanceMatrix(condensed_path)
+            discard_earlier_versions(condensed_path)
+        else:
+            record_cache(False)
+            # The approximation is shown at once, while the exact distances are
+            # calculated in shards in the background, which are checkpointed, so that
+            # an interrupted calculation resumes where it stopped. Standalone workers
+            # (see distance_shards.py) may work on the same job.
             # sklearn's pdist won't work because it needs numeric value inputs.
-            with mp.Pool() as pool:
-                distance_matrix_rows = pool.map(
-                    self.calc_dist_matrix_parallel, self.directed_graphs
-                )
-            # Transform list of dicts into a single dict.
-            distance_matrix_dict = dict(ChainMap(*distance_matrix_rows))
-            # Assemble distance matrix based on line indices
-            distance_matrix = np.zeros(
-                (len(self.directed_graphs), len(self.directed_graphs))
+            self.distance_refinement = get_anytime_matrix(
+                condensed_path, self.directed_graphs
+            )
+            capture = current_capture()
+            self.distance_refinement.profile_directory = (
+                None if capture is None else capture.directory
             )
-            # Transform the dict into a numpy array matrix
-            for i in range(len(distance_matrix_dict)):
-                distance_matrix[i] = distance_matrix_dict.get(i)
-            # https://stackoverflow.com/questions/16444930/copy-upper-triangle-to-lower-triangle-in-a-python-matrix
-            distance_matrix = (
-                distance_matrix + distance_matrix.T - np.diag(np.diag(distance_matrix))
+            (
+                self.distance_version,
+                distance_matrix,
+            ) = self.distance_refinement.snapshot(
+                refresh=st.session_state.pop("refresh_distances", False)
+            )
+            discard_earlier_versions(
+                condensed_path,
+                version_fingerprint(condensed_path, self.distance_version),
             )
-            distance_matrix = remove_possible_nans(distance_matrix)
-            scaler = MinMaxScaler()
-            distance_matrix = scaler.fit_transform(distance_matrix)
             if not self.dist_matr_shape_ok(distance_matrix):
                 raise ValueError(
                     "RFModeller: Error after calculating distance matrix. Distance matrix shape is not correct."
                 )
-            stop = timer()
-            print(
-                f"Time spent in calculcate_distance_matrix: {timedelta(seconds=stop-start)}"
+            # Only the exact matrix is kept, the next rerun takes the next version
+            return distance_matrix
+
+        return memory_manager.put(cache_key, distance_matrix, get_session_id())
+
+    @timed_stage("prediction disagreement")
+    def compute_disagreement_matrix(self) -> np.ndarray:
+        """
+        Calculate the fraction of the samples of the dataset, on which two trees predict
+        different classes, for all pairs of trees.
+        The matrix is cached per forest and data, apart from the graph edit distances.
+        """
+        x = self.data[self.features].values.astype(np.float32)
+        memory_manager = get_memory_manager()
+        cache_key = (
+            "disagreement_matrix",
+            forest_fingerprint(self.model),
+            array_fingerprint(x),
+        )
+        distance_matrix = memory_manager.get(cache_key)
+        n_trees = len(self.model.estimators_)
+        record_items(n_trees * (n_trees - 1) // 2)
+        record_cache(distance_matrix is not None)
+        if distance_matrix is None:
+            distance_matrix = memory_manager.put(
+                cache_key,
+                disagreement_distances(
+                    tree_predictions(self.model, x), len(self.model.classes_)
+                ),
+                get_session_id(),
             )
+        return distance_matrix
 
-            # Serialize
-            pickle_path.touch(
-                exist_ok=True
-            )  # will create file, if it exists will do nothing
-            with open(pickle_path, "wb") as outfile:
-                pickle.dump(distance_matrix, outfile)
-
-        # Deserialization
-        with open(pickle_path, "rb") as infile:
-            distance_matrix_unpickled = pickle.load(infile)
-
-        return distance_matrix_unpickled
-
-    def calc_dist_matrix_parallel(
-        self, process_graph: nx.DiGraph
-    ) -> dict[int, npt.NDArray[np.float64]]:
-        """
-        One directed graph will be sent to this method per process.
-        We calculate the distances per row.
-        Each row is then collected by the multiprocessing pool, which results in the
-        distance matrix.
-        """
-        row_distances = np.zeros(len(self.directed_graphs))
-        dg_index = self.directed_graphs.index(process_graph)
-        for i, di_graph in enumerate(self.directed_graphs[dg_index:]):
-            if i == 0:
-                row_distances[i] = 0
-            else:
-                row_distances[i + dg_index] = nx.graph_edit_distance(
-                    di_graph,
-                    process_graph,
-                    node_match=self.check_node_label_equality,
-                    timeout=0.5,
-                    roots=("0", "0"),
-                )
+    @timed_stage("Weisfeiler-Lehman")
+    def compute_wl_matrix(self) -> np.ndarray:
+        """
+        Calculate the L1 distances between the Weisfeiler-Lehman label counts of all
+        pairs of trees, a structural metric like the graph edit distance, which is
+        calculated in one sparse matrix product.
+        The matrix is cached per forest.
+        """
+        memory_manager = get_memory_manager()
+        cache_key = ("wl_matrix", forest_fingerprint(self.model), WL_ITERATIONS)
+        distance_matrix = memory_manager.get(cache_key)
+        n_trees = len(self.model.estimators_)
+        record_items(n_trees * (n_trees - 1) // 2)
+        record_cache(distance_matrix is not None)
+        if distance_matrix is None:
+            distance_matrix = memory_manager.put(
+                cache_key,
+                wl_l1_distances(wl_feature_matrix(self.directed_graphs)),
+                get_session_id(),
+            )
+        return distance_matrix
 
-        return {dg_index: row_distances}
+    @timed_stage("neighbor graph")
+    def compute_neighbor_graph(self) -> NeighborGraph:
+        """
+        Connect every tree with its most similar trees, found with MinHash and locality
+        sensitive hashing on the split paths of the trees. Only these candidates are
+        compared exactly, so very large forests are not compared pair by pair.
+        The graph is cached per forest.
+        """
+        memory_manager = get_memory_manager()
+        cache_key = ("neighbor_graph", forest_fingerprint(self.model))
+        neighbor_graph = memory_manager.get(cache_key)
+        record_cache(neighbor_graph is not None)
+        if neighbor_graph is None:
+            neighbor_graph = memory_manager.put(
+                cache_key, NeighborGraph.from_forest(self.model), get_session_id()
+            )
+        record_items(neighbor_graph.n_edges)
+        return neighbor_graph
+
+    def distance_matrix_path(self) -> Path:
+        """
+        Path of the pickled distance matrix. Calculated matrices are stored with the
+        suffix .npy instead.
+        """
+        dashboardv1_absolute = Path(__file__).resolve().parent
+        return dashboardv1_absolute.joinpath(
+            "pickle",
+            f"distance_matrix_{self.dataset_key}{len(self.model.estimators_)}.pickle",
+        )
+
+    def ged_telemetry(self) -> Union[GEDTelemetry, None]:
+        """
+        Elapsed time of every pair of trees of the distance matrix, if it was calculated
+        with telemetry. The pickled matrices included in the repo have none.
+        """
+        return GEDTelemetry.load(self.distance_matrix_path().with_suffix(".npy"))
 
     def dist_matr_shape_ok(self, distance_matrix: np.ndarray):
         return distance_matrix.shape == (
-            len(self.directed_graphs),
-            len(self.directed_graphs),
+            len(self.model.estimators_),
+            len(self.model.estimators_),
         )
 
-    def check_node_label_equality(self, n1: dict, n2: dict) -> bool:
-        """
-        This function is used to check if two nodes are equal.
-        It is used by the graph edit distance function in order to allow the
-        detection of more than just morphological differences.
-        """
-        n1_label = re.split(r"\\", n1["label"])
-        n2_label = re.split(r"\\", n2["label"])
-        if len(n1_label) == len(n2_label):
-            if len(n1_label) == 3:
-                n1_nvalues_string_list = n1_label[len(n1_label) - 1].split(" = ")[1]
-                n2_nvalues_string_list = n2_label[len(n2_label) - 1].split(" = ")[1]
-                n1_nvalues_true_list = ast.literal_eval(n1_nvalues_string_list)
-                n2_nvalues_true_list = ast.literal_eval(n2_nvalues_string_list)
-                return np.argmax(n1_nvalues_true_list) == np.argmax(
-                    n2_nvalues_true_list
-                )
-            elif len(n2_label) == 4:
-                n1_feature_label = n1_label[0].split(" <= ")[0]
-                n2_feature_label = n2_label[0].split(" <= ")[0]
-                return n1_feature_label == n2_feature_label
-            else:
-                raise ValueError()
-        else:
-            return False
-
     def calculate_percentage_trees_in_clusters(self) -> int:
         """
         Returns how many percent of trees have been assigned to a cluster.
@@ -362,43 +694,39 @@ class RFmodeller:
         else:
             return 100
 
-    def calculate_sample_silhouette_scores(self) -> pd.DataFrame:
-        try:
-            sample_silhouettes = pd.DataFrame(
-                silhouette_samples(
-                    X=self.distance_matrix,
-                    labels=self.cluster_df["cluster"].values,
-                    metric="precomputed",
-                ),
-                columns=["Silhouette Score"],
+    @timed_stage("silhouette")
+    def calculate_silhouette_scores(self) -> tuple[pd.DataFrame, float, dict]:
+        """
+        Calculates the silhouette score of every tree, the mean silhouette score of all
+        trees not classified as noise and the mean silhouette score of each cluster.
+        All of them are derived from a single pass over the distance matrix.
+        For a neighbor graph, they are estimated from the exact distances between an even
+        sample of SILHOUETTE_SAMPLE_TREES trees, the other trees get no score.
+        """
+        labels = self.cluster_df["cluster"].values
+        if isinstance(self.distance_matrix, NeighborGraph):
+            n_trees = self.distance_matrix.shape[0]
+            sample = np.unique(
+                np.linspace(0, n_trees - 1, SILHOUETTE_SAMPLE_TREES).astype(int)
             )
-        except ValueError:
-            sample_silhouettes = pd.DataFrame(
-                self.distance_matrix.shape[0] * [-1.0], columns=["Silhouette Score"]
+            (
+                sample_scores,
+                cluster_silhouette_score,
+                cluster_silhouette_means,
+            ) = silhouette_scores(
+                self.distance_matrix[sample][:, sample], labels[sample]
             )
-        return sample_silhouettes
-
-    def calculate_cluster_silhouette_score(self):
-        no_noise_tree_list = self.cluster_df.loc[self.cluster_df["cluster"] > -1][
-            "tree"
-        ].to_list()
-        no_noise_cluster_df = self.cluster_df.loc[self.cluster_df["cluster"] > -1]
-        distance_matrix_rows_filtered = np.take(
-            self.distance_matrix, no_noise_tree_list, axis=0
-        )
-        distance_matrix_no_noise = np.take(
-            distance_matrix_rows_filtered, no_noise_tree_list, axis=1
-        )
-        try:
-            cluster_silhouette_score = silhouette_score(
-                X=distance_matrix_no_noise,
-                labels=no_noise_cluster_df["cluster"],
-                metric="precomputed",
-                sample_size=None,
+            sample_scores = (
+                pd.Series(sample_scores, index=sample).reindex(range(n_trees)).values
             )
-        except ValueError:
-            cluster_silhouette_score = -1.0
-        return cluster_silhouette_score
+        else:
+            (
+                sample_scores,
+                cluster_silhouette_score,
+                cluster_silhouette_means,
+            ) = silhouette_scores(self.distance_matrix, labels)
+        sample_silhouettes = pd.DataFrame(sample_scores, columns=["Silhouette Score"])
+        return sample_silhouettes, cluster_silhouette_score, cluster_silhouette_means
 
     def update_load_history(self):
         if "load_history" in st.session_state:
@@ -408,48 +736,56 @@ class RFmodeller:
                 )
             else:
                 st.session_state.load_history.append([self.data_choice, "Tutorial"])
+            self.trim_load_history()
         else:
             st.session_state["load_history"] = ["Iris", "Tutorial"]
 
-    def data_selection_changed(self) -> bool:
-        if "load_history" in st.session_state:
-            return (
-                self.data_choice
-                != st.session_state.load_history[st.session_state.counter - 1][0]
+    def trim_load_history(self):
+        """
+        Keeps only the last LOAD_HISTORY_LENGTH entries of the load history.
+        The number of dropped entries is remembered, so that the history can still be
+        indexed by the rerun counter.
+        """
+        overflow = len(st.session_state.load_history) - LOAD_HISTORY_LENGTH
+        if overflow > 0:
+            del st.session_state.load_history[:overflow]
+            st.session_state["load_history_offset"] = (
+                st.session_state.get("load_history_offset", 0) + overflow
             )
-        else:
+
+    def load_history_entry(self, counter: int) -> list:
+        """
+        Returns the load history entry belonging to the given rerun counter.
+        """
+        offset = st.session_state.get("load_history_offset", 0)
+        return st.session_state.load_history[counter - offset]
+
+    def data_selection_changed(self) -> bool:
+        if "load_history" not in st.session_state:
             st.session_state["load_history"] = ["Iris", "Tutorial"]
-            return (
-                self.data_choice
-                != st.session_state.load_history[st.session_state.counter - 1][0]
-            )
+        return (
+            self.data_choice != self.load_history_entry(st.session_state.counter - 1)[0]
+        )
 
     def page_changed(self) -> bool:
-        if "load_history" in st.session_state:
-            return (
-                st.session_state.app_mode
-                != st.session_state.load_history[st.session_state.counter][1]
-            )
-        else:
+        if "load_history" not in st.session_state:
             st.session_state["load_history"] = ["Iris", "Tutorial"]
-            return (
-                st.session_state.app_mode
-                != st.session_state.load_history[st.session_state.counter][1]
-            )
+        return (
+            st.session_state.app_mode
+            != self.load_history_entry(st.session_state.counter)[1]
+        )
 
 
-def remove_possible_nans(distance_matrix: np.ndarray) -> np.ndarray:
+def discard_earlier_versions(path: Path, current: Union[str, None] = None):
     """
-    Remove possible nans, resulting from timeouts in the nx.graph_edit_distance
-    (or so I assume).
+    Drops the cached artifacts of the versions of the matrix refined towards path,
+    except the current one. Their fingerprint is the second element of the key.
     """
-    # We currently use an arbitrary measure of twice the maximum distance.
-    # This is fine for now, but should be adjusted to something more reasonable.
-    nan_count = np.count_nonzero(np.isnan(distance_matrix))
-    if nan_count > distance_matrix.shape[0]:
-        warnings.warn(
-            f"{nan_count} NaNs in distance matrix. Consider adjusting timeout parameter in nx.graph_edit_distance."
-        )
-    square_max = pow(np.nanmax(distance_matrix), 2)
-    distance_matrix = np.nan_to_num(distance_matrix, nan=square_max)
-    return distance_matrix
+    prefix = version_fingerprint(path, "")
+    get_memory_manager().discard(
+        lambda key: isinstance(key, tuple)
+        and len(key) > 1
+        and isinstance(key[1], str)
+        and key[1].startswith(prefix)
+        and key[1] != current
+    )
@@ -0,0 +1,141 @@
+"""
+pickle serializes the artifacts, os publishes them atomically by renaming a completely
+written temporary file, that uuid names uniquely.
+hashlib turns the cache keys into file names.
+file_lock makes sure, that only one of several dashboard replicas computes an artifact,
+while the others wait for it, and that only one of them evicts artifacts at a time.
+os reads the size limit of the cache from the environment.
+"""
+import hashlib
+import os
+import pickle
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Hashable, Union
+
+from file_lock import FileLock
+
+# Size limit of the shared cache on disk, if RANDFEW_CACHE_LIMIT_MB is not set
+DEFAULT_CACHE_LIMIT_MB = 2048
+
+
+class SharedCache:
+    """
+    On disk cache for artifacts, that are expensive to compute and shared by all
+    processes using the same directory, e.g. dashboard replicas on a shared volume.
+    Every artifact lives in <directory>/<namespace>/<hash of the key>.pickle.
+
+    Readers only ever see completely written files, as files are written under a
+    temporary name and renamed afterwards. While an artifact is computed, the per key
+    lock file <hash of the key>.lock is held, other processes asking for the same
+    artifact wait for it instead of computing it again. Locks of crashed processes are
+    recovered, see FileLock.
+
+    With a limit_bytes, the least recently used artifacts are removed after every
+    publish, until the artifacts fit into the limit again. Reading an artifact updates
+    the modification time of its file, which orders the artifacts by their last use,
+    also on volumes mounted without access times. The eviction lock evict.lock makes
+    sure, that only one process evicts at a time, the others skip it.
+    """
+
+    def __init__(self, directory: Path, limit_bytes: Union[int, None] = None):
+        self.directory = Path(directory)
+        self.limit_bytes = limit_bytes
+
+    def path(self, namespace: str, key: Hashable) -> Path:
+        digest = hashlib.blake2b(repr(key).encode(), digest_size=16).hexdigest()
+        return self.directory.joinpath(namespace, f"{digest}.pickle")
+
+    def get(self, namespace: str, key: Hashable) -> Any:
+        """
+        Returns the artifact or None, if it was not published yet.
+        """
+        path = self.path(namespace, key)
+        try:
+            with open(path, "rb") as infile:
+                value = pickle.load(infile)
+            # Marks the artifact as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            # Not published yet, or evicted
+            return None
+        return value
+
+    def publish(self, namespace: str, key: Hashable, value: Any):
+        path = self.path(namespace, key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            with open(temporary_path, "wb") as outfile:
+                pickle.dump(value, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary_path, path)
+        finally:
+            if temporary_path.exists():
+                os.remove(temporary_path)
+        if self.limit_bytes is not None:
+            self.evict(keep=path)
+
+    def evict(self, keep: Union[Path, None] = None):
+        """
+        Removes the least recently used artifacts of all namespaces, until the others
+        fit into limit_bytes. The artifact at keep is never removed.
+        Skipped, if another process is evicting already.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        lock = FileLock(self.directory.joinpath("evict.lock"))
+        if not lock.acquire(blocking=False):
+            return
+        try:
+            artifacts = []
+            for path in self.directory.glob("*/*.pickle"):
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                artifacts.append((stat.st_mtime, stat.st_size, path))
+            total_bytes = sum(size for _, size, _ in artifacts)
+            for _, size, path in sorted(artifacts):
+                if total_bytes <= self.limit_bytes:  # type: ignore
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total_bytes -= size
+        finally:
+            lock.release()
+
+    def get_or_compute(
+        self, namespace: str, key: Hashable, compute: Callable[[], Any]
+    ) -> Any:
+        """
+        Returns the published artifact, or computes and publishes it.
+        If another process is computing the same artifact, its result is awaited.
+        """
+        value = self.get(namespace, key)
+        if value is not None:
+            return value
+        path = self.path(namespace, key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with FileLock(path.with_suffix(".lock"), heartbeat=True):
+            # Published by the process, that held the lock before
+            value = self.get(namespace, key)
+            if value is None:
+                value = compute()
+                self.publish(namespace, key, value)
+        return value
+
+
+def get_shared_cache() -> SharedCache:
+    """
+    The shared cache in RANDFEW_CACHE_DIR, or in the cache folder next to this file.
+    Its size limit is read from RANDFEW_CACHE_LIMIT_MB.
+    """
+    default_dir = Path(__file__).resolve().parent.joinpath("cache")
+    limit_mb = float(os.environ.get("RANDFEW_CACHE_LIMIT_MB", DEFAULT_CACHE_LIMIT_MB))
+    return SharedCache(
+        Path(os.environ.get("RANDFEW_CACHE_DIR", default_dir)),
+        int(limit_mb * 1024**2),
+    )
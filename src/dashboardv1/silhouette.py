@@ -0,0 +1,97 @@
+"""
+numpy computes the silhouette scores from per cluster distance sums.
+The sums for all clusters are one product of the distance matrix with the one hot
+encoded labels, which replaces the pairwise reductions of sklearn's silhouette functions.
+"""
+import numpy as np
+import numpy.typing as npt
+
+
+def one_hot(
+    labels: npt.NDArray[np.intp], cluster_ids: npt.NDArray[np.intp]
+) -> npt.NDArray[np.float64]:
+    """
+    Matrix of shape (n_samples, n_clusters) with a 1 where a sample belongs to a cluster.
+    Samples with a label outside of cluster_ids get a row of zeros.
+    """
+    return (labels[:, np.newaxis] == cluster_ids[np.newaxis, :]).astype(np.float64)
+
+
+def silhouette_from_sums(
+    sums: npt.NDArray[np.float64],
+    labels: npt.NDArray[np.intp],
+    cluster_ids: npt.NDArray[np.intp],
+    counts: npt.NDArray[np.float64],
+) -> npt.NDArray[np.float64]:
+    """
+    Silhouette score of every sample, given the summed distances of each sample to the
+    members of each cluster in cluster_ids (sorted ascending) and the cluster sizes.
+    Samples whose label is not in cluster_ids get NaN.
+    Follows sklearn.metrics.silhouette_samples, including a score of 0 for samples in
+    clusters of size one.
+    """
+    silhouettes = np.full(len(labels), np.nan)
+    positions = np.searchsorted(cluster_ids, labels).clip(0, len(cluster_ids) - 1)
+    members = np.flatnonzero(cluster_ids[positions] == labels)
+    if len(members) == 0:
+        return silhouettes
+    own = positions[members]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        intra = sums[members, own] / (counts[own] - 1)
+        mean_distances = sums[members] / counts
+        mean_distances[np.arange(len(members)), own] = np.inf
+        inter = mean_distances.min(axis=1)
+        scores = (inter - intra) / np.maximum(intra, inter)
+    silhouettes[members] = np.nan_to_num(scores)
+    return silhouettes
+
+
+def silhouette_scores(
+    distance_matrix: npt.NDArray[np.float64], labels: npt.NDArray[np.intp]
+) -> tuple[npt.NDArray[np.float64], float, dict[int, float]]:
+    """
+    Computes all silhouette results of a clustering from one pass over the distance
+    matrix. Noise is labeled -1.
+    Returns
+    - the score of every sample, with noise treated as a cluster of its own, like
+      sklearn's silhouette_samples. All scores are -1, if there are not between 2 and
+      n_samples - 1 labels.
+    - the mean score of all samples not labeled as noise, computed only against other
+      samples not labeled as noise, like sklearn's silhouette_score on the filtered
+      matrix. It is -1, if there are not between 2 and n_samples - 1 clusters.
+    - the mean of these noise excluded scores per cluster.
+    """
+    label_ids = np.unique(labels)
+    membership = one_hot(labels, label_ids)
+    counts = membership.sum(axis=0)
+    sums = distance_matrix @ membership
+
+    if 2 <= len(label_ids) <= len(labels) - 1:
+        sample_scores = silhouette_from_sums(sums, labels, label_ids, counts)
+    else:
+        sample_scores = np.full(len(labels), -1.0)
+
+    # The noise column is dropped from the same sums
+    clusters = label_ids > -1
+    cluster_ids = label_ids[clusters]
+    clustered = np.count_nonzero(labels > -1)
+    if 2 <= len(cluster_ids) <= clustered - 1:
+        noise_excluded_scores = silhouette_from_sums(
+            sums[:, clusters], labels, cluster_ids, counts[clusters]
+        )
+        cluster_score = float(np.nanmean(noise_excluded_scores))
+        # Mean per cluster, again as a product with the memberships
+        cluster_means = dict(
+            zip(
+                cluster_ids.tolist(),
+                (
+                    np.nan_to_num(noise_excluded_scores)
+                    @ membership[:, clusters]
+                    / counts[clusters]
+                ).tolist(),
+            )
+        )
+    else:
+        cluster_score = -1.0
+        cluster_means = {cluster_id: -1.0 for cluster_id in cluster_ids.tolist()}
+    return sample_scores, cluster_score, cluster_means
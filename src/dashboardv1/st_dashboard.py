@@ -2,8 +2,29 @@ from dashboard_controller import DashboardController
 from random_forest_modeller import RFmodeller
 import multiprocessing as mp
 from dataframe_operator import DataframeOperator
-from data_loader import DataLoader
+from data_loader import CUSTOM_DATASET, DataLoader
+from dataset_ingestion import IngestedDataset, file_fingerprint, ingest_dataset
+from model_loader import (
+    TRAIN_IN_APP,
+    class_indices,
+    load_model,
+    validate_features,
+)
+from sklearn.ensemble import RandomForestClassifier
 from dashboard_page_creator import DashboardPageCreator
+from memory_manager import get_memory_manager, get_session_id
+from profiling import ProfileCapture, get_profile_dir, recent_captures
+from stage_timer import (
+    STAGE_HISTORY_LENGTH,
+    finish_rerun,
+    record_cache,
+    record_items,
+    stage,
+    start_rerun,
+)
+from typing import Union
+import time
+import pandas as pd
 import streamlit as st
 
 
@@ -14,33 +35,152 @@ def main():
         st.session_state.counter = 0
     else:
         st.session_state.counter += 1
-    dc = base_loader()
-    dpc = DashboardPageCreator(dc)
-    if dc.app_mode == "Tutorial":
-        dpc.create_tutorial_page_layout()
-    elif dc.app_mode == "Dashboard":
-        dpc.create_dashboard_page_layout(show_df=False)
+    recorder = start_rerun(st.session_state.counter)
+    # Requested in the developer panel, see DashboardController.request_profile
+    capture = None
+    if st.session_state.pop("profile_next_rerun", False):
+        capture = ProfileCapture(
+            get_profile_dir(),
+            f"{time.strftime('%Y%m%d-%H%M%S')}_{get_session_id()}_{recorder.rerun}",
+            recorder,
+        ).start()
+    try:
+        dc = base_loader()
+        dpc = DashboardPageCreator(dc)
+        if dc.app_mode == "Tutorial":
+            dpc.create_tutorial_page_layout()
+        elif dc.app_mode == "Dashboard":
+            dpc.create_dashboard_page_layout(show_df=False)
+    finally:
+        stage_records = finish_rerun()
+        if capture is not None:
+            capture.stop(stage_records)
+    stage_history = st.session_state.get("stage_history", []) + [stage_records]
+    st.session_state["stage_history"] = stage_history[-STAGE_HISTORY_LENGTH:]
+    if dc.admin_mode():
+        dc.create_admin_metrics_view()
+        dc.create_stage_timing_view(st.session_state["stage_history"])
+        dc.create_ged_telemetry_view()
+        dc.create_profiling_view(recent_captures(get_profile_dir()))
+    # Account for everything the session keeps until its next rerun. Recorded last, as
+    # other sessions may release it from now on, once the memory budget is exceeded
+    get_memory_manager().record_session(
+        get_session_id(), dc.session_artifacts(), dc.release_artifacts
+    )
 
 
 def base_loader() -> DashboardController:
     st.set_page_config(layout="wide")
     # Load dataset
-    if "data_choice" in st.session_state:
-        dl = DataLoader(st.session_state["data_choice"])
-    else:
-        dl = DataLoader()
+    with stage("data loading"):
+        custom_dataset = load_custom_dataset()
+        if (
+            st.session_state.get("data_choice") == CUSTOM_DATASET
+            and custom_dataset is None
+        ):
+            # The uploaded file was removed
+            st.session_state["data_choice"] = "Iris"
+        if "data_choice" in st.session_state:
+            dl = DataLoader(
+                st.session_state["data_choice"],
+                custom_dataset,
+                st.session_state.get("custom_target_column"),  # type: ignore
+            )
+        else:
+            dl = DataLoader()
+        record_items(len(dl.data))
 
-    # Create RF model
-    rfm = RFmodeller(dl.data, dl.features, dl.target_column, dl.target_names)
+    # Create RF model, or use an imported one
+    imported_model, dataset_key = load_imported_model(dl)
+    rfm = RFmodeller(
+        dl.data,
+        dl.features,
+        dl.target_column,
+        dl.target_names,
+        dataset_key,
+        imported_model,
+    )
 
     # Create tree dataframe
     df_operator = DataframeOperator(rfm, dl.features)
     # Create dashboard controller
-    dc = DashboardController(dl.data, dl.features, df_operator)
+    with stage("sidebar"):
+        dc = DashboardController(dl.data, dl.features, df_operator, custom_dataset)
 
     return dc
 
 
+def load_imported_model(
+    dl: DataLoader,
+) -> tuple[Union[RandomForestClassifier, None], str]:
+    """
+    Returns the model selected in the sidebar and the key for the files computed from
+    it, which includes the fingerprint of the model file.
+    Without a selected model, or if the model does not fit the dataset, the forest is
+    trained in the app and the dataset key is returned unchanged.
+    """
+    model_choice = st.session_state.get("model_choice", TRAIN_IN_APP)
+    if model_choice == TRAIN_IN_APP:
+        return None, dl.dataset_key
+    try:
+        with st.spinner(f"Loading {model_choice}"):
+            model, model_fingerprint = load_model(model_choice)
+        validate_features(model, dl.features)
+        class_indices(model, dl.data[dl.target_column].values, dl.target_names)
+    except ValueError as error:
+        st.sidebar.error(f"{model_choice} can't be used: {error}")
+        st.session_state["model_choice"] = TRAIN_IN_APP
+        return None, dl.dataset_key
+    return model, f"{dl.dataset_key}_{model_fingerprint}"
+
+
+def load_custom_dataset() -> Union[IngestedDataset, None]:
+    """
+    Returns the dataset uploaded in the sidebar, or None if there is none.
+    Every file content is only ingested once, the result is kept by the memory manager
+    under its fingerprint.
+    If it is selected with a continuous target column, the error is shown and the
+    default dataset is analyzed instead.
+    """
+    upload = st.session_state.get("dataset_upload")
+    if upload is None:
+        return None
+    # Fingerprinting is cheap, but still not repeated for the same upload
+    upload_id, fingerprint = st.session_state.get(
+        "dataset_upload_fingerprint", (None, None)
+    )
+    if upload_id != upload.id:
+        fingerprint = file_fingerprint(upload)
+        st.session_state["dataset_upload_fingerprint"] = (upload.id, fingerprint)
+
+    memory_manager = get_memory_manager()
+    cache_key = ("ingested_dataset", fingerprint)
+    custom_dataset = memory_manager.get(cache_key)
+    record_cache(custom_dataset is not None)
+    if custom_dataset is None:
+        try:
+            with st.spinner(f"Reading {upload.name}"):
+                custom_dataset = ingest_dataset(
+                    upload, upload.name, fingerprint=fingerprint
+                )
+        except (ValueError, pd.errors.ParserError) as error:
+            st.sidebar.error(f"{upload.name} could not be read: {error}")
+            return None
+        memory_manager.put(cache_key, custom_dataset, get_session_id())
+
+    # The last column is the default target, like in most tabular datasets
+    if st.session_state.get("custom_target_column") not in custom_dataset.frame.columns:
+        st.session_state["custom_target_column"] = custom_dataset.frame.columns[-1]
+    if st.session_state.get("data_choice") == CUSTOM_DATASET:
+        try:
+            custom_dataset.check_target(st.session_state["custom_target_column"])
+        except ValueError as error:
+            # The dataset stays selectable, so that another target can be chosen
+            st.sidebar.error(f"{upload.name} can't be analyzed: {error}")
+            st.session_state["data_choice"] = "Iris"
+    return custom_dataset
+
+
 if __name__ == "__main__":
     try:
         mp.set_start_method("spawn")
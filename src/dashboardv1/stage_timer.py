@@ -0,0 +1,155 @@
+"""
+time measures the wall and CPU time of the pipeline stages.
+logging and json emit every finished stage as a structured log record.
+threading keeps the stages of concurrent sessions apart, as Streamlit runs every
+session in a thread of its own.
+This module does not depend on streamlit, the dashboard keeps the recorded reruns in
+its session state.
+"""
+import functools
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, Union
+
+# Reruns kept for the developer metrics panel
+STAGE_HISTORY_LENGTH = 10
+
+logger = logging.getLogger("randfew.stages")
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+class StageRecord:
+    """
+    Measurements of one stage: wall and CPU time in milliseconds, the start relative to
+    the start of the rerun, whether its result came from a cache and how many items
+    (trees, pairs, clusters, charts, ...) it processed.
+    CPU time is the time of the calling thread, work done by pool processes or native
+    threads is only contained in the wall time.
+    """
+
+    def __init__(self, stage: str, rerun: int, start_ms: float):
+        self.stage = stage
+        self.rerun = rerun
+        self.start_ms = start_ms
+        self.wall_ms = 0.0
+        self.cpu_ms = 0.0
+        self.cache: Union[str, None] = None
+        self.items: Union[int, None] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "rerun": self.rerun,
+            "stage": self.stage,
+            "start_ms": round(self.start_ms, 3),
+            "wall_ms": round(self.wall_ms, 3),
+            "cpu_ms": round(self.cpu_ms, 3),
+            "cache": self.cache,
+            "items": self.items,
+        }
+
+
+class RerunRecorder:
+    """
+    Collects the stage records of one rerun.
+    """
+
+    def __init__(self, rerun: int):
+        self.rerun = rerun
+        self.start = time.perf_counter()
+        self.records: list[StageRecord] = []
+        self.active: list[StageRecord] = []
+
+    @contextmanager
+    def stage(self, name: str, items: int = None) -> Iterator[StageRecord]:  # type: ignore
+        record = StageRecord(name, self.rerun, (time.perf_counter() - self.start) * 1e3)
+        record.items = items
+        self.active.append(record)
+        wall_start, cpu_start = time.perf_counter(), time.thread_time()
+        try:
+            yield record
+        finally:
+            record.wall_ms = (time.perf_counter() - wall_start) * 1e3
+            record.cpu_ms = (time.thread_time() - cpu_start) * 1e3
+            self.active.remove(record)
+            self.records.append(record)
+            logger.info(json.dumps(record.to_dict()))
+
+
+_local = threading.local()
+
+
+def start_rerun(rerun: int) -> RerunRecorder:
+    """
+    Starts recording the stages of a rerun in the current thread.
+    """
+    _local.recorder = RerunRecorder(rerun)
+    return _local.recorder
+
+
+def finish_rerun() -> list[dict]:
+    """
+    Stops recording and returns the records of the rerun.
+    """
+    recorder = getattr(_local, "recorder", None)
+    _local.recorder = None
+    return [] if recorder is None else [record.to_dict() for record in recorder.records]
+
+
+@contextmanager
+def stage(name: str, items: int = None) -> Iterator[StageRecord]:  # type: ignore
+    """
+    Times the enclosed block as a stage of the current rerun. Outside of a rerun,
+    e.g. in benchmarks, a recorder for a single stage is used, so that the stage is
+    still logged.
+    """
+    recorder = getattr(_local, "recorder", None) or RerunRecorder(-1)
+    with recorder.stage(name, items) as record:
+        yield record
+
+
+def timed_stage(name: str) -> Callable:
+    """
+    Decorator, that times every call of the function as a stage.
+    """
+
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def record_cache(hit: bool):
+    """
+    Marks, whether the innermost running stage took its result from a cache.
+    A miss is kept, even if later lookups of the same stage hit.
+    """
+    recorder = getattr(_local, "recorder", None)
+    if recorder is None or not recorder.active:
+        return
+    record = recorder.active[-1]
+    if not hit:
+        record.cache = "miss"
+    elif record.cache is None:
+        record.cache = "hit"
+
+
+def record_items(items: int):
+    """
+    Sets the number of items processed by the innermost running stage.
+    """
+    recorder = getattr(_local, "recorder", None)
+    if recorder is not None and recorder.active:
+        recorder.active[-1].items = items
@@ -0,0 +1,7 @@
+"""
+The dashboard modules import each other by their bare names, like streamlit runs them.
+"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,46 @@
+import networkx as nx
+import numpy as np
+from scipy.spatial.distance import squareform
+
+from anytime_distance import AnytimeDistanceMatrix
+from condensed_distance import CondensedDistanceMatrix
+from worker_pool import WorkerPool
+
+
+def tree(features: list[int], classes: list[int]) -> nx.DiGraph:
+    graph = nx.DiGraph()
+    for node, feature in enumerate(features):
+        graph.add_node(str(node), label=f"x{feature} <= 0.5\\gini\\samples\\value")
+        if node:
+            graph.add_edge(str((node - 1) // 2), str(node))
+    for leaf, value in enumerate(classes, start=len(features)):
+        graph.add_node(
+            str(leaf), label=f"gini\\samples\\value = [{1 - value}, {value}]"
+        )
+        graph.add_edge(str((leaf - 1) // 2), str(leaf))
+    return graph
+
+
+def test_snapshot_is_condensed_and_pinned(tmp_path):
+    graphs = [
+        tree([0], [0, 1]),
+        tree([1], [1, 0]),
+        tree([0, 1, 2], [0, 1, 1, 0]),
+        tree([2, 0, 0], [1, 1, 0, 0]),
+    ]
+    # The pool is not started, as the refinement is not
+    matrix = AnytimeDistanceMatrix(tmp_path / "matrix.npy", graphs, pool=WorkerPool(1))
+    version, snapshot = matrix.snapshot()
+    assert isinstance(snapshot, CondensedDistanceMatrix)
+    square = squareform(matrix.lower)
+    scale = square.max(axis=0)
+    scale[scale == 0] = 1
+    assert np.allclose(np.asarray(snapshot), square / scale)
+
+    matrix.distances[:] = matrix.lower + 1
+    matrix.version += 1
+    assert matrix.snapshot() == (version, snapshot)
+    refreshed_version, refreshed = matrix.snapshot(refresh=True)
+    assert refreshed_version == version + 1
+    assert np.allclose(refreshed.values, matrix.lower + 1)
+    assert matrix.snapshot() == (refreshed_version, refreshed)
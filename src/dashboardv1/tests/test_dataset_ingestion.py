@@ -0,0 +1,47 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+from dataset_ingestion import ingest_dataset
+
+
+def ingest_csv(text: str):
+    return ingest_dataset(io.BytesIO(text.encode()), "upload.csv", fingerprint="test")
+
+
+def test_column_without_values_is_dropped():
+    with pytest.warns(UserWarning, match="Column 'b' has no values"):
+        dataset = ingest_csv("a,b,y\n1,,0\n2,,1\n3,,0\n4,,1\n")
+    assert list(dataset.frame.columns) == ["a", "y"]
+    assert not dataset.frame.isna().any().any()
+    features = dataset.features("y")
+    RandomForestClassifier(n_estimators=2).fit(
+        dataset.frame[features].values, dataset.frame["y"].values
+    )
+
+
+def test_text_column_without_values_is_dropped():
+    parquet = io.BytesIO()
+    pd.DataFrame(
+        {"a": [1, 2], "b": pd.Series([None, None], dtype=object), "y": ["x", "z"]}
+    ).to_parquet(parquet)
+    with pytest.warns(UserWarning, match="Column 'b' has no values"):
+        dataset = ingest_dataset(parquet, "upload.parquet", fingerprint="test")
+    assert "b" not in dataset.frame.columns
+    assert dataset.categories == {"y": ["x", "z"]}
+
+
+def test_continuous_target_is_rejected():
+    dataset = ingest_csv("a,y\n1,0.5\n2,1.25\n3,2.75\n")
+    assert dataset.frame["y"].dtype == np.float32
+    with pytest.raises(ValueError, match="continuous values"):
+        dataset.check_target("y")
+
+
+def test_discrete_targets_are_accepted():
+    dataset = ingest_csv("y,z,w\n0,cat,1.0\n1,dog,2.0\n")
+    for target_column in ("y", "z", "w"):
+        dataset.check_target(target_column)
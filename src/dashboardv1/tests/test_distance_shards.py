@@ -0,0 +1,27 @@
+import threading
+
+import networkx as nx
+
+from distance_shards import DistanceJob
+
+
+def test_concurrent_creation_writes_one_valid_definition(tmp_path):
+    graphs = [nx.gn_graph(300, seed=seed) for seed in range(40)]
+    errors = []
+
+    def create(shard_pairs: int):
+        try:
+            DistanceJob.create(tmp_path / "matrix.npy", graphs, shard_pairs)
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=create, args=(pairs,)) for pairs in range(1, 9)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    job = DistanceJob(tmp_path / "matrix.npy")
+    assert job.n_trees == len(graphs)
+    assert job.shard_pairs in range(1, 9)
+    assert sorted(path.name for path in job.directory.iterdir()) == ["job.pickle"]
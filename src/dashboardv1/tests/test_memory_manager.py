@@ -0,0 +1,97 @@
+import gc
+import weakref
+
+import numpy as np
+
+from memory_manager import MemoryManager
+
+MB = 1024**2
+
+
+class Session:
+    """
+    Holds artifacts like a DashboardController, whose widget callbacks keep it alive.
+    """
+
+    def __init__(self, size_mb: int):
+        self.distance_matrix = np.ones(size_mb * MB, dtype=np.uint8)
+
+    def artifacts(self) -> dict:
+        return {"distance_matrix": self.distance_matrix}
+
+    def release_artifacts(self):
+        self.distance_matrix = None
+
+
+def record(memory_manager: MemoryManager, session_id: str, session: Session):
+    memory_manager.record_session(
+        session_id, session.artifacts(), session.release_artifacts
+    )
+
+
+def test_over_budget_releases_least_recently_seen_session():
+    memory_manager = MemoryManager(5 * MB)
+    first, second, third = Session(2), Session(2), Session(2)
+    released = weakref.ref(first.distance_matrix)
+    record(memory_manager, "first", first)
+    record(memory_manager, "second", second)
+    assert memory_manager.summary()["releases"] == 0
+
+    record(memory_manager, "third", third)
+    gc.collect()
+    assert released() is None
+    assert first.distance_matrix is None
+    assert second.distance_matrix is not None
+    assert third.distance_matrix is not None
+    summary = memory_manager.summary()
+    assert summary["releases"] == 1
+    assert summary["sessions"] == 2
+
+
+def test_current_session_is_not_released():
+    memory_manager = MemoryManager(1 * MB)
+    session = Session(2)
+    record(memory_manager, "only", session)
+    assert session.distance_matrix is not None
+    assert memory_manager.summary()["releases"] == 0
+
+
+def test_cached_artifacts_count_once():
+    memory_manager = MemoryManager(5 * MB)
+    shared = memory_manager.put(("distance_matrix", 1), np.ones(2 * MB, np.uint8))
+    sessions = [Session(0) for _ in range(3)]
+    for index, session in enumerate(sessions):
+        session.distance_matrix = shared
+        record(memory_manager, str(index), session)
+    assert memory_manager.summary()["releases"] == 0
+    assert all(session.distance_matrix is shared for session in sessions)
+
+
+def test_cache_eviction_releases_sessions_holding_the_entry():
+    memory_manager = MemoryManager(5 * MB)
+    session = Session(0)
+    session.distance_matrix = memory_manager.put(
+        ("distance_matrix", 1), np.ones(3 * MB, np.uint8)
+    )
+    released = weakref.ref(session.distance_matrix)
+    record(memory_manager, "idle", session)
+    # Evicts the entry, which the idle session still holds
+    memory_manager.put(("distance_matrix", 2), np.ones(3 * MB, np.uint8), "active")
+    gc.collect()
+    assert released() is None
+    assert memory_manager.summary()["releases"] == 1
+
+
+def test_discard_removes_matching_entries():
+    memory_manager = MemoryManager(5 * MB)
+    for version in range(3):
+        memory_manager.put(("nearest_trees", f"job@{version}"), np.ones(MB, np.uint8))
+    memory_manager.put(("nearest_trees", "other"), np.ones(MB, np.uint8))
+    assert memory_manager.discard(lambda key: key[1] in ("job@0", "job@1")) == 2
+    assert memory_manager.keys("nearest_trees") == [
+        ("nearest_trees", "job@2"),
+        ("nearest_trees", "other"),
+    ]
+    assert memory_manager.used_bytes == sum(
+        entry["size"] for entry in memory_manager._entries.values()
+    )
@@ -0,0 +1,50 @@
+import os
+import time
+
+from profiling import (
+    STALE_WORKER_SECONDS,
+    ProfileCapture,
+    profile_worker,
+    recent_captures,
+)
+from stage_timer import RerunRecorder
+
+
+def work():
+    return sum(range(200000))
+
+
+def test_late_worker_samples_are_added_to_the_capture(tmp_path):
+    capture = ProfileCapture(tmp_path, "capture", RerunRecorder(0)).start()
+    with profile_worker(capture.directory, "shard_00000"):
+        work()
+    capture.stop([])
+    # A shard, that was still running when the rerun ended
+    with profile_worker(capture.directory, "shard_00001"):
+        time.sleep(0.1)
+        work()
+    assert list(capture.directory.glob("worker_*.json"))
+
+    (report,) = recent_captures(tmp_path)
+    assert report["worker_peak_rss_mb"] > 0
+    assert not list(capture.directory.glob("worker_*.json"))
+    folded = capture.directory.joinpath("profile.folded").read_text()
+    assert "GED worker;" in folded
+    assert (
+        recent_captures(tmp_path)[0]["worker_peak_rss_mb"]
+        == report["worker_peak_rss_mb"]
+    )
+
+
+def test_stale_worker_samples_are_removed(tmp_path):
+    directory = tmp_path.joinpath("crashed")
+    directory.mkdir()
+    with profile_worker(directory, "shard_00000"):
+        work()
+    with profile_worker(directory, "shard_00001"):
+        work()
+    stale, recent = sorted(directory.glob("worker_*.json"))
+    stale_time = time.time() - STALE_WORKER_SECONDS - 1
+    os.utime(stale, (stale_time, stale_time))
+    assert recent_captures(tmp_path) == []
+    assert list(directory.glob("worker_*.json")) == [recent]
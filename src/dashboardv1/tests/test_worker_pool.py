@@ -0,0 +1,34 @@
+import time
+
+from worker_pool import HEALTH_CHECK_TIMEOUT, WorkerPool
+
+
+def wait_for_health(pool: WorkerPool, healthy: bool, timeout: float = 60) -> float:
+    """
+    Polls the health status like the admin view, and returns the longest call.
+    """
+    longest = 0.0
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        started = time.time()
+        status = pool.health_status()[0]
+        longest = max(longest, time.time() - started)
+        if status is healthy:
+            return longest
+        time.sleep(0.1)
+    raise AssertionError(f"The pool did not become {healthy} in {timeout} s")
+
+
+def test_health_status_does_not_wait_for_busy_workers():
+    pool = WorkerPool(1)
+    try:
+        assert pool.health_status()[0] is None
+        wait_for_health(pool, True)
+        busy = pool.executor().submit(time.sleep, 3 * HEALTH_CHECK_TIMEOUT)
+        while not busy.running():
+            time.sleep(0.01)
+        assert wait_for_health(pool, False) < 0.5
+        busy.result()
+        wait_for_health(pool, True)
+    finally:
+        pool.shutdown()
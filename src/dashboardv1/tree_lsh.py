@@ -0,0 +1,289 @@
+"""
+numpy turns every tree into a set of split path shingles, MinHashes the sets and finds
+candidate neighbors with locality sensitive hashing on the signatures.
+scipy holds the exact Jaccard distances of the candidates as a sparse neighbor graph.
+sklearn's DBSCAN clusters the graph and scipy's sparse eigensolver embeds it.
+Only candidates are compared, so the cost grows about linearly with the number of
+trees, instead of quadratically like a full distance matrix.
+This module does not depend on streamlit.
+"""
+import warnings
+
+import numpy as np
+import numpy.typing as npt
+from scipy import sparse
+from scipy.sparse.linalg import eigsh
+from sklearn.cluster import DBSCAN
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.exceptions import EfficiencyWarning
+
+from embedding_backends import fix_signs
+
+# Hash functions of every MinHash signature
+MINHASH_PERMUTATIONS = 64
+# Bands of the LSH, each made of MINHASH_PERMUTATIONS / LSH_BANDS hash functions.
+# Trees agreeing on all hash functions of at least one band become candidates.
+LSH_BANDS = 32
+# Trees of the same bucket are only compared with the next LSH_WINDOW - 1 trees of the
+# bucket, so that huge buckets of near identical trees stay linear
+LSH_WINDOW = 50
+# Nearest candidates kept for every tree
+NEIGHBORS = 15
+# Candidate pairs, whose shingles are intersected at once
+PAIR_CHUNK = 100_000
+SEED = 123
+
+# Constants of the splitmix64 finalizer, see mix()
+_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+_C1 = np.uint64(0xBF58476D1CE4E5B9)
+_C2 = np.uint64(0x94D049BB133111EB)
+# Added to the class of a leaf, so that leaf tokens never equal a feature id
+_LEAF_TOKEN = np.uint64(1 << 32)
+
+
+def mix(
+    values: npt.NDArray[np.uint64], salt: np.uint64 = np.uint64(0)
+) -> npt.NDArray[np.uint64]:
+    """
+    Hashes values combined with salt, element wise, with the splitmix64 finalizer.
+    salt is a single value or an array of the same shape.
+    """
+    hashes = (values ^ salt) + _GAMMA
+    hashes = (hashes ^ (hashes >> np.uint64(30))) * _C1
+    hashes = (hashes ^ (hashes >> np.uint64(27))) * _C2
+    return hashes ^ (hashes >> np.uint64(31))
+
+
+def tree_shingles(estimator) -> npt.NDArray[np.uint64]:
+    """
+    Hashes of the split paths of a fitted sklearn tree. Every node contributes the
+    sequence of feature ids from the root to the node, leaves end the sequence with
+    their majority class instead of a feature.
+    The paths are hashed level by level, each from the hash of its parent.
+    """
+    tree = estimator.tree_
+    is_leaf = tree.children_left < 0
+    tokens = np.where(
+        is_leaf,
+        _LEAF_TOKEN + tree.value[:, 0, :].argmax(axis=1).astype(np.uint64),
+        tree.feature.astype(np.uint64),
+    )
+    parent_hashes = np.zeros(tree.node_count, dtype=np.uint64)
+    shingles = np.zeros(tree.node_count, dtype=np.uint64)
+    level = np.array([0])
+    while len(level):
+        shingles[level] = mix(parent_hashes[level], mix(tokens[level]))
+        splits = level[~is_leaf[level]]
+        for children in (tree.children_left[splits], tree.children_right[splits]):
+            parent_hashes[children] = shingles[splits]
+        level = np.concatenate(
+            [tree.children_left[splits], tree.children_right[splits]]
+        )
+    return np.unique(shingles)
+
+
+def forest_shingles(
+    model: RandomForestClassifier,
+) -> tuple[npt.NDArray[np.int64], npt.NDArray[np.uint64]]:
+    """
+    Shingles of all trees, concatenated. The shingles of tree i are
+    shingles[indptr[i]:indptr[i + 1]].
+    """
+    tree_sets = [tree_shingles(estimator) for estimator in model.estimators_]
+    indptr = np.concatenate([[0], np.cumsum([len(shingles) for shingles in tree_sets])])
+    return indptr, np.concatenate(tree_sets)
+
+
+def minhash_signatures(
+    indptr: npt.NDArray[np.int64],
+    shingles: npt.NDArray[np.uint64],
+    n_permutations: int = MINHASH_PERMUTATIONS,
+) -> npt.NDArray[np.uint64]:
+    """
+    MinHash signature of every tree, of shape (n_trees, n_permutations). Two trees
+    agree on a hash function with the probability of the Jaccard similarity of their
+    shingles.
+    """
+    salts = mix(np.arange(n_permutations, dtype=np.uint64), np.uint64(SEED))
+    signatures = np.empty((len(indptr) - 1, n_permutations), dtype=np.uint64)
+    for permutation, salt in enumerate(salts):
+        signatures[:, permutation] = np.minimum.reduceat(
+            mix(shingles, salt), indptr[:-1]
+        )
+    return signatures
+
+
+def lsh_candidates(
+    signatures: npt.NDArray[np.uint64],
+    bands: int = LSH_BANDS,
+    window: int = LSH_WINDOW,
+) -> npt.NDArray[np.int64]:
+    """
+    Pairs of trees (i < j), that share the bucket of at least one band, of shape
+    (n_pairs, 2). The trees are sorted by their bucket in every band, so that the
+    members of a bucket are compared by shifting the sorted trees against each other.
+    """
+    n_trees, n_permutations = signatures.shape
+    rows = n_permutations // bands
+    pair_codes = []
+    for band in range(bands):
+        buckets = signatures[:, band * rows]
+        for column in range(band * rows + 1, (band + 1) * rows):
+            buckets = mix(buckets, signatures[:, column])
+        order = np.argsort(buckets, kind="stable")
+        sorted_buckets = buckets[order]
+        for offset in range(1, window):
+            same = np.flatnonzero(sorted_buckets[offset:] == sorted_buckets[:-offset])
+            if len(same) == 0:
+                break
+            first, second = order[same], order[same + offset]
+            pair_codes.append(
+                np.minimum(first, second) * n_trees + np.maximum(first, second)
+            )
+    if not pair_codes:
+        return np.empty((0, 2), dtype=np.int64)
+    codes = np.unique(np.concatenate(pair_codes))
+    return np.stack([codes // n_trees, codes % n_trees], axis=1)
+
+
+def pair_distances(
+    shingle_matrix: sparse.csr_matrix, pairs: npt.NDArray[np.int64]
+) -> npt.NDArray[np.float32]:
+    """
+    Exact Jaccard distances of the shingles of the pairs of trees. shingle_matrix has a
+    row per tree and a column per distinct shingle.
+    """
+    sizes = np.diff(shingle_matrix.indptr)
+    distances = np.empty(len(pairs), dtype=np.float32)
+    for start in range(0, len(pairs), PAIR_CHUNK):
+        first, second = pairs[start : start + PAIR_CHUNK].T
+        both = shingle_matrix[first].multiply(shingle_matrix[second])
+        intersection = np.asarray(both.sum(axis=1)).ravel()
+        union = sizes[first] + sizes[second] - intersection
+        distances[start : start + PAIR_CHUNK] = 1 - intersection / union
+    return distances
+
+
+def nearest_neighbors(
+    pairs: npt.NDArray[np.int64],
+    distances: npt.NDArray[np.float32],
+    n_trees: int,
+    neighbors: int = NEIGHBORS,
+) -> sparse.csr_matrix:
+    """
+    Symmetric sparse distance matrix, that keeps the neighbors nearest candidates of
+    every tree. An edge is kept, if it is among the nearest of either of its trees.
+    Distances of 0, of identical trees and of every tree to itself, are stored
+    explicitly.
+    """
+    rows = np.concatenate([pairs[:, 0], pairs[:, 1]])
+    columns = np.concatenate([pairs[:, 1], pairs[:, 0]])
+    both_distances = np.concatenate([distances, distances])
+    order = np.lexsort((both_distances, rows))
+    rows, columns, both_distances = rows[order], columns[order], both_distances[order]
+    # Rank of every candidate among the candidates of its tree
+    kept = np.arange(len(rows)) - np.searchsorted(rows, rows) < neighbors
+    codes, first_index = np.unique(
+        np.minimum(rows[kept], columns[kept]) * n_trees
+        + np.maximum(rows[kept], columns[kept]),
+        return_index=True,
+    )
+    first, second = codes // n_trees, codes % n_trees
+    kept_distances = both_distances[kept][first_index]
+    # Every tree is its own neighbor, which DBSCAN counts towards min_samples
+    trees = np.arange(n_trees)
+    rows = np.concatenate([trees, first, second])
+    columns = np.concatenate([trees, second, first])
+    both_distances = np.concatenate(
+        [np.zeros(n_trees, dtype=np.float32), kept_distances, kept_distances]
+    )
+    return sparse.csr_matrix(
+        (both_distances, (rows, columns)), shape=(n_trees, n_trees)
+    )
+
+
+class NeighborGraph:
+    """
+    Sparse distance graph of a forest, which replaces the full distance matrix for very
+    large forests. Every tree is connected with its NEIGHBORS nearest LSH candidates,
+    the distance being the exact Jaccard distance of their shingles. Trees without
+    candidates are isolated.
+    Indexing rows returns the exact distances of these trees to all trees, calculated
+    on demand, so the graph can be sampled like a distance matrix.
+    """
+
+    def __init__(self, shingle_matrix: sparse.csr_matrix, distances: sparse.csr_matrix):
+        self.shingle_matrix = shingle_matrix
+        self.distances = distances
+
+    @classmethod
+    def from_forest(
+        cls, model: RandomForestClassifier, neighbors: int = NEIGHBORS
+    ) -> "NeighborGraph":
+        indptr, shingles = forest_shingles(model)
+        _, columns = np.unique(shingles, return_inverse=True)
+        shingle_matrix = sparse.csr_matrix(
+            (np.ones(len(shingles), dtype=np.float32), columns, indptr)
+        )
+        pairs = lsh_candidates(minhash_signatures(indptr, shingles))
+        distances = nearest_neighbors(
+            pairs, pair_distances(shingle_matrix, pairs), len(indptr) - 1, neighbors
+        )
+        return cls(shingle_matrix, distances)
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self.distances.shape
+
+    @property
+    def n_edges(self) -> int:
+        """
+        Number of edges of the graph.
+        """
+        return (self.distances.nnz - self.shape[0]) // 2
+
+    def __getitem__(self, index) -> npt.NDArray[np.float32]:
+        rows = np.atleast_1d(np.arange(self.shape[0])[index])
+        intersection = (self.shingle_matrix[rows] @ self.shingle_matrix.T).toarray()
+        sizes = np.diff(self.shingle_matrix.indptr)
+        union = sizes[rows][:, np.newaxis] + sizes - intersection
+        return (1 - intersection / union).astype(np.float32)
+
+    def memory_footprint(self) -> int:
+        return sum(
+            matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+            for matrix in (self.shingle_matrix, self.distances)
+        )
+
+    def dbscan_labels(self, eps: float, min_samples: int) -> npt.NDArray[np.intp]:
+        """
+        DBSCAN on the graph. Only neighbors within the graph count towards the
+        min_samples of a core tree, so min_samples should stay below NEIGHBORS.
+        """
+        with warnings.catch_warnings():
+            # sklearn sorts the rows of the graph by distance, which is expected
+            warnings.simplefilter("ignore", EfficiencyWarning)
+            return DBSCAN(
+                eps=eps, min_samples=min_samples, metric="precomputed"
+            ).fit_predict(self.distances)
+
+    def spectral_embedding(self) -> npt.NDArray[np.float32]:
+        """
+        Laplacian eigenmaps on a gaussian affinity of the neighbor distances, like the
+        dense SpectralBackend, with the kernel width being the median neighbor distance.
+        """
+        positive = self.distances.data[self.distances.data > 0]
+        width = np.median(positive) if len(positive) else 1
+        affinity = self.distances.copy()
+        affinity.data = np.exp(-(affinity.data**2) / (2 * width**2))
+        degree_root = np.sqrt(np.asarray(affinity.sum(axis=1)).ravel())
+        scaling = sparse.diags(1 / degree_root)
+        normalized_affinity = scaling @ affinity @ scaling
+        start = np.random.default_rng(SEED).random(self.shape[0])
+        eigenvalues, eigenvectors = eigsh(
+            normalized_affinity, k=3, which="LA", v0=start
+        )
+        # The first eigenvector is trivial and skipped
+        eigenvectors = eigenvectors[:, np.argsort(eigenvalues)[::-1]]
+        coordinates = eigenvectors[:, 1:3] / degree_root[:, np.newaxis]
+        return fix_signs(coordinates).astype(np.float32)
@@ -0,0 +1,56 @@
+"""
+sklearn exports a single tree in the dot language, which pygraphviz lays out and renders
+as SVG.
+The shared cache keeps every rendered tree on disk, keyed by the content hash of the
+tree from the memory manager, so every tree is rendered once by any session or replica,
+and only when it is shown.
+stage_timer records, whether the diagram was rendered or taken from the cache.
+"""
+import pygraphviz as pgv
+from sklearn import tree
+from sklearn.tree import DecisionTreeClassifier
+
+from memory_manager import tree_fingerprint
+from shared_cache import get_shared_cache
+from stage_timer import record_cache
+
+
+def render_tree_svg(
+    estimator: DecisionTreeClassifier,
+    features: list[str],
+    class_names: list[str],
+) -> str:
+    """
+    Renders the diagram of a fitted tree, with its nodes colored by their majority class.
+    """
+    dot_string = tree.export_graphviz(
+        estimator,
+        feature_names=features,
+        class_names=class_names,
+        filled=True,
+        rounded=True,
+    )
+    return pgv.AGraph(dot_string).draw(format="svg", prog="dot").decode("utf-8")
+
+
+def get_tree_svg(
+    estimator: DecisionTreeClassifier,
+    features: list[str],
+    class_names: list[str],
+) -> str:
+    """
+    Returns the SVG diagram of the tree, which is rendered on the first request only.
+    The feature and class names are part of the key, as they are part of the diagram.
+    """
+    shared_cache = get_shared_cache()
+    cache_key = (tree_fingerprint(estimator), tuple(features), tuple(class_names))
+    svg = shared_cache.get("tree_svg", cache_key)
+    record_cache(svg is not None)
+    if svg is None:
+        # Another process may be rendering the same tree already
+        svg = shared_cache.get_or_compute(
+            "tree_svg",
+            cache_key,
+            lambda: render_tree_svg(estimator, features, class_names),
+        )
+    return svg
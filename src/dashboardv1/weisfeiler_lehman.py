@@ -0,0 +1,89 @@
+"""
+networkx provides the trees of the extraction stage, whose nodes are relabeled with the
+Weisfeiler-Lehman scheme: every iteration combines the label of a node with the labels
+of its children, so the labels describe ever deeper subtrees.
+scipy counts the labels of every tree in a sparse matrix, from which the L1 distances of
+all pairs of trees follow in one sparse matrix product.
+graph_edit_distance provides the node labels, so both metrics compare the same parts
+of a node. This module does not depend on streamlit.
+"""
+import networkx as nx
+import numpy as np
+import numpy.typing as npt
+from scipy import sparse
+
+from graph_edit_distance import node_label
+
+# Relabeling iterations, the labels of the last one describe subtrees of this depth
+WL_ITERATIONS = 3
+
+
+def wl_feature_matrix(
+    graphs: list[nx.DiGraph], iterations: int = WL_ITERATIONS
+) -> sparse.csr_matrix:
+    """
+    Matrix of shape (n_trees, n_labels), which counts how often each label occurs in
+    each tree, over all iterations. The labels of iteration 0 are the split feature of
+    internal nodes and the majority class of leaves. The children of a node are
+    unordered, like in the graph edit distance.
+    """
+    labels: dict[tuple, int] = {}
+    rows, columns = [], []
+    for tree, graph in enumerate(graphs):
+        node_labels = {
+            node: labels.setdefault((0, node_label(graph.nodes[node])), len(labels))
+            for node in graph
+        }
+        for iteration in range(1, iterations + 1):
+            columns.extend(node_labels.values())
+            node_labels = {
+                node: labels.setdefault(
+                    (
+                        iteration,
+                        node_labels[node],
+                        *sorted(node_labels[child] for child in graph.successors(node)),
+                    ),
+                    len(labels),
+                )
+                for node in graph
+            }
+        columns.extend(node_labels.values())
+        rows.extend([tree] * (iterations + 1) * len(graph))
+    # Repeated entries of the same tree and label are summed up to counts
+    return sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.float32), (rows, columns)),
+        shape=(len(graphs), len(labels)),
+    )
+
+
+def wl_l1_distances(features: sparse.csr_matrix) -> npt.NDArray[np.float32]:
+    """
+    L1 distances between the label counts of all pairs of trees, divided by the
+    largest one, so that they lie in [0, 1] like the normalized graph edit distance.
+    The L1 distance of two count vectors is |x| + |y| - 2 * sum(min(x, y)). The sum of
+    the minima is the product of their unary encodings, which have a column for every
+    occurrence of a label, so all pairs are calculated in one sparse matrix product.
+    Unlike the cosine distance, the L1 distance grows with the difference of the tree
+    sizes, like the graph edit distance does.
+    """
+    counts = features.data.astype(np.int64)
+    max_count = counts.max(initial=1)
+    trees = np.repeat(np.arange(features.shape[0]), np.diff(features.indptr))
+    occurrences = np.arange(counts.sum()) - np.repeat(
+        np.cumsum(counts) - counts, counts
+    )
+    unary = sparse.csr_matrix(
+        (
+            np.ones(len(occurrences), dtype=np.float32),
+            (
+                np.repeat(trees, counts),
+                np.repeat(features.indices, counts) * max_count + occurrences,
+            ),
+        ),
+        shape=(features.shape[0], features.shape[1] * max_count),
+    )
+    sizes = np.bincount(trees, weights=counts, minlength=features.shape[0])
+    distances = sizes[:, np.newaxis] + sizes - 2 * (unary @ unary.T).toarray()
+    np.fill_diagonal(distances, 0)
+    largest = distances.max()
+    return (distances / largest if largest > 0 else distances).astype(np.float32)
@@ -0,0 +1,164 @@
+"""
+concurrent.futures runs the graph edit distances in worker processes, which are started
+once and reused by every distance calculation of the process, instead of starting a
+pool for every calculation.
+multiprocessing provides the spawn start method, as forking the threads of streamlit
+is unsafe. threading guards the pool, which all sessions share.
+atexit shuts the workers down with the process.
+time dates the health checks, that run in the background.
+This module does not depend on streamlit, standalone distance workers use it as well.
+"""
+import atexit
+import multiprocessing as mp
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Iterable, Iterator, Union
+
+# Seconds a worker may take to answer a health check
+HEALTH_CHECK_TIMEOUT = 2.0
+# Restarts of a broken pool within one map_unordered call, before it gives up
+MAX_RESTARTS = 3
+
+
+def ping() -> int:
+    """
+    Task of the health check.
+    """
+    return os.getpid()
+
+
+class WorkerPool:
+    """
+    Long lived pool of worker processes, started on first use.
+    A worker, that dies, breaks the whole executor. The pool is then replaced by a new
+    one and the unfinished tasks are submitted again, which is safe for the distance
+    shards, as their locks of dead processes are recovered.
+    All methods are thread safe.
+    """
+
+    def __init__(self, processes: int = None):  # type: ignore
+        self.processes = processes or os.cpu_count() or 1
+        self.starts = 0
+        self._executor: Union[ProcessPoolExecutor, None] = None
+        self._lock = threading.Lock()
+        # Result and start time of the last finished health check, and the running one
+        self._health: tuple[Union[bool, None], float] = (None, 0.0)
+        self._health_check: Union[
+            tuple[Future, float, ProcessPoolExecutor], None
+        ] = None
+        self._health_lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._executor is not None
+
+    def executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    self.processes, mp_context=mp.get_context("spawn")
+                )
+                self.starts += 1
+            return self._executor
+
+    def restart(self, broken_executor: ProcessPoolExecutor):
+        """
+        Drops the broken executor, unless another thread replaced it already.
+        """
+        with self._lock:
+            if self._executor is broken_executor:
+                self._executor = None
+        broken_executor.shutdown(wait=False, cancel_futures=True)
+
+    def health_status(self) -> tuple[Union[bool, None], float]:
+        """
+        Whether a worker answered the last health check, None before the first one
+        answered, and the time the check was started. Never waits for the workers: the
+        check runs in the background and the next call picks up its answer and starts
+        the next one. A check, that is not answered within HEALTH_CHECK_TIMEOUT, counts
+        as not answering, until it is answered. A broken pool is restarted.
+        """
+        with self._health_lock:
+            if self._health_check is not None:
+                future, started, executor = self._health_check
+                if future.done():
+                    self._health_check = None
+                    if isinstance(future.exception(), BrokenProcessPool):
+                        self.restart(executor)
+                        self._health = (False, started)
+                    else:
+                        self._health = (True, started)
+                elif time.time() - started > HEALTH_CHECK_TIMEOUT:
+                    self._health = (False, started)
+            if self._health_check is None:
+                executor = self.executor()
+                try:
+                    future = executor.submit(ping)
+                except BrokenProcessPool:
+                    self.restart(executor)
+                    self._health = (False, time.time())
+                else:
+                    self._health_check = (future, time.time(), executor)
+            return self._health
+
+    def map_unordered(self, function: Callable, items: Iterable) -> Iterator[Any]:
+        """
+        Runs function on every item in the workers and yields the results in the order
+        they complete. function has to be importable by the workers.
+        """
+        pending = list(items)
+        restarts = 0
+        while pending:
+            executor = self.executor()
+            unfinished = {}
+            try:
+                for item in pending:
+                    unfinished[executor.submit(function, item)] = item
+                pending = []
+                while unfinished:
+                    done, _ = wait(unfinished, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        result = future.result()
+                        del unfinished[future]
+                        yield result
+            except BrokenProcessPool:
+                restarts += 1
+                if restarts > MAX_RESTARTS:
+                    raise
+                self.restart(executor)
+                # Nothing was yielded before all items were submitted, so the items,
+                # that were not submitted, follow the submitted ones in pending
+                pending = list(unfinished.values()) + pending[len(unfinished) :]
+            finally:
+                for future in unfinished:
+                    future.cancel()
+
+    def shutdown(self):
+        """
+        Waits for the running tasks and stops the workers. The next use starts new ones.
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+_worker_pool: Union[WorkerPool, None] = None
+_worker_pool_lock = threading.Lock()
+
+
+def get_worker_pool() -> WorkerPool:
+    """
+    The pool shared by all sessions of this process. Its size is read from
+    RANDFEW_GED_WORKERS and defaults to the number of CPUs.
+    """
+    global _worker_pool
+    with _worker_pool_lock:
+        if _worker_pool is None:
+            processes = os.environ.get("RANDFEW_GED_WORKERS")
+            _worker_pool = WorkerPool(int(processes) if processes else None)  # type: ignore
+            atexit.register(_worker_pool.shutdown)
+        return _worker_pool